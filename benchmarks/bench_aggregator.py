@@ -0,0 +1,98 @@
+"""
+Benchmark of the incremental aggregation of the engine batches, against the outer merge of the
+rollup with every new batch the engines used before.
+
+    python -m benchmarks.bench_aggregator [partitions [rows]]
+
+Every partition is a random batch of job host summary rows, 50k hosts over 7 organizations and
+13 job templates, aggregated as by the job host summary engine. It prints the time of both
+rollups of all the partitions and checks they are the same.
+"""
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from metrics_utility.automation_controller_billing.dataframe_engine.base import Aggregator
+from metrics_utility.automation_controller_billing.dataframe_engine.dataframe_jobhost_summary_usage \
+    import DataframeJobhostSummaryUsage
+
+HOSTS = 50_000
+
+
+def partial(engine, rows, rng):
+    hosts = rng.integers(0, HOSTS, rows)
+    created = pd.Timestamp("2024-01-01") + pd.to_timedelta(rng.integers(0, 30 * 86400, rows), unit="s")
+    host_names = pd.Series([f"host{host}" for host in hosts])
+    billing_data = pd.DataFrame({
+        "organization_name": "org" + pd.Series(hosts % 7).astype(str),
+        "job_template_name": "template" + pd.Series(hosts % 13).astype(str),
+        "host_name": host_names,
+        "original_host_name": host_names,
+        "install_uuid": "uuid",
+        "job_remote_id": rng.integers(0, 300, rows),
+        "task_runs": rng.integers(1, 50, rows),
+        "created": created,
+        "job_created": created,
+    })
+
+    billing_data_group = billing_data.groupby(engine.unique_index_columns(), dropna=False).agg(
+        task_runs=("task_runs", "sum"),
+        host_runs=("host_name", "count"),
+        first_automation=("created", "min"),
+        last_automation=("created", "max"),
+        job_created=("job_created", "max"),
+    )
+    return engine.cast_dataframe(billing_data_group, engine.cast_types())
+
+
+def outer_merge(engine, partials):
+    # The rollup as the engines built it before the Aggregator
+    rollup = None
+    for billing_data_group in partials:
+        if rollup is None:
+            rollup = billing_data_group
+            continue
+
+        rollup = pd.merge(rollup, billing_data_group, on=engine.unique_index_columns(), how="outer")
+        for column in engine.data_columns():
+            operation = engine.data_operations().get(column, "sum")
+            rollup[column] = getattr(rollup[[f"{column}_x", f"{column}_y"]], operation)(axis=1)
+            del rollup[f"{column}_x"]
+            del rollup[f"{column}_y"]
+        rollup = engine.cast_dataframe(rollup, engine.cast_types())
+
+    return rollup.reset_index()
+
+
+def aggregator(engine, partials):
+    rollup = Aggregator(engine.data_columns(), engine.data_operations())
+    for billing_data_group in partials:
+        rollup.add(billing_data_group)
+
+    return engine.cast_dataframe(rollup.result(), engine.cast_types()).reset_index()
+
+
+def main(partitions, rows):
+    rng = np.random.default_rng(0)
+    engine = DataframeJobhostSummaryUsage(extractor=None, month=None, extra_params={})
+    partials = [partial(engine, rows, rng) for _ in range(partitions)]
+    print(f"partitions={partitions} rows={partitions * rows} groups={sum(len(df) for df in partials)}")
+
+    start = time.time()
+    merged = outer_merge(engine, partials)
+    print(f"outer merge {time.time() - start:.1f}s")
+
+    start = time.time()
+    aggregated = aggregator(engine, partials)
+    print(f"aggregator  {time.time() - start:.1f}s")
+
+    columns = engine.unique_index_columns()
+    merged = merged.sort_values(columns, ignore_index=True)
+    aggregated = aggregated[merged.columns].sort_values(columns, ignore_index=True)
+    print(f"groups={len(aggregated)} same={merged.equals(aggregated)}")
+
+
+if __name__ == "__main__":
+    main(*([int(arg) for arg in sys.argv[1:3]] + [30, 100_000][len(sys.argv[1:3]):]))
@@ -0,0 +1,51 @@
+"""
+Benchmark of the parsing of the collection and role names of the main_jobevent rows, once per
+distinct value against once per row as the content usage engine parsed them before.
+
+    python -m benchmarks.bench_content_names [events [batch]]
+
+Events use 2003 modules and 503 roles, in categorical batches as parsed from the gathered CSVs.
+It prints the time of both parsings of all the batches and checks they give the same names.
+"""
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from metrics_utility.automation_controller_billing.dataframe_engine.dataframe_content_usage \
+    import DataframeContentUsage
+
+MODULES = np.array([f"ns{index % 40}.collection{index % 70}.module{index}" for index in range(2000)] +
+                   ["shell", "ping", "x.y"], dtype=object)
+ROLES = np.array([f"ns{index % 40}.collection{index % 70}.role{index}" for index in range(500)] +
+                 ["user.role", "plainrole", None], dtype=object)
+
+
+def main(events, batch):
+    rng = np.random.default_rng(1)
+    engine = DataframeContentUsage(extractor=None, month=None, extra_params={})
+
+    per_row = distinct = 0
+    same = True
+    for _ in range(events // batch):
+        task_action = pd.Series(MODULES[rng.integers(0, len(MODULES), batch)], dtype="category")
+        role = pd.Series(ROLES[rng.integers(0, len(ROLES), batch)], dtype="category")
+
+        start = time.time()
+        collections = task_action.astype(str).apply(DataframeContentUsage.extract_collection_name)
+        roles = role.astype(str).apply(DataframeContentUsage.extract_role_name)
+        per_row += time.time() - start
+
+        start = time.time()
+        distinct_collections = engine.map_distinct(task_action, DataframeContentUsage.extract_collection_name)
+        distinct_roles = engine.map_distinct(role, DataframeContentUsage.extract_role_name)
+        distinct += time.time() - start
+
+        same = same and collections.equals(distinct_collections) and roles.equals(distinct_roles)
+
+    print(f"events={events} per row {per_row:.1f}s distinct {distinct:.2f}s same={same}")
+
+
+if __name__ == "__main__":
+    main(*([int(arg) for arg in sys.argv[1:3]] + [10_000_000, 100_000][len(sys.argv[1:3]):]))
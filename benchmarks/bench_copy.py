@@ -0,0 +1,97 @@
+"""
+Benchmark of the psycopg3 COPY of a table into the split CSV files, the rows written as bytes by
+the BinaryCsvFileSplitter against the rows decoded into the text CsvFileSplitter before.
+
+    PGHOST=... PGPORT=... PGUSER=... PGDATABASE=... python -m benchmarks.bench_copy [rows [max_file_size]]
+
+It needs a PostgreSQL server, the connection is taken from the libpq environment variables. The
+rows, with quoted multiline fields, are created in a metrics_utility_benchmark schema, dropped
+afterwards. It prints the MB/s and the client CPU time of every path, the max file size in MB, and
+checks both paths write the same split files.
+"""
+import os
+import sys
+import tempfile
+import time
+
+import django
+from django.conf import settings
+
+from metrics_utility.automation_controller_billing.csv_file_splitter import BinaryCsvFileSplitter, CsvFileSplitter
+
+SCHEMA = "metrics_utility_benchmark"
+QUERY = f"COPY (SELECT * FROM {SCHEMA}.main_jobevent ORDER BY id) TO STDOUT WITH CSV HEADER"
+
+
+def create_table(cursor, rows):
+    cursor.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+    cursor.execute(f"CREATE SCHEMA {SCHEMA}")
+    cursor.execute(f"CREATE TABLE {SCHEMA}.main_jobevent (id int PRIMARY KEY, created timestamptz, "
+                   f"host_name text, task text, stdout text, event_data text)")
+    cursor.execute(f"INSERT INTO {SCHEMA}.main_jobevent "
+                   f"SELECT row, now() - row * interval '1 second', 'host' || (row % 5000) || '.example.com', "
+                   f"'Task \"' || (row % 300) || '\", with a comma', "
+                   f"'ok: [host' || (row % 5000) || ']\n' || repeat('changed line, \"quoted\"\n', row % 4), "
+                   f"'{{\"task_action\": \"namespace.collection.module' || (row % 500) || '\", "
+                   f"\"res\": {{\"changed\": true}}}}' "
+                   f"FROM generate_series(1, {rows}) AS row")
+
+
+def copy_decoded(cursor, filespec, max_file_size):
+    # The path before, every row copied into bytes and decoded for the text splitter
+    file = CsvFileSplitter(filespec=filespec, max_file_size=max_file_size)
+    with cursor.copy(QUERY) as copy:
+        while data := copy.read():
+            byte_data = bytes(data)
+            file.write(byte_data.decode())
+    return file.file_list()
+
+
+def copy_binary(cursor, filespec, max_file_size):
+    file = BinaryCsvFileSplitter(filespec=filespec, max_file_size=max_file_size)
+    with cursor.copy(QUERY) as copy:
+        while data := copy.read():
+            file.write(data)
+    return file.file_list()
+
+
+def run(cursor, copy, filespec, max_file_size):
+    start, start_cpu = time.time(), time.process_time()
+    file_list = copy(cursor, filespec, max_file_size)
+    elapsed, cpu = time.time() - start, time.process_time() - start_cpu
+
+    contents = []
+    for file_path in file_list:
+        with open(file_path, "rb") as file:
+            contents.append(file.read())
+    return elapsed, cpu, contents
+
+
+def main(rows, max_file_size):
+    settings.configure(DATABASES={"default": {"ENGINE": "django.db.backends.postgresql",
+                                              "NAME": os.environ.get("PGDATABASE", "postgres")}})
+    django.setup()
+
+    from django.db import connection
+
+    with connection.cursor() as cursor, tempfile.TemporaryDirectory() as path:
+        create_table(cursor, rows)
+        results = {}
+        try:
+            for copy in (copy_decoded, copy_binary):
+                os.mkdir(os.path.join(path, copy.__name__))
+                filespec = os.path.join(path, copy.__name__, "main_jobevent_table.csv")
+                results[copy.__name__] = run(cursor, copy, filespec, max_file_size * 1024 * 1024)
+        finally:
+            cursor.execute(f"DROP SCHEMA {SCHEMA} CASCADE")
+
+    size = sum(len(content) for content in results["copy_binary"][2])
+    print(f"pg_version={connection.pg_version} rows={rows} {size / 2 ** 20:.0f}MB "
+          f"files={len(results['copy_binary'][2])}")
+    for name, (elapsed, cpu, _) in results.items():
+        print(f"{name:<12} {size / 2 ** 20 / elapsed:.0f} MB/s {elapsed:.1f}s client CPU {cpu:.1f}s")
+    print(f"same={results['copy_decoded'][2] == results['copy_binary'][2]}")
+
+
+if __name__ == "__main__":
+    main(*([int(arg) for arg in sys.argv[1:3]] + [1_000_000, 100][len(sys.argv[1:3]):]))
@@ -0,0 +1,67 @@
+"""
+Benchmark of the renewal guidance deduplication, resolving the duplicate groups of host metrics
+as connected components.
+
+    python -m benchmarks.bench_dedup [rows ...]
+
+For every number of rows it times the deduplication of random host metrics, a third of the values
+of the dedup columns shared by more records, and of one group chaining all the records in a random
+order, with the rounds of the union-find.
+"""
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from metrics_utility.automation_controller_billing.report.renewal_guidance.dedup import Dedup
+
+
+def host_metrics(rows, rng):
+    def column(prefix, missing):
+        values = pd.Series([f"{prefix}{value}" for value in rng.integers(0, rows // 3 + 1, rows)], dtype=object)
+        values[rng.random(rows) < missing] = None
+        return values
+
+    first_automation = pd.Timestamp("2024-01-01") + pd.to_timedelta(rng.integers(0, 300, rows), unit="D")
+    return pd.DataFrame({
+        "hostname": [f"host{value}" for value in rng.integers(0, rows, rows)],
+        "ansible_host_variable": column("variable", .7),
+        "ansible_product_serial": column("serial", .7),
+        "ansible_machine_id": column("machine", .7),
+        "first_automation": first_automation,
+        "last_automation": first_automation + pd.to_timedelta(rng.integers(0, 30, rows), unit="D"),
+        "automated_counter": rng.integers(1, 10, rows),
+        "deleted_counter": rng.integers(0, 2, rows),
+        "last_deleted": pd.NaT,
+        "deleted": rng.random(rows) < .2,
+    })
+
+
+def chained_host_metrics(rows, rng):
+    # Record k shares the serial with record k + 1 when k is even, the machine id otherwise
+    host_metrics = pd.DataFrame({
+        "hostname": [f"host{index}" for index in range(rows)],
+        "ansible_host_variable": None,
+        "ansible_product_serial": [f"serial{(index + 1) // 2}" for index in range(rows)],
+        "ansible_machine_id": [f"machine{index // 2}" for index in range(rows)],
+    })
+    return host_metrics.iloc[rng.permutation(rows)].reset_index(drop=True)
+
+
+def main(sizes):
+    rng = np.random.default_rng(0)
+    for rows in sizes:
+        dataframe = host_metrics(rows, rng)
+        start = time.time()
+        deduped = Dedup(dataframe, {}).run_deduplication()
+        print(f"random  rows={rows} groups={len(deduped)} {time.time() - start:.2f}s")
+
+        dataframe = chained_host_metrics(rows, rng)
+        start = time.time()
+        components, rounds = Dedup(dataframe, {}).connected_components(dataframe, return_rounds=True)
+        print(f"chained rows={rows} groups={len(np.unique(components))} rounds={rounds} {time.time() - start:.2f}s")
+
+
+if __name__ == "__main__":
+    main([int(rows) for rows in sys.argv[1:]] or [10_000, 100_000, 1_000_000])
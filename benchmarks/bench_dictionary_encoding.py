@@ -0,0 +1,111 @@
+"""
+Benchmark of the dictionary encoding of the string keys of the rollups, against the engines
+aggregating by the strings themselves.
+
+    python -m benchmarks.bench_dictionary_encoding [days [rows]]
+
+Every day has a job host summary and a main_jobevent tarball of the rows, over 100k hosts. It
+prints the time to build the job host summary and content dataframes from a single scan, with the
+memory of the result frames, and checks both builds give the same dataframes.
+"""
+import datetime
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from metrics_utility.automation_controller_billing.dataframe_engine.base import build_dataframes
+from metrics_utility.automation_controller_billing.dataframe_engine.dataframe_content_usage \
+    import DataframeContentUsage
+from metrics_utility.automation_controller_billing.dataframe_engine.dataframe_jobhost_summary_usage \
+    import DataframeJobhostSummaryUsage
+from metrics_utility.automation_controller_billing.extract.extractor_directory import ExtractorDirectory
+
+from benchmarks.synthetic import write_tarball
+
+MONTH = datetime.date(2024, 5, 1)
+HOSTS = 100_000
+
+
+class StringKeysJobhostSummaryUsage(DataframeJobhostSummaryUsage):
+    @staticmethod
+    def categorical_columns():
+        return []
+
+
+class StringKeysContentUsage(DataframeContentUsage):
+    @staticmethod
+    def categorical_columns():
+        return []
+
+
+def write_tarballs(ship_path, days, rows, rng):
+    for day in range(days):
+        date = MONTH + datetime.timedelta(days=day)
+        hosts = rng.integers(0, HOSTS, rows)
+        jobs = rng.integers(0, 3000, rows)
+        created = (pd.Timestamp(date, tz="UTC") + pd.to_timedelta(rng.integers(0, 86400, rows), unit="s")).astype(str)
+
+        job_host_summary = pd.DataFrame({
+            "host_name": [f"host{host}.example.com" for host in hosts],
+            "organization_name": [f"Organization {host % 50}" for host in hosts],
+            "job_template_name": [f"Job template {job % 400}" for job in jobs],
+            "job_remote_id": jobs,
+            "created": created,
+            "modified": created,
+            "job_created": created,
+            **{column: rng.integers(0, 5, rows) for column in ("dark", "failures", "ok", "skipped", "ignored", "rescued")},
+        })
+        write_tarball(ship_path, date, "job_host_summary", job_host_summary.to_csv(index=False))
+
+        modules = rng.integers(0, 500, rows)
+        main_jobevent = pd.DataFrame({
+            "host_name": [f"host{host}.example.com" for host in hosts],
+            "task_action": [f"namespace{module % 20}.collection{module % 60}.module{module}" for module in modules],
+            "resolved_action": None,
+            "role": [f"namespace{module % 20}.collection{module % 60}.role{module % 90}" for module in modules],
+            "resolved_role": None,
+            "job_remote_id": jobs,
+            "duration": rng.random(rows),
+        })
+        write_tarball(ship_path, date, "main_jobevent", main_jobevent.to_csv(index=False), index=1)
+
+
+def build(ship_path, engine_classes):
+    extractor = ExtractorDirectory({"ship_path": ship_path})
+    engines = [engine_class(extractor=extractor, month=MONTH, extra_params={}) for engine_class in engine_classes]
+
+    start = time.time()
+    dataframes = build_dataframes(extractor, engines[0].dates(), engines)
+    return time.time() - start, dataframes
+
+
+def memory(dataframes):
+    return " ".join(f"{dataframe.memory_usage(deep=True).sum() / 2 ** 20:.0f}MiB" for dataframe in dataframes)
+
+
+def same(encoded, string_keys):
+    encoded = encoded.astype({column: object for column in encoded.columns
+                              if isinstance(encoded[column].dtype, pd.CategoricalDtype)})
+    string_keys = string_keys.astype({column: object for column in string_keys.columns
+                                      if isinstance(string_keys[column].dtype, pd.CategoricalDtype)})
+    return encoded.equals(string_keys[encoded.columns])
+
+
+def main(days, rows):
+    with tempfile.TemporaryDirectory() as ship_path:
+        write_tarballs(ship_path, days, rows, np.random.default_rng(0))
+
+        encoded_time, encoded = build(ship_path, [DataframeJobhostSummaryUsage, DataframeContentUsage])
+        print(f"dictionary encoded {encoded_time:.1f}s rows={[len(df) for df in encoded]} {memory(encoded)}")
+
+        string_keys_time, string_keys = build(ship_path, [StringKeysJobhostSummaryUsage, StringKeysContentUsage])
+        print(f"string keys        {string_keys_time:.1f}s rows={[len(df) for df in string_keys]} {memory(string_keys)}")
+
+        print(f"same={all(same(*dataframes) for dataframes in zip(encoded, string_keys))}")
+
+
+if __name__ == "__main__":
+    main(*([int(arg) for arg in sys.argv[1:3]] + [30, 100_000][len(sys.argv[1:3]):]))
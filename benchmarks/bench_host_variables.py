@@ -0,0 +1,130 @@
+"""
+Benchmark of the host variable parsing of the job_host_summary collector, once per distinct host
+against the format checks of every joined row the collector ran before.
+
+    PGHOST=... PGPORT=... PGUSER=... PGDATABASE=... python -m benchmarks.bench_host_variables [hosts [rows]]
+
+It needs a PostgreSQL server, the connection is taken from the libpq environment variables. The
+hosts, their variables mixing JSON, YAML and empty values, and the job host summaries are created
+in a metrics_utility_benchmark schema, dropped afterwards. It prints the time to export the slice
+by every query, with the IS JSON predicate on PostgreSQL 16+ and with the plpgsql fallback, and
+checks they export the same rows.
+"""
+import io
+import json
+import os
+import sys
+import time
+
+import django
+from django.conf import settings
+
+SCHEMA = "metrics_utility_benchmark"
+SLICE_CONDITION = "main_jobhostsummary.modified >= now() - interval '2 days'"
+
+
+def variables(host):
+    if host % 4 == 0:
+        return json.dumps({"ansible_host": f"10.0.{host % 255}.{host % 7}", "ansible_connection": "ssh",
+                           "values": list(range(20))})
+    elif host % 4 == 1:
+        return f"---\nansible_host: 10.1.{host % 255}.1\nansible_connection: local\n" + "key: value\n" * 20
+    elif host % 4 == 2:
+        return ""
+    return "{}"
+
+
+def create_tables(cursor, hosts, rows):
+    cursor.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+    cursor.execute(f"CREATE SCHEMA {SCHEMA}")
+    cursor.execute(f"SET search_path TO {SCHEMA}")
+    cursor.execute("CREATE TABLE main_host (id int PRIMARY KEY, name text, variables text)")
+    cursor.execute("CREATE TABLE main_jobhostsummary (id serial PRIMARY KEY, modified timestamptz, "
+                   "host_name text, host_id int)")
+    cursor.execute("CREATE INDEX ON main_jobhostsummary (modified)")
+
+    cursor.execute("INSERT INTO main_host SELECT id, 'host' || id, variables "
+                   "FROM unnest(%s::int[], %s::text[]) AS hosts(id, variables)",
+                   [list(range(hosts)), [variables(host) for host in range(hosts)]])
+    cursor.execute(f"INSERT INTO main_jobhostsummary (modified, host_name, host_id) "
+                   f"SELECT now() - (row % 86400) * interval '1 second', 'host' || (row % {hosts}), row % {hosts} "
+                   f"FROM generate_series(1, {rows}) AS row")
+    cursor.execute("ANALYZE")
+
+
+def per_row_query():
+    # The join of the collector before, the format is checked twice for every row
+    return f'''
+        SELECT main_jobhostsummary.id,
+               CASE WHEN (metrics_utility_is_valid_json(main_host.variables))
+                   THEN main_host.variables::jsonb->>'ansible_host'
+                   ELSE metrics_utility_parse_yaml_field(main_host.variables, 'ansible_host' )
+               END AS ansible_host_variable,
+               CASE WHEN (metrics_utility_is_valid_json(main_host.variables))
+                   THEN main_host.variables::jsonb->>'ansible_connection'
+                   ELSE metrics_utility_parse_yaml_field(main_host.variables, 'ansible_connection' )
+               END AS ansible_connection_variable
+        FROM main_jobhostsummary
+        LEFT JOIN main_host ON main_host.id = main_jobhostsummary.host_id
+        WHERE ({SLICE_CONDITION})
+        ORDER BY main_jobhostsummary.id
+    '''
+
+
+def per_host_query(host_variables):
+    hosts_condition = f"main_host.id IN (SELECT DISTINCT main_jobhostsummary.host_id " \
+                      f"FROM main_jobhostsummary WHERE {SLICE_CONDITION})"
+    return f'''
+        WITH host_variables AS ({host_variables.host_variables_query(hosts_condition)})
+        SELECT main_jobhostsummary.id,
+               host_variables.ansible_host_variable,
+               host_variables.ansible_connection_variable
+        FROM main_jobhostsummary
+        LEFT JOIN host_variables ON host_variables.id = main_jobhostsummary.host_id
+        WHERE ({SLICE_CONDITION})
+        ORDER BY main_jobhostsummary.id
+    '''
+
+
+def export(cursor, query):
+    start = time.time()
+    output = io.BytesIO()
+    with cursor.copy(f"COPY ({query}) TO STDOUT WITH CSV") as copy:
+        for data in copy:
+            output.write(data)
+
+    return time.time() - start, output.getvalue()
+
+
+def main(hosts, rows):
+    settings.configure(DATABASES={"default": {"ENGINE": "django.db.backends.postgresql",
+                                              "NAME": os.environ.get("PGDATABASE", "postgres")}})
+    django.setup()
+
+    from django.db import connection
+    from metrics_utility.automation_controller_billing import host_variables
+
+    with connection.cursor() as cursor:
+        create_tables(cursor, hosts, rows)
+        cursor.execute(host_variables.pg_functions())
+        try:
+            per_row, per_row_output = export(cursor, per_row_query())
+            per_host, per_host_output = export(cursor, per_host_query(host_variables))
+
+            # Servers older than PostgreSQL 16 check the format by the plpgsql function
+            is_json_version = host_variables.PG_IS_JSON_VERSION
+            host_variables.PG_IS_JSON_VERSION = sys.maxsize
+            try:
+                fallback, fallback_output = export(cursor, per_host_query(host_variables))
+            finally:
+                host_variables.PG_IS_JSON_VERSION = is_json_version
+        finally:
+            cursor.execute(f"DROP SCHEMA {SCHEMA} CASCADE")
+
+    print(f"pg_version={connection.pg_version} hosts={hosts} rows={rows}")
+    print(f"per row plpgsql {per_row:.2f}s per host {per_host:.2f}s per host plpgsql {fallback:.2f}s "
+          f"same={per_row_output == per_host_output == fallback_output}")
+
+
+if __name__ == "__main__":
+    main(*([int(arg) for arg in sys.argv[1:3]] + [20_000, 1_000_000][len(sys.argv[1:3]):]))
@@ -0,0 +1,97 @@
+"""
+Benchmark of the prefetch of the S3 tarballs, while the current one is processed.
+
+    python -m benchmarks.bench_s3_prefetch [latency [bandwidth [prefetch ...]]]
+
+The tarballs of a month, one job host summary tarball per day, are served from a temporary
+directory by a fake S3 handler, with the latency in seconds of every request and the bandwidth
+in MB/s of every object. It prints the time to build the job host summary dataframe for every
+METRICS_UTILITY_S3_PREFETCH_PARTITIONS value, 0 disables the prefetch.
+"""
+import datetime
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from metrics_utility.automation_controller_billing.dataframe_engine.dataframe_jobhost_summary_usage \
+    import DataframeJobhostSummaryUsage
+from metrics_utility.automation_controller_billing.extract.extractor_s3 import ExtractorS3
+
+from benchmarks.synthetic import write_tarball
+
+MONTH = datetime.date(2024, 5, 1)
+ROWS = 20_000
+
+
+class SlowBody:
+    # Object body with the time to first byte and the bandwidth of the fake endpoint
+    def __init__(self, path, latency, bandwidth):
+        time.sleep(latency)
+        self.file = open(path, "rb")
+        self.bandwidth = bandwidth
+
+    def read(self, amt=None):
+        data = self.file.read(amt) if amt else self.file.read()
+        time.sleep(len(data) / self.bandwidth)
+        return data
+
+    def close(self):
+        self.file.close()
+
+
+class SlowS3Handler:
+    def __init__(self, root, latency, bandwidth):
+        self.root = root
+        self.latency = latency
+        self.bandwidth = bandwidth
+
+    def list_file_sizes(self, prefix):
+        time.sleep(self.latency)
+        directory = os.path.join(self.root, prefix)
+        for name in sorted(os.listdir(directory)) if os.path.isdir(directory) else []:
+            yield os.path.join(prefix, name), os.path.getsize(os.path.join(directory, name))
+
+    def list_files(self, prefix):
+        for path, _ in self.list_file_sizes(prefix):
+            yield path
+
+    def open_file(self, path):
+        return SlowBody(os.path.join(self.root, path), self.latency, self.bandwidth)
+
+
+def write_tarballs(ship_path, rng):
+    for day in range(30):
+        date = MONTH + datetime.timedelta(days=day)
+        created = date.strftime("%Y-%m-%d 00:00:00+00")
+        counts = rng.integers(0, 5, (ROWS, 6))
+        rows = "".join(f"host{host},org{host % 7},template{host % 13},{job},{created},{created},"
+                       f"{','.join(map(str, count))}\n"
+                       for host, job, count in zip(rng.integers(0, 50_000, ROWS), rng.integers(0, 300, ROWS), counts))
+        write_tarball(ship_path, date, "job_host_summary",
+                      "host_name,organization_name,job_template_name,job_remote_id,"
+                      "created,job_created,dark,failures,ok,skipped,ignored,rescued\n" + rows)
+
+
+def main(latency, bandwidth, prefetch):
+    with tempfile.TemporaryDirectory() as root:
+        write_tarballs(os.path.join(root, "ship"), np.random.default_rng(0))
+
+        for partitions in prefetch:
+            os.environ["METRICS_UTILITY_S3_PREFETCH_PARTITIONS"] = str(partitions)
+
+            extractor = ExtractorS3({"ship_path": "ship"})
+            extractor.s3_handler = SlowS3Handler(root, latency, bandwidth * 1024 * 1024)
+            engine = DataframeJobhostSummaryUsage(extractor=extractor, month=MONTH, extra_params={})
+
+            start = time.time()
+            dataframe = engine.build_dataframe()
+            print(f"prefetch={partitions} rows={len(dataframe)} {time.time() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    main(float(sys.argv[1]) if len(sys.argv) > 1 else 0.2,
+         float(sys.argv[2]) if len(sys.argv) > 2 else 5,
+         [int(partitions) for partitions in sys.argv[3:]] or [0, 1, 4])
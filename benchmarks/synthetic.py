@@ -0,0 +1,33 @@
+"""
+Synthetic tarballs of the gathered tables, as shipped to the directory and S3 targets.
+"""
+import datetime
+import io
+import json
+import os
+import tarfile
+
+INSTALL_UUID = "36e809d0-b1ae-4b99-9011-2fa3a3eb196e"
+
+
+def write_tarball(ship_path, date, table, content, index=0, install_uuid=INSTALL_UUID):
+    """
+    Write the tarball of the table gathered for the whole day.
+
+    :param content: CSV of the table, with the header
+    """
+    since = datetime.datetime.combine(date, datetime.time(), datetime.timezone.utc)
+    until = since + datetime.timedelta(days=1)
+    path = os.path.join(ship_path, "data", date.strftime("%Y/%m/%d"),
+                        f"{install_uuid}-{since:%Y-%m-%d-%H%M%S%z}-{until:%Y-%m-%d-%H%M%S%z}-{index}.tar.gz")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    members = [("config.json", json.dumps({"install_uuid": install_uuid}).encode()),
+               (f"{table}.csv", content.encode())]
+    with tarfile.open(path, "w:gz") as tar:
+        for name, data in members:
+            info = tarfile.TarInfo(f"./{name}")
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+
+    return path
@@ -1,8 +1,18 @@
 import logging
+import threading
 import boto3
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
 from botocore.exceptions import ClientError
 import os
 
+# Sessions and clients shared by all the handlers using the same credentials and endpoint,
+# so the connections are pooled and reused across objects, instead of a new TLS handshake
+# for every object. Clients are thread safe, creating them is not, hence the lock.
+_shared_clients = {}
+_shared_clients_lock = threading.Lock()
+
+
 class S3Handler():
     def __init__(self, params):
         self.bucket_name = params.get("bucket_name")
@@ -13,11 +23,6 @@ class S3Handler():
 
         self._session = None
 
-        self.s3 = self.get_s3_resource()
-        self.s3_bucket = self.get_s3_bucket()
-        self.s3_client = self.get_s3_client
-
-
     @property
     def session(self):
         if self._session is not None:
@@ -30,12 +35,37 @@ class S3Handler():
         )
         return self._session
 
+    @property
+    def s3(self):
+        return self.get_s3_resource()
+
+    @property
+    def s3_bucket(self):
+        return self.get_s3_bucket()
+
+    @property
+    def s3_client(self):
+        return self.get_s3_client()
+
+    def _shared(self, kind):
+        key = (kind, self.bucket_access_key, self.bucket_secret_key, self.bucket_region, self.bucket_endpoint)
+
+        with _shared_clients_lock:
+            if key not in _shared_clients:
+                if kind == "client":
+                    _shared_clients[key] = self.session.client(
+                        "s3", endpoint_url=self.bucket_endpoint, config=self.client_config())
+                else:
+                    _shared_clients[key] = self.session.resource(
+                        "s3", endpoint_url=self.bucket_endpoint, config=self.client_config())
+
+            return _shared_clients[key]
 
     def get_s3_resource(self):
-        return self.session.resource("s3", endpoint_url=self.bucket_endpoint)
+        return self._shared("resource")
 
     def get_s3_client(self):
-        return self.session.client("s3", endpoint_url=self.bucket_endpoint)
+        return self._shared("client")
 
     def get_s3_bucket(self):
         return self.get_s3_resource().Bucket(self.bucket_name)
@@ -55,8 +85,8 @@ class S3Handler():
 
         # Upload the file
         try:
-            s3_resource = self.get_s3_resource()
-            s3_resource.meta.client.upload_file(file_name, self.bucket_name, object_name)
+            client = self.get_s3_client()
+            client.upload_file(file_name, self.bucket_name, object_name, Config=self.transfer_config())
         except ClientError as e:
             logging.error(e)
             return False
@@ -70,7 +100,7 @@ class S3Handler():
 
         full_name = s3_filename # os.path.join(s3_path, s3_filename) if s3_path else s3_filename
         try:
-            client.download_file(self.bucket_name, full_name, local_filename)
+            client.download_file(self.bucket_name, full_name, local_filename, Config=self.transfer_config())
             status = True
         except ClientError as e:
             code = int(e.response["Error"]["Code"])
@@ -81,18 +111,47 @@ class S3Handler():
 
         return status
 
+    def open_file(self, s3_filename):
+        """
+        :param s3_filename - request_id
+        :return: streaming body of the object, read on demand
+        """
+        client = self.get_s3_client()
+
+        response = client.get_object(Bucket=self.bucket_name, Key=s3_filename)
+        return response["Body"]
+
     def list_files(self, prefix):
-        s3_resource = self.get_s3_resource()
+        for key, _ in self.list_file_sizes(prefix):
+            yield key
 
-        paginator = s3_resource.meta.client.get_paginator('list_objects')
+    def list_file_sizes(self, prefix):
+        client = self.get_s3_client()
+
+        paginator = client.get_paginator('list_objects_v2')
         for resp in paginator.paginate(Bucket=self.bucket_name, Prefix=prefix):
             for ret_value in resp.get('Contents', []):
-                yield ret_value["Key"]
+                yield ret_value["Key"], ret_value["Size"]
 
     def list_subdirs(self, prefix):
-        s3_resource = self.get_s3_resource()
+        client = self.get_s3_client()
 
-        paginator = s3_resource.meta.client.get_paginator('list_objects')
+        paginator = client.get_paginator('list_objects_v2')
         for resp in paginator.paginate(Bucket=self.bucket_name, Delimiter='/', Prefix=prefix):
             for ret_value in resp.get('CommonPrefixes', []):
                 yield ret_value
+
+    @staticmethod
+    def client_config():
+        # Size of the connection pool of the shared client, it should not be lower than
+        # the number of threads using it, e.g. the prefetch of the tarballs
+        return Config(max_pool_connections=int(os.environ.get('METRICS_UTILITY_S3_MAX_POOL_CONNECTIONS', 32)))
+
+    @staticmethod
+    def transfer_config():
+        # Concurrency and multipart sizes of uploads and downloads
+        return TransferConfig(
+            max_concurrency=int(os.environ.get('METRICS_UTILITY_S3_TRANSFER_MAX_CONCURRENCY', 10)),
+            multipart_threshold=int(os.environ.get('METRICS_UTILITY_S3_MULTIPART_THRESHOLD', 8 * 1024 * 1024)),
+            multipart_chunksize=int(os.environ.get('METRICS_UTILITY_S3_MULTIPART_CHUNKSIZE', 8 * 1024 * 1024)),
+        )
@@ -0,0 +1,52 @@
+import os
+
+from metrics_utility.automation_controller_billing import schema
+
+"""
+File format of the gathered tables. CSV by default, or Parquet typed by the schema
+of the table, which needs the optional pyarrow dependency (pip install metrics-utility[parquet]).
+"""
+
+CSV = 'csv'
+PARQUET = 'parquet'
+
+FORMATS = [CSV, PARQUET]
+
+
+def collection_format():
+    return os.environ.get('METRICS_UTILITY_COLLECTION_FORMAT', CSV)
+
+
+def csv_to_parquet(csv_path, collection, block_size=16 * 1024 * 1024):
+    """
+    Convert the CSV exported by COPY into a Parquet file, typed by the schema of the collection,
+    one block at a time. The CSV file is removed.
+
+    :return: path of the Parquet file
+    """
+    import pyarrow.csv
+    import pyarrow.parquet
+
+    parquet_path = os.path.splitext(csv_path)[0] + '.parquet'
+
+    reader = pyarrow.csv.open_csv(
+        csv_path,
+        read_options=pyarrow.csv.ReadOptions(block_size=block_size),
+        # Quoted values can span more lines, e.g. names of tasks
+        parse_options=pyarrow.csv.ParseOptions(newlines_in_values=True),
+        convert_options=pyarrow.csv.ConvertOptions(
+            column_types=schema.arrow_types(collection),
+            # NULL and empty strings are both missing values, same as read by pandas
+            strings_can_be_null=True,
+            # PostgreSQL booleans
+            true_values=schema.TRUE_VALUES,
+            false_values=schema.FALSE_VALUES,
+        ),
+    )
+
+    with pyarrow.parquet.ParquetWriter(parquet_path, reader.schema, compression='zstd') as writer:
+        for batch in reader:
+            writer.write_batch(batch)
+
+    os.remove(csv_path)
+    return parquet_path
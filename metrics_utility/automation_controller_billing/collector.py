@@ -1,23 +1,68 @@
 import contextlib
 import json
 import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from django.conf import settings
 from django.db import connection
+from django.utils.timezone import now
 
 import insights_analytics_collector as base
+from insights_analytics_collector.collection import Collection
 
 from django.core.serializers.json import DjangoJSONEncoder
 # from awx.conf.license import get_license
 # from awx.main.models import Job
 # from awx.main.access import access_registry
 # from rest_framework.exceptions import PermissionDenied
-from metrics_utility.automation_controller_billing.package.factory import Factory as PackageFactory
-
-from awx.main.utils import datetime_hook
-from awx.main.utils.pglock import advisory_lock
+from metrics_utility.automation_controller_billing.host_variables import pg_functions
 
 logger = logging.getLogger('metrics_utility.collector')
 
+# Upper limit of the slices gathered concurrently, multiplied by the COPY connections of a
+# collector it bounds the database connections of the gathering, to protect the database
+MAX_GATHER_WORKERS = 4
+
+
+class CollectionCSV(base.CollectionCSV):
+    """
+    CSV collection writing its files into its own gather_dir, if set, so the slices
+    of a collector can be gathered concurrently without overwriting each other's files
+    """
+    def __init__(self, collector, fnc_collecting):
+        super().__init__(collector, fnc_collecting)
+        self.gather_dir = None
+        # The SQL functions prepended by the collectors were already created, see Collector
+        self.pg_functions_created = False
+
+    def gather(self, max_data_size):
+        self.gathering_started_at = now()
+
+        try:
+            result = self.fnc_collecting(
+                since=self.since,
+                until=self.until,
+                max_data_size=max_data_size,
+                full_path=self.gather_dir or self.collector.gather_dir,
+                collection_type=self.collector.collection_type,
+                pg_functions_created=self.pg_functions_created,
+            )
+            self._save_gathering(result)
+
+            self.gathering_successful = True
+        except Exception as e:
+            self.logger.exception(f"Could not generate metric {self.filename}: {e}")
+            self.gathering_successful = False
+        finally:
+            self._set_gathering_finished()
+
+    def add_to_tar(self, tar):
+        # Tables can be gathered in the Parquet format as well, the extension of the file is kept
+        _, extension = os.path.splitext(self.target())
+        self.logger.debug(f"CollectionCSV._add_to_tar: | {self.key}{extension} | Size: {self.data_size()}")
+        tar.add(self.target(), arcname=f"./{self.key}{extension}")
+
 
 class Collector(base.Collector):
     def __init__(self, collection_type=base.Collector.SCHEDULED_COLLECTION, collector_module=None,
@@ -30,6 +75,10 @@ class Collector(base.Collector):
         self.ship_target = ship_target
         self.billing_provider_params = billing_provider_params
 
+        # Gathered CSV slices with their packages, in the order of the slices, set by the concurrent gathering
+        self.slice_packages = None
+        self._packages_lock = threading.Lock()
+
         super(Collector, self).__init__(collection_type=collection_type, collector_module=collector_module, logger=logger)
 
     # TODO: extract advisory lock name in the superclass and log message, so we can change it here and then use
@@ -77,6 +126,88 @@ class Collector(base.Collector):
 
             return self.all_tar_paths()
 
+    def _gather_csv_collections(self):
+        workers = self.gather_workers()
+        if workers <= 1:
+            super()._gather_csv_collections()
+            return
+
+        self._gather_csv_collections_concurrently(workers)
+
+    def _gather_csv_collections_concurrently(self, workers):
+        """
+        Gathers the slices (e.g. days) of the CSV collections in a pool of workers. Every slice
+        is gathered over its own database connection into its own directory and it's packed
+        into its own tarballs, which are processed one at a time.
+        """
+        self.slice_packages = []
+        collections = self.collections[Collection.COLLECTION_TYPE_CSV]
+
+        # The SQL functions of the collectors are created once, before the workers, concurrent
+        # CREATE OR REPLACE FUNCTION statements fail with "tuple concurrently updated"
+        with connection.cursor() as cursor:
+            cursor.execute(pg_functions())
+        for collection in collections:
+            collection.pg_functions_created = True
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            # map keeps the order of the slices, so the last gathered entries can be updated in order
+            slices_packages = list(executor.map(self._gather_csv_slice, range(len(collections)), collections))
+
+        for collection, packages in zip(collections, slices_packages):
+            self.slice_packages.append((collection, packages))
+            for package in packages:
+                self.packages.setdefault(collection.shipping_group, []).append(package)
+
+    def _gather_csv_slice(self, index, collection):
+        collection.gather_dir = self.gather_dir.joinpath(f"slice-{index}")
+        collection.gather_dir.mkdir(mode=0o700)
+
+        try:
+            collection.gather(self._package_class().max_data_size())
+        finally:
+            # Worker threads open their own connections, which are not closed by django
+            connection.close()
+
+        if collection.is_empty() or not collection.gathering_successful:
+            return []
+
+        packages = []
+        for sub_collection in collection.sub_collections or [collection]:
+            package = self._create_package()
+            package.add_collection(sub_collection)
+            packages.append(package)
+
+            # Tarball names are indexed by the existing files, packing and shipping one at a time
+            with self._packages_lock:
+                self._process_package(package)
+
+        return packages
+
+    def _update_last_gathered_entries(self):
+        if self.slice_packages is None:
+            super()._update_last_gathered_entries()
+            return
+
+        # Slices were gathered concurrently, walk them in order and lock the key at the first
+        # slice failing to gather or to ship, so the last gathered entry only advances over
+        # the slices which succeeded together with all the slices before them.
+        last_gathered_updates = {"keys": {}, "locked": set()}
+
+        for collection, packages in self.slice_packages:
+            if not collection.gathering_successful or not all(package.shipping_successful for package in packages):
+                last_gathered_updates["locked"].add(collection.key)
+
+            for package in packages:
+                package.update_last_gathered_entries(last_gathered_updates)
+
+        for unsuccessful_key in last_gathered_updates["locked"]:
+            last_gathered_updates["keys"].pop(f"{unsuccessful_key}_full", None)
+
+        self.last_gathered_entries.update(last_gathered_updates["keys"])
+
+        self._save_last_gathered_entries(self.last_gathered_entries)
+
     def _is_valid_license(self):
         # TODO: which license to check? Any license will do?
         #
@@ -107,6 +238,8 @@ class Collector(base.Collector):
     @contextlib.contextmanager
     def _pg_advisory_lock(self, key, wait=False):
         """Use awx specific implementation to pass tests with sqlite3"""
+        from awx.main.utils.pglock import advisory_lock
+
         with advisory_lock(key, wait=wait) as lock:
             yield lock
 
@@ -119,6 +252,7 @@ class Collector(base.Collector):
         # We can safely do this, by making sure we use the same lock as Analytics, before we persist
         # these settings.
         from awx.conf.models import Setting
+        from awx.main.utils import datetime_hook
 
         last_entries = Setting.objects.filter(key='AUTOMATION_ANALYTICS_LAST_ENTRIES').first()
         last_gathered_entries = json.loads((last_entries.value if last_entries is not None else '') or '{}', object_hook=datetime_hook)
@@ -140,4 +274,20 @@ class Collector(base.Collector):
         settings.AUTOMATION_ANALYTICS_LAST_ENTRIES = json.dumps(last_gathered_entries, cls=DjangoJSONEncoder)
 
     def _package_class(self):
+        # Imported when used, as the other controller dependent modules
+        from metrics_utility.automation_controller_billing.package.factory import Factory as PackageFactory
+
         return PackageFactory(ship_target=self.ship_target).create()
+
+    @staticmethod
+    def _collection_csv_class():
+        return CollectionCSV
+
+    @staticmethod
+    def gather_workers():
+        # Number of the slices gathered concurrently, each one holds its own database connection,
+        # multiplied by the METRICS_UTILITY_COPY_PARALLELISM of the collectors
+        workers = int(os.environ.get('METRICS_UTILITY_GATHER_WORKERS', 1))
+        if workers > MAX_GATHER_WORKERS:
+            logger.warning(f"METRICS_UTILITY_GATHER_WORKERS={workers} is limited to {MAX_GATHER_WORKERS}")
+        return max(1, min(workers, MAX_GATHER_WORKERS))
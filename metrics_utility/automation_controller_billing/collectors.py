@@ -3,6 +3,7 @@ import os
 import os.path
 import platform
 import distro
+from concurrent.futures import ThreadPoolExecutor
 
 from django.db import connection
 from django.conf import settings
@@ -13,7 +14,9 @@ from awx.conf.license import get_license
 from awx.main.utils import get_awx_version, datetime_hook
 # TODO: enhance the CsvFIleSplitter base class and use that
 from insights_analytics_collector import register #, CsvFileSplitter
-from metrics_utility.automation_controller_billing.csv_file_splitter import CsvFileSplitter
+from metrics_utility.automation_controller_billing.collection_format import PARQUET, collection_format, csv_to_parquet
+from metrics_utility.automation_controller_billing.csv_file_splitter import BinaryCsvFileSplitter, CsvFileSplitter
+from metrics_utility.automation_controller_billing.host_variables import host_variables_query, pg_functions
 
 """
 This module is used to define metrics collected by
@@ -37,6 +40,16 @@ def optional_collectors():
     return os.environ.get('METRICS_UTILITY_OPTIONAL_COLLECTORS', 'main_jobevent').split(",")
 
 
+# Upper limit of the concurrent COPY connections of one collector, to protect the database
+MAX_COPY_PARALLELISM = 8
+
+
+def copy_parallelism():
+    # Number of sub ranges of a slice exported concurrently, each over its own database connection
+    parallelism = int(os.environ.get('METRICS_UTILITY_COPY_PARALLELISM', 1))
+    return max(1, min(parallelism, MAX_COPY_PARALLELISM))
+
+
 def daily_slicing(key, last_gather, **kwargs):
     since, until = kwargs.get('since', None), kwargs.get('until', now())
     if since is not None:
@@ -121,185 +134,349 @@ def config(since, **kwargs):
 
 def _copy_table(table, query, path, prepend_query=None):
     file_path = os.path.join(path, table + '_table.csv')
-    file = CsvFileSplitter(filespec=file_path)
 
     with connection.cursor() as cursor:
         if prepend_query:
             cursor.execute(prepend_query)
 
         if hasattr(cursor, 'copy_expert') and callable(cursor.copy_expert):
+            file = CsvFileSplitter(filespec=file_path)
             _copy_table_aap_2_4_and_below(cursor, query, file)
         else:
+            file = BinaryCsvFileSplitter(filespec=file_path)
             _copy_table_aap_2_5_and_above(cursor, query, file)
 
     return file.file_list()
 
 
+def _export_table(collection, table, query, since, until, path, prepend_query=None):
+    # Copy the table in the CSV format, converted to Parquet typed by the schema of the collection if configured
+    file_list = _copy_table_ranges(table=table,
+                                   query=query,
+                                   since=since,
+                                   until=until,
+                                   path=path,
+                                   prepend_query=prepend_query)
+
+    if collection_format() == PARQUET:
+        return [csv_to_parquet(file_path, collection) for file_path in file_list]
+
+    return file_list
+
+
+def _copy_table_ranges(table, query, since, until, path, prepend_query=None):
+    """
+    Export the slice in copy_parallelism() sub ranges of time, each one over its own
+    database connection. The sub ranges are merged in order into the split files.
+
+    :param query: function returning the COPY query for the given since and until
+    """
+    parallelism = copy_parallelism()
+    if parallelism <= 1:
+        return _copy_table(table=table, query=query(since, until), path=path, prepend_query=prepend_query)
+
+    # Run the prepend query once, the created functions are used by all the connections
+    if prepend_query:
+        with connection.cursor() as cursor:
+            cursor.execute(prepend_query)
+
+    step = (until - since) / parallelism
+    ranges = [(since + step * index, since + step * (index + 1) if index < parallelism - 1 else until)
+              for index in range(parallelism)]
+    part_paths = [os.path.join(path, f"{table}_table_part{index}.csv") for index in range(parallelism)]
+
+    try:
+        with ThreadPoolExecutor(max_workers=parallelism, thread_name_prefix="metrics_utility_copy") as executor:
+            futures = [executor.submit(_copy_range, query(range_since, range_until), part_path)
+                       for (range_since, range_until), part_path in zip(ranges, part_paths)]
+            for future in futures:
+                future.result()
+
+        file = BinaryCsvFileSplitter(filespec=os.path.join(path, table + '_table.csv'))
+        for index, part_path in enumerate(part_paths):
+            with open(part_path, 'rb') as part:
+                header = part.readline()
+                if index == 0:
+                    file.write(header)
+                _copy_csv_rows(part, file)
+    finally:
+        for part_path in part_paths:
+            if os.path.exists(part_path):
+                os.remove(part_path)
+
+    return file.file_list()
+
+
+def _copy_range(query, part_path):
+    # Runs in its own thread, hence over its own database connection
+    try:
+        with connection.cursor() as cursor, open(part_path, 'wb') as part:
+            if hasattr(cursor, 'copy_expert') and callable(cursor.copy_expert):
+                _copy_table_aap_2_4_and_below(cursor, query, part)
+            else:
+                _copy_table_aap_2_5_and_above(cursor, query, part)
+    finally:
+        connection.close()
+
+
+def _copy_csv_rows(source, file, chunk_size=1024 * 1024):
+    # Write the CSV in chunks ending on row boundaries, so the split files are cut only between
+    # rows. Newlines inside quoted values are told apart by the parity of the preceding quotes,
+    # escaped quotes are doubled, so they don't change the parity.
+    pending = b""
+    while chunk := source.read(chunk_size):
+        pending += chunk
+
+        end = pending.rfind(b"\n")
+        while end >= 0 and pending.count(b'"', 0, end) % 2:
+            end = pending.rfind(b"\n", 0, end)
+
+        if end >= 0:
+            file.write(pending[:end + 1])
+            pending = pending[end + 1:]
+
+    if pending:
+        file.write(pending)
+
+
 def _copy_table_aap_2_4_and_below(cursor, query, file):
     # Automation Controller 4.4 and below use psycopg2 with .copy_expert() method
     cursor.copy_expert(query, file)
 
 
 def _copy_table_aap_2_5_and_above(cursor, query, file):
-    # Automation Controller 4.5 and above use psycopg3 with .copy() method
+    # Automation Controller 4.5 and above use psycopg3 with .copy() method,
+    # the rows are written as they are read, without copying and decoding them
     with cursor.copy(query) as copy:
         while data := copy.read():
-            byte_data = bytes(data)
-            file.write(byte_data.decode())
+            file.write(data)
 
 
 @register('job_host_summary', '1.2', format='csv', description=_('Data for billing'), fnc_slicing=daily_slicing)
 def job_host_summary_table(since, full_path, until, **kwargs):
     # TODO: controler needs to have an index on main_jobhostsummary.modified
-    prepend_query = '''
-        -- Define function for parsing field out of yaml encoded as text
-        CREATE OR REPLACE FUNCTION metrics_utility_parse_yaml_field(
-            str text,
-            field text
+    # Functions created already when the slices are gathered concurrently, see Collector
+    prepend_query = None if kwargs.get('pg_functions_created') else pg_functions()
+
+    def query(since, until):
+        slice_condition = "main_jobhostsummary.modified >= '{0}' AND main_jobhostsummary.modified < '{1}'".format(
+            since.isoformat(), until.isoformat()
         )
-        RETURNS text AS
-        $$
-        DECLARE
-            line_re text;
-            field_re text;
-        BEGIN
-            field_re := ' *[:=] *(.+?) *$';
-            line_re := '(?n)^' || field || field_re;
-            RETURN trim(both '"' from substring(str from line_re) );
-        END;
-        $$
-        LANGUAGE plpgsql;
-
-        -- Define function to check if field is a valid json
-        CREATE OR REPLACE FUNCTION metrics_utility_is_valid_json(p_json text)
-            returns boolean
-        AS
-        $$
-        BEGIN
-            RETURN (p_json::json is not null);
-        EXCEPTION
-            WHEN others THEN
-                RETURN false;
-        END;
-        $$
-        LANGUAGE plpgsql;
-    '''
-
-    query = '''
-        (SELECT main_jobhostsummary.id,
-                main_jobhostsummary.created,
-                main_jobhostsummary.modified,
-                main_jobhostsummary.host_name,
-                main_jobhostsummary.host_id as host_remote_id,
-                CASE
-                    WHEN (metrics_utility_is_valid_json(main_host.variables))
-                        THEN main_host.variables::jsonb->>'ansible_host'
-                    ELSE metrics_utility_parse_yaml_field(main_host.variables, 'ansible_host' )
-                END AS ansible_host_variable,
-                CASE
-                    WHEN (metrics_utility_is_valid_json(main_host.variables))
-                        THEN main_host.variables::jsonb->>'ansible_connection'
-                    ELSE metrics_utility_parse_yaml_field(main_host.variables, 'ansible_connection' )
-                END AS ansible_connection_variable,
-                -- main_jobhostsummary.constructed_host_id,
-                main_jobhostsummary.changed,
-                main_jobhostsummary.dark,
-                main_jobhostsummary.failures,
-                main_jobhostsummary.ok,
-                main_jobhostsummary.processed,
-                main_jobhostsummary.skipped,
-                main_jobhostsummary.failed,
-                main_jobhostsummary.ignored,
-                main_jobhostsummary.rescued,
-                main_unifiedjob.created AS job_created,
-                main_jobhostsummary.job_id AS job_remote_id,
-                main_unifiedjob.unified_job_template_id AS job_template_remote_id,
-                main_unifiedjob.name AS job_template_name,
-                main_inventory.id AS inventory_remote_id,
-                main_inventory.name AS inventory_name,
-                main_organization.id AS organization_remote_id,
-                main_organization.name AS organization_name,
-                main_unifiedjobtemplate_project.id AS project_remote_id,
-                main_unifiedjobtemplate_project.name AS project_name
-                FROM main_jobhostsummary
-                -- connect to main_job, that has connections into inventory and project
-                LEFT JOIN main_job ON main_jobhostsummary.job_id = main_job.unifiedjob_ptr_id
-                -- get project name from project_options
-                LEFT JOIN main_unifiedjobtemplate AS main_unifiedjobtemplate_project ON main_unifiedjobtemplate_project.id = main_job.project_id
-                -- get inventory name from main_inventory
-                LEFT JOIN main_inventory ON main_inventory.id = main_job.inventory_id
-                -- get job name from main_unifiedjob
-                LEFT JOIN main_unifiedjob ON main_unifiedjob.id = main_jobhostsummary.job_id
-                -- get organization name from main_organization
-                LEFT JOIN main_organization ON main_organization.id = main_unifiedjob.organization_id
-                -- get variables from main_host
-                LEFT JOIN main_host ON main_host.id = main_jobhostsummary.host_id
-                WHERE (main_jobhostsummary.modified >= '{0}' AND main_jobhostsummary.modified < '{1}')
-                ORDER BY main_jobhostsummary.modified ASC)
-        '''.format(
+
+        # Host variables are parsed once per distinct host of the slice, then joined back
+        hosts_condition = f'''main_host.id IN (SELECT DISTINCT main_jobhostsummary.host_id
+                                               FROM main_jobhostsummary
+                                               WHERE {slice_condition})'''
+
+        query = f'''
+            (WITH host_variables AS ({host_variables_query(hosts_condition)})
+             SELECT main_jobhostsummary.id,
+                    main_jobhostsummary.created,
+                    main_jobhostsummary.modified,
+                    main_jobhostsummary.host_name,
+                    main_jobhostsummary.host_id as host_remote_id,
+                    host_variables.ansible_host_variable,
+                    host_variables.ansible_connection_variable,
+                    -- main_jobhostsummary.constructed_host_id,
+                    main_jobhostsummary.changed,
+                    main_jobhostsummary.dark,
+                    main_jobhostsummary.failures,
+                    main_jobhostsummary.ok,
+                    main_jobhostsummary.processed,
+                    main_jobhostsummary.skipped,
+                    main_jobhostsummary.failed,
+                    main_jobhostsummary.ignored,
+                    main_jobhostsummary.rescued,
+                    main_unifiedjob.created AS job_created,
+                    main_jobhostsummary.job_id AS job_remote_id,
+                    main_unifiedjob.unified_job_template_id AS job_template_remote_id,
+                    main_unifiedjob.name AS job_template_name,
+                    main_inventory.id AS inventory_remote_id,
+                    main_inventory.name AS inventory_name,
+                    main_organization.id AS organization_remote_id,
+                    main_organization.name AS organization_name,
+                    main_unifiedjobtemplate_project.id AS project_remote_id,
+                    main_unifiedjobtemplate_project.name AS project_name
+                    FROM main_jobhostsummary
+                    -- connect to main_job, that has connections into inventory and project
+                    LEFT JOIN main_job ON main_jobhostsummary.job_id = main_job.unifiedjob_ptr_id
+                    -- get project name from project_options
+                    LEFT JOIN main_unifiedjobtemplate AS main_unifiedjobtemplate_project ON main_unifiedjobtemplate_project.id = main_job.project_id
+                    -- get inventory name from main_inventory
+                    LEFT JOIN main_inventory ON main_inventory.id = main_job.inventory_id
+                    -- get job name from main_unifiedjob
+                    LEFT JOIN main_unifiedjob ON main_unifiedjob.id = main_jobhostsummary.job_id
+                    -- get organization name from main_organization
+                    LEFT JOIN main_organization ON main_organization.id = main_unifiedjob.organization_id
+                    -- get variables parsed from main_host
+                    LEFT JOIN host_variables ON host_variables.id = main_jobhostsummary.host_id
+                    WHERE ({slice_condition})
+                    ORDER BY main_jobhostsummary.modified ASC)
+            '''
+
+        return f"COPY {query} TO STDOUT WITH CSV HEADER"
+
+    return _export_table(collection='job_host_summary',
+                         table='main_jobhostsummary',
+                         query=query,
+                         since=since,
+                         until=until,
+                         path=full_path,
+                         prepend_query=prepend_query)
+
+
+@register('job_host_summary_rollup', '1.0', format='csv', description=_('Data for billing aggregated by job and host'),
+          fnc_slicing=daily_slicing)
+def job_host_summary_rollup_table(since, full_path, until, **kwargs):
+    """
+    The job_host_summary aggregated by the columns the billing report groups by, so the
+    report can skip the aggregation of the raw job_host_summary of the same slice. Host
+    names and ansible_host variables are kept apart, the report resolves the host name.
+    """
+    if 'job_host_summary_rollup' not in optional_collectors():
+        return None
+
+    # Functions created already when the slices are gathered concurrently, see Collector
+    prepend_query = None if kwargs.get('pg_functions_created') else pg_functions()
+
+    def query(since, until):
+        slice_condition = "main_jobhostsummary.modified >= '{0}' AND main_jobhostsummary.modified < '{1}'".format(
             since.isoformat(), until.isoformat()
-    )
+        )
 
-    return _copy_table(table='main_jobhostsummary',
-                       query=f"COPY {query} TO STDOUT WITH CSV HEADER",
-                       path=full_path,
-                       prepend_query=prepend_query)
+        hosts_condition = f'''main_host.id IN (SELECT DISTINCT main_jobhostsummary.host_id
+                                               FROM main_jobhostsummary
+                                               WHERE {slice_condition})'''
+
+        query = f'''
+            (WITH host_variables AS ({host_variables_query(hosts_condition)})
+             SELECT main_organization.name AS organization_name,
+                    main_unifiedjob.name AS job_template_name,
+                    main_jobhostsummary.host_name,
+                    host_variables.ansible_host_variable,
+                    main_jobhostsummary.job_id AS job_remote_id,
+                    SUM(main_jobhostsummary.dark +
+                        main_jobhostsummary.failures +
+                        main_jobhostsummary.ok +
+                        main_jobhostsummary.skipped +
+                        main_jobhostsummary.ignored +
+                        main_jobhostsummary.rescued) AS task_runs,
+                    COUNT(*) AS host_runs,
+                    MIN(main_jobhostsummary.created) AS first_automation,
+                    MAX(main_jobhostsummary.created) AS last_automation,
+                    MAX(main_unifiedjob.created) AS job_created
+                    FROM main_jobhostsummary
+                    -- get job name from main_unifiedjob
+                    LEFT JOIN main_unifiedjob ON main_unifiedjob.id = main_jobhostsummary.job_id
+                    -- get organization name from main_organization
+                    LEFT JOIN main_organization ON main_organization.id = main_unifiedjob.organization_id
+                    -- get variables parsed from main_host
+                    LEFT JOIN host_variables ON host_variables.id = main_jobhostsummary.host_id
+                    WHERE ({slice_condition})
+                    GROUP BY main_organization.name,
+                             main_unifiedjob.name,
+                             main_jobhostsummary.host_name,
+                             host_variables.ansible_host_variable,
+                             main_jobhostsummary.job_id)
+            '''
+
+        return f"COPY {query} TO STDOUT WITH CSV HEADER"
+
+    return _export_table(collection='job_host_summary_rollup',
+                         table='main_jobhostsummary_rollup',
+                         query=query,
+                         since=since,
+                         until=until,
+                         path=full_path,
+                         prepend_query=prepend_query)
 
 
 @register('main_jobevent', '1.0', format='csv', description=_('Content usage'), fnc_slicing=daily_slicing)
 def main_jobevent_table(since, full_path, until, **kwargs):
-    if 'main_jobevent' not in optional_collectors():
+    # The rollup mode ships the events aggregated by job, host, module and role, instead of the
+    # raw events, the content usage report reads both formats. The resolved module and role are
+    # picked by the report as for the raw events, so both formats give the same report.
+    rollup = 'main_jobevent_rollup' in optional_collectors()
+    if 'main_jobevent' not in optional_collectors() and not rollup:
         return None
 
     tbl = 'main_jobevent'
     event_data = fr"replace({tbl}.event_data, '\u', '\u005cu')::jsonb"
 
-    query = f'''
-        WITH job_scope AS (
-            SELECT main_jobhostsummary.id AS main_jobhostsummary_id,
-                   main_jobhostsummary.created AS main_jobhostsummary_created,
-                   main_jobhostsummary.modified AS main_jobhostsummary_modified,
-                   main_unifiedjob.created AS job_created,
-                   main_jobhostsummary.job_id AS job_id,
-                   main_jobhostsummary.host_name
-            FROM main_jobhostsummary
-            JOIN main_unifiedjob ON main_unifiedjob.id = main_jobhostsummary.job_id
-            WHERE (main_jobhostsummary.modified >= '{since.isoformat()}' AND main_jobhostsummary.modified < '{until.isoformat()}')
-        )
-        SELECT
-            job_scope.main_jobhostsummary_id,
-            job_scope.main_jobhostsummary_created,
-            {tbl}.id,
-            {tbl}.created,
-            {tbl}.modified,
-            {tbl}.job_created as job_created,
-            {tbl}.event,
-            ({event_data}->>'task_action')::TEXT AS task_action,
-            ({event_data}->>'resolved_action')::TEXT AS resolved_action,
-            ({event_data}->>'resolved_role')::TEXT AS resolved_role,
-            ({event_data}->>'duration')::TEXT AS duration,
-            {tbl}.failed,
-            {tbl}.changed,
-            {tbl}.playbook,
-            {tbl}.play,
-            {tbl}.task,
-            {tbl}.role,
-            {tbl}.job_id as job_remote_id,
-            {tbl}.host_id as host_remote_id,
-            {tbl}.host_name
-
-        FROM {tbl}
-        JOIN job_scope ON job_scope.job_created = {tbl}.job_created AND job_scope.job_id={tbl}.job_id AND job_scope.host_name={tbl}.host_name
-        WHERE {tbl}.event IN ('runner_on_ok',
-                              'runner_on_failed',
-                              'runner_on_unreachable',
-                              'runner_on_skipped',
-                              'runner_retry',
-                              'runner_on_async_ok',
-                              'runner_item_on_ok',
-                              'runner_item_on_failed',
-                              'runner_item_on_skipped')
-        '''
-    return _copy_table(table=tbl,
-                       query=f"COPY ({query}) TO STDOUT WITH CSV HEADER",
-                       path=full_path)
+    if rollup:
+        columns = f'''
+                {tbl}.job_id as job_remote_id,
+                {tbl}.host_name,
+                (parsed.event_data->>'task_action')::TEXT AS task_action,
+                (parsed.event_data->>'resolved_action')::TEXT AS resolved_action,
+                (parsed.event_data->>'resolved_role')::TEXT AS resolved_role,
+                {tbl}.role,
+                COUNT(*) AS task_runs,
+                SUM((parsed.event_data->>'duration')::float8) AS duration
+            '''
+        group_by = "GROUP BY 1, 2, 3, 4, 5, 6"
+    else:
+        columns = f'''
+                job_scope.main_jobhostsummary_id,
+                job_scope.main_jobhostsummary_created,
+                {tbl}.id,
+                {tbl}.created,
+                {tbl}.modified,
+                {tbl}.job_created as job_created,
+                {tbl}.event,
+                (parsed.event_data->>'task_action')::TEXT AS task_action,
+                (parsed.event_data->>'resolved_action')::TEXT AS resolved_action,
+                (parsed.event_data->>'resolved_role')::TEXT AS resolved_role,
+                (parsed.event_data->>'duration')::TEXT AS duration,
+                {tbl}.failed,
+                {tbl}.changed,
+                {tbl}.playbook,
+                {tbl}.play,
+                {tbl}.task,
+                {tbl}.role,
+                {tbl}.job_id as job_remote_id,
+                {tbl}.host_id as host_remote_id,
+                {tbl}.host_name
+            '''
+        group_by = ""
+
+    def query(since, until):
+        query = f'''
+            WITH job_scope AS (
+                SELECT main_jobhostsummary.id AS main_jobhostsummary_id,
+                       main_jobhostsummary.created AS main_jobhostsummary_created,
+                       main_jobhostsummary.modified AS main_jobhostsummary_modified,
+                       main_unifiedjob.created AS job_created,
+                       main_jobhostsummary.job_id AS job_id,
+                       main_jobhostsummary.host_name
+                FROM main_jobhostsummary
+                JOIN main_unifiedjob ON main_unifiedjob.id = main_jobhostsummary.job_id
+                WHERE (main_jobhostsummary.modified >= '{since.isoformat()}' AND main_jobhostsummary.modified < '{until.isoformat()}')
+            )
+            SELECT {columns}
+            FROM {tbl}
+            JOIN job_scope ON job_scope.job_created = {tbl}.job_created AND job_scope.job_id={tbl}.job_id AND job_scope.host_name={tbl}.host_name
+            -- Parse the event_data only once per event, OFFSET 0 keeps the subquery from being flattened
+            CROSS JOIN LATERAL (SELECT {event_data} AS event_data OFFSET 0) AS parsed
+            WHERE {tbl}.event IN ('runner_on_ok',
+                                  'runner_on_failed',
+                                  'runner_on_unreachable',
+                                  'runner_on_skipped',
+                                  'runner_retry',
+                                  'runner_on_async_ok',
+                                  'runner_item_on_ok',
+                                  'runner_item_on_failed',
+                                  'runner_item_on_skipped')
+            -- Events without a task action are not used by the content usage
+            AND (parsed.event_data->>'task_action') <> ''
+            {group_by}
+            '''
+
+        return f"COPY ({query}) TO STDOUT WITH CSV HEADER"
+
+    return _export_table(collection='main_jobevent',
+                         table=tbl,
+                         query=query,
+                         since=since,
+                         until=until,
+                         path=full_path)
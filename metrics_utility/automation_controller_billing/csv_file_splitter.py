@@ -25,3 +25,29 @@ class CsvFileSplitter(BaseCsvFileSplitter):
             os.rename(filename, new_filename)
             self.files.append(new_filename)
         return self.files
+
+
+class BinaryCsvFileSplitter(CsvFileSplitter):
+    """CsvFileSplitter writing bytes-like data (e.g. memoryviews) as they are, without
+    decoding them. Files are split only after writes ending a CSV row, writes are expected
+    to be whole rows, like the rows read from a psycopg3 COPY.
+    """
+
+    def cycle_file(self):
+        """Closes current file, opens new one and writes CSV header"""
+        if self.currentfile:
+            self.currentfile.close()
+        self.counter = 0
+        fname = "{}_split{}".format(self.filespec, len(self.files))
+        self.currentfile = open(fname, "wb")
+        self.files.append(fname)
+        if self.header:
+            self.counter += self.currentfile.write(self.header + b"\n")
+
+    def write(self, data):
+        """Writes to file and creates new one if file exceedes threshold"""
+        if self.header is None:
+            self.header = bytes(data).split(b"\n", 1)[0]
+        self.counter += self.currentfile.write(data)
+        if self.counter >= self.max_file_size and data[-1:] == b"\n":
+            self.cycle_file()
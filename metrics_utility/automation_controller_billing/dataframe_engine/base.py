@@ -1,5 +1,7 @@
 import logging
 import datetime
+import numpy as np
+import pandas as pd
 from dateutil.relativedelta import relativedelta
 
 logger = logging.getLogger(__name__)
@@ -36,6 +38,139 @@ def list_dates(start_date, end_date, granularity):
 
     return dates_arr
 
+
+def fillna(series, value):
+    # Series.fillna() of the categorical columns too, the filled in values are added to the categories
+    if not isinstance(series.dtype, pd.CategoricalDtype):
+        return series.fillna(value)
+
+    values = pd.Series(value).dropna().unique()
+    series = series.cat.add_categories(pd.Index(values, dtype=object).difference(series.cat.categories))
+    if isinstance(value, pd.Series):
+        value = value.astype(series.dtype)
+
+    return series.fillna(value)
+
+
+class ExtractionFailed(Exception):
+    pass
+
+
+def iter_extracted(batches):
+    # Failures of the extraction are told apart from the failures of the engines, which are raised
+    while True:
+        try:
+            data = next(batches)
+        except StopIteration:
+            return
+        except Exception as e:
+            raise ExtractionFailed() from e
+
+        yield data
+
+
+def build_dataframes(extractor, dates, engines):
+    # Scan every partition only once, each batch is fed to all the engines, so the
+    # tarballs are downloaded, extracted and parsed once for all the dataframes
+    columns = {}
+    for engine in engines:
+        engine.reset()
+
+        # Only the columns used by any of the engines are parsed
+        for table, table_columns in engine.table_columns().items():
+            columns.setdefault(table, set()).update(table_columns)
+
+    for path, batches in extractor.iter_dates_tarballs(dates, columns=columns):
+        # Batches of a tarball are staged by the engines until the whole tarball was read,
+        # nothing of a tarball failing to read, e.g. a truncated one, is counted
+        try:
+            for data in iter_extracted(batches):
+                for engine in engines:
+                    engine.process_batch(data)
+        except ExtractionFailed as e:
+            extractor.logger.exception(f"{extractor.LOG_PREFIX} ERROR: Extracting {path} failed with {e.__cause__}")
+            for engine in engines:
+                engine.discard()
+        else:
+            for engine in engines:
+                engine.commit()
+
+    return tuple(engine.result() for engine in engines)
+
+
+class Aggregator:
+    """
+    Incremental group by aggregation of batches, keyed by the index of the partial aggregations.
+
+    Partial aggregations are kept on a stack with a level, adding a partial of the same level as
+    the top of the stack combines both into one of the next level, like a binary counter. Every
+    row is thus re-aggregated only log(number of batches) times, instead of merging the whole
+    rollup with every new batch.
+    """
+    # Operation used to combine already aggregated values, counts of the partials are summed
+    COMBINE_OPERATIONS = {"sum": "sum", "count": "sum", "min": "min", "max": "max"}
+
+    def __init__(self, columns, operations={}):
+        self.operations = {col: self.COMBINE_OPERATIONS[operations.get(col, "sum")] for col in columns}
+        self.partials = []
+
+    def add(self, df):
+        level = 0
+        while self.partials and self.partials[-1][0] == level:
+            _, previous = self.partials.pop()
+            df = self.combine([previous, df])
+            level += 1
+        self.partials.append((level, df))
+
+    def result(self):
+        if not self.partials:
+            return None
+
+        return self.combine([df for _, df in self.partials])
+
+    def combine(self, dfs):
+        if len(dfs) == 1:
+            return dfs[0]
+
+        df = pd.concat(dfs)
+        return df.groupby(level=list(range(df.index.nlevels)), dropna=False, observed=True).agg(self.operations)
+
+
+class Vocabulary:
+    """
+    Dictionary encoding of a string column, stable across the batches. Values get their codes
+    in the order they are first seen and keep them, so the aggregations of all the batches are
+    grouped and merged by the integer codes. Missing values are encoded as -1.
+    """
+    def __init__(self):
+        self.values = pd.Index([], dtype=object)
+
+    def encode(self, series):
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            codes, uniques = series.cat.codes.to_numpy(), series.cat.categories
+        else:
+            codes, uniques = pd.factorize(series)
+
+        if len(uniques) == 0:
+            return pd.Series(-1, index=series.index, dtype='int64')
+
+        mapping = self.values.get_indexer(uniques)
+        if (mapping < 0).any():
+            self.values = self.values.append(pd.Index(uniques[mapping < 0], dtype=object))
+            mapping = self.values.get_indexer(uniques)
+
+        return pd.Series(np.where(codes >= 0, mapping[codes], -1), index=series.index, dtype='int64')
+
+    def decode(self, codes):
+        # Categories are sorted, so the categorical sorts and groups in the order of the strings
+        order = self.values.argsort()
+        ranks = np.empty(len(order), dtype='int64')
+        ranks[order] = np.arange(len(order))
+
+        codes = np.asarray(codes)
+        return pd.Categorical.from_codes(np.where(codes >= 0, ranks[codes], -1), categories=self.values[order])
+
+
 class Base:
     LOG_PREFIX = "[AAPBillingReport] "
 
@@ -46,9 +181,58 @@ class Base:
         self.month = month
         self.extra_params = extra_params
 
+        self.reset()
+
     def build_dataframe(self):
+        return build_dataframes(self.extractor, self.dates(), [self])[0]
+
+    def reset(self):
+        # Rollup of the already processed tarballs
+        self.rollup = Aggregator(self.data_columns() or [], self.data_operations())
+        # Rollup of the batches of the tarball being processed, see commit() and discard()
+        self.staged = Aggregator(self.data_columns() or [], self.data_operations())
+        # Codes of the categorical columns of the rollup
+        self.vocabularies = {column: Vocabulary() for column in self.categorical_columns()}
+
+    def encode(self, df):
+        # Replace the categorical columns by their codes, stable across the batches
+        for column, vocabulary in self.vocabularies.items():
+            df[column] = vocabulary.encode(df[column])
+
+        return df
+
+    def decode(self, df):
+        if not self.vocabularies:
+            return df
+
+        for column, vocabulary in self.vocabularies.items():
+            df[column] = vocabulary.decode(df[column])
+
+        # Rows were sorted by the codes, sort them by the values as they're grouped by
+        return df.sort_values(self.unique_index_columns(), ignore_index=True)
+
+    def process_batch(self, data):
         pass
 
+    def commit(self):
+        # The whole tarball was read, its batches are added to the rollup
+        staged = self.staged.result()
+        if staged is not None:
+            self.rollup.add(staged)
+        self.staged = Aggregator(self.data_columns() or [], self.data_operations())
+
+    def discard(self):
+        # The tarball failed to read, its batches processed so far are dropped
+        self.staged = Aggregator(self.data_columns() or [], self.data_operations())
+
+    def result(self):
+        rollup = self.rollup.result()
+        if rollup is None:
+            return None
+
+        # Tweak types to match the table
+        return self.decode(self.cast_dataframe(rollup, self.cast_types()).reset_index())
+
     def dates(self):
         if self.extra_params.get('since_date') is not None:
             beginning_of_the_month = self.extra_params.get('since_date')
@@ -70,31 +254,31 @@ class Base:
             df.index = df.index.astype(object)
         else:
             # Composite index branch
-            # Casting index field to object
+            # Casting index field to object, codes of the categorical columns are kept
             for index, level in enumerate(df.index.levels):
-                casted_level = df.index.levels[index].astype(object)
-                levels.append(casted_level)
+                if df.index.names[index] in self.vocabularies:
+                    levels.append(level)
+                else:
+                    levels.append(level.astype(object))
 
             df.index = df.index.set_levels(levels)
 
         return df.astype(types)
 
-    def summarize_merged_dataframes(self, df, columns, operations={}):
-        for col in columns:
-            if operations.get(col) == "min":
-                df[col] = df[[f"{col}_x", f"{col}_y"]].min(axis=1)
-            elif operations.get(col) == "max":
-                df[col] = df[[f"{col}_x", f"{col}_y"]].max(axis=1)
-            else:
-                df[col] = df[[f"{col}_x", f"{col}_y"]].sum(axis=1)
-            del df[f"{col}_x"]
-            del df[f"{col}_y"]
-        return df
-
     @staticmethod
     def get_logger():
         return logging.getLogger(__name__)
 
+    @staticmethod
+    def table_columns():
+        # Columns of the gathered tables used by the engine, typed by the schema registry
+        return {}
+
+    @staticmethod
+    def categorical_columns():
+        # Columns of the unique index aggregated by their codes and returned as categoricals
+        return []
+
     @staticmethod
     def unique_index_columns():
         pass
@@ -103,6 +287,11 @@ class Base:
     def data_columns():
         pass
 
+    @staticmethod
+    def data_operations():
+        # Aggregation of data columns across batches, sum if not specified
+        return {}
+
     @staticmethod
     def cast_types():
         pass
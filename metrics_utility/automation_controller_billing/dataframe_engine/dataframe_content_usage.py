@@ -1,11 +1,12 @@
 import logging
 import datetime
+import numpy as np
 import pandas as pd
 import re
 from dateutil.relativedelta import relativedelta
 
 from metrics_utility.automation_controller_billing.dataframe_engine.base \
-    import Base, list_dates, granularity_cast
+    import Base, fillna, list_dates, granularity_cast
 
 logger = logging.getLogger(__name__)
 
@@ -16,93 +17,93 @@ logger = logging.getLogger(__name__)
 class DataframeContentUsage(Base):
     LOG_PREFIX = "[AAPBillingReport] "
 
-    def build_dataframe(self):
-        # A monthly rollup dataframe
-        content_explorer_rollup = None
-
-        for date in self.dates():
-            ###############################
-            # Start a daily rollup code here
-            ###############################
-            for data in self.extractor.iter_batches(date=date):
-                # If the dataframe is empty, skip additional processing
-                events = data['main_jobevent']
-                if events.empty:
-                    continue
-
-                # Filter non relevant rows
-                events = events[events['task_action'].notnull()]
-                events = events[events['host_name'].notnull()]
-
-                # If the dataframe is empty, skip additional processing
-                if events.empty:
-                    continue
-
-                events['install_uuid'] = data['config']['install_uuid']
-
-                # If resolved_action resolved role are not there, fill them with task action
-                # and role
-                events['task_action'] = events.resolved_action.fillna(events.task_action).astype(str)
-                events['role'] = events.resolved_role.fillna(events.role).astype(str)
-                # Only get valid role names into role name
-                events["role"] = events["role"].apply(
-                    lambda x: self.extract_role_name(x))
-
-                # Rename columns to match the reality, they are just names, not normalized cols anymore
-                events.rename(columns={
-                    'task_action': 'module_name',
-                    'role': 'role_name'
-                }, inplace=True)
-
-                events['collection_name'] = events['module_name'].apply(
-                    self.extract_collection_name)
-
-                # Final cleanup if some module names didn't connect, otherwise this will fail
-                # to insert with not null constraint on module_name
-                events = events[events['module_name'].notnull()]
-
-                # Set a human readable values for missing role and collection name
-                events['role_name'] = events['role_name'].fillna("No role used").astype(str)
-                events['collection_name'] = events['collection_name'].fillna("No collection used").astype(str)
-
-                ################################
-                # Do the aggregation
-                ################################
-                events_group = events.groupby(
-                    self.unique_index_columns(), dropna=False
-                ).agg(
-                    task_runs=('module_name', 'count'),
-                    duration=('duration', "sum"))
-
-                # Duration is null in older versions of Controller
-                events_group['duration'] = events_group.duration.fillna(0)
-                # Tweak types to match the table
-                events_group = self.cast_dataframe(events_group, self.cast_types())
-
-                ################################
-                # Merge aggregations of multiple batches
-                ################################
-                if content_explorer_rollup is None:
-                    content_explorer_rollup = events_group
-                else:
-                    # Multipart collection, merge the dataframes and sum counts
-                    content_explorer_rollup = pd.merge(
-                        content_explorer_rollup.loc[:, ],
-                        events_group.loc[:, ],
-                        on=self.unique_index_columns(),
-                        how='outer')
-
-                    content_explorer_rollup = self.summarize_merged_dataframes(
-                        content_explorer_rollup, self.data_columns())
-
-                    # Tweak types to match the table
-                    content_explorer_rollup = self.cast_dataframe(
-                        content_explorer_rollup, self.cast_types())
-
-        if content_explorer_rollup is None:
-            return None
+    def process_batch(self, data):
+        # If the dataframe is empty, skip additional processing
+        events = data['main_jobevent']
+        if events.empty:
+            return
+
+        # Events gathered in the rollup mode are already aggregated by job, host, module and
+        # role, with the task runs counted
+        aggregated = 'task_runs' in events.columns
+
+        # Filter non relevant rows
+        events = events[events['task_action'].notnull()]
+        events = events[events['host_name'].notnull()]
+
+        # If the dataframe is empty, skip additional processing
+        if events.empty:
+            return
+
+        events['install_uuid'] = data['config']['install_uuid']
+
+        # If resolved_action resolved role are not there, fill them with task action
+        # and role
+        events['task_action'] = fillna(events.resolved_action, events.task_action)
+        events['role'] = fillna(events.resolved_role, events.role)
+        # Only get valid role names into role name
+        events["role"] = self.map_distinct(events["role"], self.extract_role_name)
+
+        # Rename columns to match the reality, they are just names, not normalized cols anymore
+        events.rename(columns={
+            'task_action': 'module_name',
+            'role': 'role_name'
+        }, inplace=True)
+
+        events['collection_name'] = self.map_distinct(events['module_name'], self.extract_collection_name)
+
+        # Final cleanup if some module names didn't connect, otherwise this will fail
+        # to insert with not null constraint on module_name
+        events = events[events['module_name'].notnull()]
+
+        # Set a human readable values for missing role and collection name
+        events['role_name'] = events['role_name'].fillna("No role used").astype(str)
+        events['collection_name'] = events['collection_name'].fillna("No collection used").astype(str)
+
+        ################################
+        # Do the aggregation
+        ################################
+        events_group = self.encode(events).groupby(
+            self.unique_index_columns(), dropna=False, observed=True
+        ).agg(
+            task_runs=('task_runs', 'sum') if aggregated else ('module_name', 'count'),
+            duration=('duration', "sum"))
+
+        # Duration is null in older versions of Controller
+        events_group['duration'] = events_group.duration.fillna(0)
+        # Tweak types to match the table
+        events_group = self.cast_dataframe(events_group, self.cast_types())
+
+        ################################
+        # Merge aggregations of multiple batches
+        ################################
+        self.staged.add(events_group)
+
+    def reset(self):
+        super().reset()
+
+        # Parsed module and role names, kept for all the batches
+        self.parsed_names = {}
+
+    def map_distinct(self, series, function):
+        """
+        Apply the function to every distinct value of the series only, the values are passed as
+        strings, the missing ones as 'nan'. Results are memoized across the batches.
+        """
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            codes, uniques = series.cat.codes.to_numpy(), series.cat.categories
+        else:
+            codes, uniques = pd.factorize(series)
 
-        return content_explorer_rollup.reset_index()
+        cache = self.parsed_names.setdefault(function, {})
+        results = []
+        # The last result is for the missing values, coded as -1
+        for value in [*map(str, uniques), str(np.nan)]:
+            if value not in cache:
+                cache[value] = function(value)
+            results.append(cache[value])
+
+        return pd.Series(np.array(results, dtype=object)[codes], index=series.index)
 
     @staticmethod
     def collection_regexp():
@@ -139,6 +140,17 @@ class DataframeContentUsage(Base):
         else:
             return None
 
+    @staticmethod
+    def table_columns():
+        return {
+            'main_jobevent': ['host_name', 'task_action', 'resolved_action', 'role', 'resolved_role',
+                              'job_remote_id', 'duration', 'task_runs'],
+        }
+
+    @staticmethod
+    def categorical_columns():
+        return ['host_name', 'module_name', 'collection_name', 'role_name', 'install_uuid']
+
     @staticmethod
     def unique_index_columns():
         return ['host_name', 'module_name', 'collection_name', 'role_name', 'install_uuid', 'job_remote_id']
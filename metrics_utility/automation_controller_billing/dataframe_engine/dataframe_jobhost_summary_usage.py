@@ -1,10 +1,12 @@
+import functools
 import logging
 import datetime
+import os
 import pandas as pd
 from dateutil.relativedelta import relativedelta
 
 from metrics_utility.automation_controller_billing.dataframe_engine.base \
-    import Base, list_dates
+    import Aggregator, Base, fillna, list_dates
 
 logger = logging.getLogger(__name__)
 
@@ -15,88 +17,231 @@ logger = logging.getLogger(__name__)
 class DataframeJobhostSummaryUsage(Base):
     LOG_PREFIX = "[AAPBillingReport] "
 
-    def build_dataframe(self):
-        # A daily rollup dataframe
-        billing_data_monthly_rollup = None
+    def reset(self):
+        super().reset()
 
-        for date in self.dates():
-            ###############################
-            # Generate the monthly dataset for report
-            ###############################
+        # Aggregations of the raw job_host_summary by gathered slice, with the tarballs and the
+        # time range of the slice. The job_host_summary_rollup replaces the raw rows modified
+        # within its time range, the raw and rollup slices don't have to match, see result()
+        self.slice_rollups = {}
+        self.slice_paths = {}
+        self.slice_ranges = {}
+        # Time ranges of the job_host_summary_rollup by install_uuid
+        self.rollup_ranges = {}
+        # Raw aggregations, rollup and time ranges of the tarball being processed
+        self.staged_slice_rollups = {}
+        self.staged_rollup = None
+        self.staged_ranges = {}
 
-            for data in self.extractor.iter_batches(date=date):
-                # If the dataframe is empty, skip additional processing
+    def process_batch(self, data):
+        if not data['job_host_summary_rollup'].empty:
+            self.process_rollup_batch(data)
+
+        if not data['data_collection_status'].empty:
+            self.process_status_batch(data)
+
+        # If the dataframe is empty, skip additional processing
+        billing_data = data['job_host_summary']
+        if billing_data.empty:
+            return
+
+        # Slices already replaced by the rollups are skipped, the time range of the tarball name
+        # is rounded down to seconds
+        since, until = data['slice_range'] or (None, None)
+        install_uuid = data['config']['install_uuid']
+        if since is not None and self.replaced_ranges(install_uuid, since, until + pd.Timedelta(seconds=1)) == 'all':
+            return
+
+        if data['slice'] not in self.staged_slice_rollups:
+            self.staged_slice_rollups[data['slice']] = (data['path'], data['slice_range'], install_uuid,
+                                                        Aggregator(self.data_columns(), self.data_operations()))
+        self.staged_slice_rollups[data['slice']][3].add(self.aggregate_batch(billing_data, data['config']))
+
+    def aggregate_batch(self, billing_data, config):
+        billing_data['organization_name'] = fillna(billing_data.organization_name, "No organization name")
+        billing_data['install_uuid'] = config['install_uuid']
+
+        # Store the original host name for mapping purposes
+        billing_data['original_host_name'] = billing_data['host_name']
+        if 'ansible_host_variable' in billing_data.columns:
+            # Replace missing ansible_host_variable with host name
+            billing_data['ansible_host_variable'] = fillna(billing_data.ansible_host_variable, billing_data['host_name'])
+            # And use the new ansible_host_variable instead of host_name, since
+            # what is in ansible_host_variable should be the actual host we count
+            billing_data['host_name'] = billing_data['ansible_host_variable']
+
+        # Sumarize all task counts into 1 col
+        def sum_columns(row):
+            return sum([row[i] for i in ['dark', 'failures', 'ok', 'skipped', 'ignored',  'rescued']])
+        billing_data['task_runs'] = billing_data.apply(sum_columns, axis=1)
+
+        billing_data['created'] = pd.to_datetime(
+            billing_data['created']).dt.tz_localize(None)
+
+        billing_data['job_created'] = pd.to_datetime(
+            billing_data['job_created']).dt.tz_localize(None)
+
+        # Runs of the missing host names are not counted
+        billing_data['host_runs'] = billing_data['host_name'].notna()
+
+        ################################
+        # Do the aggregation
+        ################################
+
+        billing_data_group = self.encode(billing_data).groupby(
+            self.unique_index_columns(), dropna=False, observed=True
+        ).agg(
+            task_runs=('task_runs', 'sum'),
+            host_runs=('host_runs', 'sum'),
+            first_automation=('created', 'min'),
+            last_automation=('created', 'max'),
+            job_created=('job_created', 'max'),
+            )
+
+        # Tweak types to match the table
+        return self.cast_dataframe(billing_data_group, self.cast_types())
+
+    def process_rollup_batch(self, data):
+        self.staged_rollup = (data['slice_range'], data['config']['install_uuid'])
+
+        rollup_data = data['job_host_summary_rollup']
+        rollup_data['organization_name'] = fillna(rollup_data.organization_name, "No organization name")
+        rollup_data['install_uuid'] = data['config']['install_uuid']
+
+        # Same host name resolution as for the raw rows, rows of the gathered groups can
+        # fall into one group here, e.g. the missing and the empty ansible_host variables
+        rollup_data['original_host_name'] = rollup_data['host_name']
+        rollup_data['host_name'] = fillna(rollup_data.ansible_host_variable, rollup_data['host_name'])
+        # Runs of the missing host names are not counted
+        rollup_data['host_runs'] = rollup_data['host_runs'].where(rollup_data['host_name'].notna(), 0)
+
+        for column in ['first_automation', 'last_automation', 'job_created']:
+            rollup_data[column] = pd.to_datetime(rollup_data[column]).dt.tz_localize(None)
+
+        rollup_data_group = self.encode(rollup_data).groupby(
+            self.unique_index_columns(), dropna=False, observed=True
+        ).agg(
+            task_runs=('task_runs', 'sum'),
+            host_runs=('host_runs', 'sum'),
+            first_automation=('first_automation', 'min'),
+            last_automation=('last_automation', 'max'),
+            job_created=('job_created', 'max'),
+            )
+
+        self.staged.add(self.cast_dataframe(rollup_data_group, self.cast_types()))
+
+    def process_status_batch(self, data):
+        # Exact time ranges of the gathered tables, the tarball names are rounded down to seconds
+        status = data['data_collection_status']
+        if not {'file_name', 'since', 'until'}.issubset(status.columns):
+            return
+
+        for row in status.itertuples():
+            table, _ = os.path.splitext(str(row.file_name))
+            if pd.notna(row.since) and pd.notna(row.until):
+                self.staged_ranges[table] = (row.since, row.until)
+
+    def commit(self):
+        super().commit()
+
+        if self.staged_rollup is not None:
+            slice_range, install_uuid = self.staged_rollup
+            slice_range = self.staged_ranges.get('job_host_summary_rollup', slice_range)
+            if slice_range is not None:
+                self.rollup_ranges.setdefault(install_uuid, []).append(slice_range)
+
+        for raw_slice, (path, slice_range, install_uuid, staged_slice_rollup) in self.staged_slice_rollups.items():
+            if raw_slice not in self.slice_rollups:
+                self.slice_rollups[raw_slice] = Aggregator(self.data_columns(), self.data_operations())
+                self.slice_paths[raw_slice] = []
+            self.slice_rollups[raw_slice].add(staged_slice_rollup.result())
+            self.slice_paths[raw_slice].append(path)
+
+            # Ranges of all the tarballs of a slice are the same
+            slice_range = self.staged_ranges.get('job_host_summary', slice_range)
+            self.slice_ranges[raw_slice] = (install_uuid, slice_range)
+
+        self.discard()
+
+    def discard(self):
+        super().discard()
+
+        self.staged_slice_rollups = {}
+        self.staged_rollup = None
+        self.staged_ranges = {}
+
+    def replaced_ranges(self, install_uuid, since, until):
+        """
+        Returns the time ranges of the rollups replacing the raw rows of the range, or 'all'
+        if the rollups cover the whole range
+        """
+        ranges = sorted((max(since, range_since), min(until, range_until))
+                        for range_since, range_until in self.rollup_ranges.get(install_uuid, [])
+                        if range_since < until and range_until > since)
+
+        covered_until = since
+        for range_since, range_until in ranges:
+            if range_since > covered_until:
+                break
+            covered_until = max(covered_until, range_until)
+
+        return 'all' if covered_until >= until else ranges
+
+    def result(self):
+        for raw_slice, slice_rollup in self.slice_rollups.items():
+            install_uuid, slice_range = self.slice_ranges[raw_slice]
+            replaced_ranges = self.replaced_ranges(install_uuid, *slice_range) if slice_range is not None else []
+
+            if replaced_ranges == 'all':
+                # The rollups replace the whole raw slice
+                continue
+            elif replaced_ranges:
+                # The rollups replace a part of the raw slice, e.g. the collectors were gathered
+                # since different times, its rows are read again without the replaced ones
+                self.rollup.add(self.reaggregate_slice(raw_slice, replaced_ranges))
+            else:
+                self.rollup.add(slice_rollup.result())
+        self.slice_rollups = {}
+
+        return super().result()
+
+    def reaggregate_slice(self, raw_slice, replaced_ranges):
+        slice_rollup = Aggregator(self.data_columns(), self.data_operations())
+
+        for path in self.slice_paths[raw_slice]:
+            self.logger.info(f"{self.LOG_PREFIX}Reading {path} again without the rows of the job_host_summary_rollup")
+            batches = self.extractor.iter_path_batches(path, functools.partial(self.extractor.open_tarball, path),
+                                                       self.extractor.batch_size(), self.table_columns())
+            for data in batches:
                 billing_data = data['job_host_summary']
                 if billing_data.empty:
                     continue
 
-                billing_data['organization_name'] = billing_data.organization_name.fillna("No organization name")
-                billing_data['install_uuid'] = data['config']['install_uuid']
-
-                # Store the original host name for mapping purposes
-                billing_data['original_host_name'] = billing_data['host_name']
-                if 'ansible_host_variable' in billing_data.columns:
-                    # Replace missing ansible_host_variable with host name
-                    billing_data['ansible_host_variable'] = billing_data.ansible_host_variable.fillna(billing_data['host_name'])
-                    # And use the new ansible_host_variable instead of host_name, since
-                    # what is in ansible_host_variable should be the actual host we count
-                    billing_data['host_name'] = billing_data['ansible_host_variable']
-
-                # Sumarize all task counts into 1 col
-                def sum_columns(row):
-                    return sum([row[i] for i in ['dark', 'failures', 'ok', 'skipped', 'ignored',  'rescued']])
-                billing_data['task_runs'] = billing_data.apply(sum_columns, axis=1)
-
-                billing_data['created'] = pd.to_datetime(
-                    billing_data['created']).dt.tz_localize(None)
-
-                billing_data['job_created'] = pd.to_datetime(
-                    billing_data['job_created']).dt.tz_localize(None)
-
-                ################################
-                # Do the aggregation
-                ################################
-
-                billing_data_group = billing_data.groupby(
-                    self.unique_index_columns(), dropna=False
-                ).agg(
-                    task_runs=('task_runs', 'sum'),
-                    host_runs=('host_name', 'count'),
-                    first_automation=('created', 'min'),
-                    last_automation=('created', 'max'),
-                    job_created=('job_created', 'max'),
-                    )
-
-                # Tweak types to match the table
-                billing_data_group = self.cast_dataframe(billing_data_group, self.cast_types())
-
-                ################################
-                # Merge aggregations of multiple batches
-                ################################
-                if billing_data_monthly_rollup is None:
-                    billing_data_monthly_rollup = billing_data_group
-                else:
-                    # Multipart collection, merge the dataframes and sum counts
-                    billing_data_monthly_rollup = pd.merge(
-                        billing_data_monthly_rollup.loc[:, ],
-                        billing_data_group.loc[:, ],
-                        on=self.unique_index_columns(),
-                        how='outer')
-
-                    billing_data_monthly_rollup = self.summarize_merged_dataframes(
-                        billing_data_monthly_rollup, self.data_columns(),
-                        operations={"first_automation": "min",
-                                    "last_automation": "max",
-                                    "job_created": "max"})
-
-                    # Tweak types to match the table
-                    billing_data_monthly_rollup = self.cast_dataframe(
-                        billing_data_monthly_rollup, self.cast_types())
-
-        if billing_data_monthly_rollup is None:
-            return None
-
-        return billing_data_monthly_rollup.reset_index()
+                replaced = pd.Series(False, index=billing_data.index)
+                for since, until in replaced_ranges:
+                    replaced |= (billing_data['modified'] >= since) & (billing_data['modified'] < until)
+
+                billing_data = billing_data[~replaced.to_numpy()].copy()
+                if not billing_data.empty:
+                    slice_rollup.add(self.aggregate_batch(billing_data, data['config']))
+
+        return slice_rollup.result()
+
+    @staticmethod
+    def table_columns():
+        return {
+            'job_host_summary': ['organization_name', 'job_template_name', 'host_name', 'ansible_host_variable',
+                                 'job_remote_id', 'dark', 'failures', 'ok', 'skipped', 'ignored', 'rescued',
+                                 'created', 'modified', 'job_created'],
+            'job_host_summary_rollup': ['organization_name', 'job_template_name', 'host_name', 'ansible_host_variable',
+                                        'job_remote_id', 'task_runs', 'host_runs', 'first_automation',
+                                        'last_automation', 'job_created'],
+            'data_collection_status': ['file_name', 'since', 'until'],
+        }
+
+    @staticmethod
+    def categorical_columns():
+        return ['organization_name', 'job_template_name', 'host_name', 'original_host_name', 'install_uuid']
 
     @staticmethod
     def unique_index_columns():
@@ -106,6 +251,12 @@ class DataframeJobhostSummaryUsage(Base):
     def data_columns():
         return ['host_runs', 'task_runs', 'first_automation', 'last_automation', 'job_created']
 
+    @staticmethod
+    def data_operations():
+        return {"first_automation": "min",
+                "last_automation": "max",
+                "job_created": "max"}
+
     @staticmethod
     def cast_types():
         return {'task_runs': int,
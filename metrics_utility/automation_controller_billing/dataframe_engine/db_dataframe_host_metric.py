@@ -6,6 +6,7 @@ from dateutil.relativedelta import relativedelta
 
 from metrics_utility.automation_controller_billing.dataframe_engine.base \
     import Base, list_dates, granularity_cast
+from metrics_utility.automation_controller_billing.schema import parse_timestamps
 
 logger = logging.getLogger(__name__)
 
@@ -30,7 +31,8 @@ class DBDataframeHostMetric(Base):
                 continue
 
             # host_metric['install_uuid'] = data['config']['install_uuid']
-            host_metric["last_deleted"] = pd.to_datetime(host_metric['last_deleted'])
+            # Timestamps by the schema registry, e.g. last_deleted is mostly missing
+            host_metric = parse_timestamps(host_metric, 'host_metric')
 
             if host_metric_concat is None:
                 host_metric_concat = host_metric
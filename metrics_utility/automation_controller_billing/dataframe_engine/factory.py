@@ -7,6 +7,8 @@ from metrics_utility.automation_controller_billing.dataframe_engine.dataframe_co
 from metrics_utility.automation_controller_billing.dataframe_engine.db_dataframe_host_metric \
     import DBDataframeHostMetric
 
+from metrics_utility.automation_controller_billing.dataframe_engine.base import build_dataframes
+
 from metrics_utility.exceptions import NotSupportedFactory
 
 
@@ -20,19 +22,22 @@ class Factory:
 
     def create(self):
         if self.report_type == "CCSP":
-            return (self._get_dataframe_jobhost_summary_usage().build_dataframe(),
-                    self._get_dataframe_content_usage().build_dataframe())
+            return self._build_dataframes(self._get_dataframe_jobhost_summary_usage(),
+                                          self._get_dataframe_content_usage())
         elif self.report_type == "CCSPv2":
-            return (self._get_dataframe_jobhost_summary_usage().build_dataframe(),
-                    self._get_dataframe_content_usage().build_dataframe())
+            return self._build_dataframes(self._get_dataframe_jobhost_summary_usage(),
+                                          self._get_dataframe_content_usage())
         elif self.report_type == "RENEWAL_GUIDANCE":
             return (self._get_db_dataframe_host_metric_usage().build_dataframe(),)
         elif self.report_type == "RENEWAL_GUIDANCEv2":
-            return (self._get_dataframe_jobhost_summary_usage().build_dataframe(),
-                    self._get_dataframe_content_usage().build_dataframe())
+            return self._build_dataframes(self._get_dataframe_jobhost_summary_usage(),
+                                          self._get_dataframe_content_usage())
         else:
             raise NotSupportedFactory(f"Factory for {self.ship_target} not supported")
 
+    def _build_dataframes(self, *engines):
+        # Build all the dataframes from a single scan of the extracted data
+        return build_dataframes(self.extractor, engines[0].dates(), engines)
 
     def _get_dataframe_jobhost_summary_usage(self):
         # Return default S3 loader
@@ -0,0 +1,261 @@
+import datetime
+import functools
+import io
+import json
+import logging
+import os
+import re
+import shutil
+import tarfile
+import tempfile
+from contextlib import closing
+
+import pandas as pd
+
+from metrics_utility.automation_controller_billing import schema
+from metrics_utility.exceptions import MissingRequiredFile
+
+# Names of the tarballs of a gathered slice, <install uuid>-<since>-<until>
+TARBALL_SLICE_RANGE = re.compile(r'^.+-(?P<since>\d{4}-\d{2}-\d{2}-\d{6}[+-]\d{4})-(?P<until>\d{4}-\d{2}-\d{2}-\d{6}[+-]\d{4})$')
+
+
+class TarballMemberReader(io.RawIOBase):
+    # Tarball members of a stream mode tarfile can't tell they are not seekable,
+    # which the CSV parser asks for
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        data = self.fileobj.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+
+class Base:
+    LOG_PREFIX = "[Extractor]"
+
+    # Tables read from the collected tarballs
+    TABLES = ['job_host_summary', 'job_host_summary_rollup', 'main_jobevent', 'data_collection_status']
+
+    # Tarballs written before the config.json was stored first have the tables ahead of
+    # it, these are spooled in memory up to this size and then in a temporary file
+    SPOOL_MAX_SIZE = 64 * 1024 * 1024
+
+    READ_BUFFER_SIZE = 1024 * 1024
+
+    # Formats of the gathered tables, Parquet needs the optional pyarrow dependency
+    TABLE_EXTENSIONS = ['.csv', '.parquet']
+
+    def __init__(self, extra_params, logger=logging.getLogger(__name__)):
+        self.extra_params = extra_params
+
+        self.logger = logger
+
+    def _get_path_prefix(self, date):
+        path_prefix = f"{self.path}/data"
+
+        year = date.strftime("%Y")
+        month = date.strftime("%m")
+        day = date.strftime("%d")
+
+        path = f"{path_prefix}/{year}/{month}/{day}"
+
+        return path
+
+    def get_report_path(self, date):
+        path_prefix = f"{self.path}/reports"
+
+        year = date.strftime("%Y")
+        month = date.strftime("%m")
+
+        path = f"{path_prefix}/{year}/{month}"
+
+        return path
+
+    def iter_batches(self, date, columns=None, batch_size=None):
+        return self.iter_dates_batches([date], columns=columns, batch_size=batch_size)
+
+    def iter_dates_batches(self, dates, columns=None, batch_size=None):
+        """
+        Read the tables of each tarball in batches of batch_size rows, every batch contains
+        one table, the config and the gathered slice of the tarball, other tables are empty.
+
+        A tarball failing to read is logged and skipped, the batches read from it before the
+        failure were already yielded though, see iter_dates_tarballs.
+
+        :param columns: optional dict of the columns to read by table, other columns are skipped
+        """
+        for path, batches in self.iter_dates_tarballs(dates, columns=columns, batch_size=batch_size):
+            try:
+                yield from batches
+            except Exception as e:
+                self.logger.exception(f"{self.LOG_PREFIX} ERROR: Extracting {path} failed with {e}")
+
+    def iter_dates_tarballs(self, dates, columns=None, batch_size=None):
+        """
+        Yields the path and the batches of each tarball, the batches are read as they are
+        iterated. Iterating the batches raises if the tarball can't be read completely, e.g. it
+        is truncated or it misses the config.json, the batches of the tarball processed so far
+        are then to be discarded by the caller.
+
+        :param columns: optional dict of the columns to read by table, other columns are skipped
+        """
+        if batch_size is None:
+            batch_size = self.batch_size()
+
+        for path, open_tarball in self.iter_tarballs(dates):
+            yield path, self.iter_path_batches(path, open_tarball, batch_size, columns or {})
+
+    def iter_path_batches(self, path, open_tarball, batch_size, columns={}):
+        # Stream the tarball, members are parsed as they are decompressed,
+        # without extracting them to the disk
+        with closing(open_tarball()) as fileobj, \
+                tarfile.open(fileobj=fileobj, mode='r|*') as tar:
+            for batch in self.iter_tarball_batches(tar, batch_size, columns):
+                batch['slice'] = self.tarball_slice(path)
+                batch['slice_range'] = self.tarball_slice_range(path)
+                batch['path'] = path
+                yield batch
+
+    def iter_tarballs(self, dates):
+        # Yields the path of every tarball of the dates, with a callable opening it
+        for date in dates:
+            self.logger.info(f"{self.LOG_PREFIX} Processing {date}")
+
+            for path in self.fetch_partition_paths(date):
+                yield path, functools.partial(self.open_tarball, path)
+
+    def iter_tarball_batches(self, tar, batch_size, columns={}):
+        config = None
+        # Tables preceding the config.json in the tarball, spooled until the config is read
+        spooled = []
+
+        try:
+            for member in tar:
+                if not self.tarball_sanitize_member(member):
+                    continue
+
+                name = os.path.normpath(member.name)
+                table, extension = os.path.splitext(name)
+                if name == 'config.json':
+                    config = self.load_config(tar.extractfile(member))
+
+                    for table, extension, spool in spooled:
+                        spool.seek(0)
+                        yield from self.iter_table_batches(table, extension, spool, config, batch_size, columns.get(table))
+                        spool.close()
+                    spooled = []
+
+                elif table in self.TABLES and extension in self.TABLE_EXTENSIONS:
+                    if config is not None and extension == '.csv':
+                        member_reader = io.BufferedReader(TarballMemberReader(tar.extractfile(member)),
+                                                          buffer_size=self.READ_BUFFER_SIZE)
+                        yield from self.iter_table_batches(table, extension, member_reader, config, batch_size,
+                                                           columns.get(table))
+                    elif config is not None:
+                        # Parquet is read from its footer, it needs a seekable file
+                        with tempfile.SpooledTemporaryFile(max_size=self.SPOOL_MAX_SIZE) as spool:
+                            shutil.copyfileobj(tar.extractfile(member), spool)
+                            spool.seek(0)
+                            yield from self.iter_table_batches(table, extension, spool, config, batch_size,
+                                                               columns.get(table))
+                    else:
+                        spool = tempfile.SpooledTemporaryFile(max_size=self.SPOOL_MAX_SIZE)
+                        spooled.append((table, extension, spool))
+                        shutil.copyfileobj(tar.extractfile(member), spool)
+
+            if config is None:
+                # Tables can't be processed without the config, e.g. the install_uuid
+                raise MissingRequiredFile("missing config.json in the tarball")
+        finally:
+            for _, _, spool in spooled:
+                spool.close()
+
+    def iter_table_batches(self, table, extension, fileobj, config, batch_size, columns=None):
+        if extension == '.parquet':
+            yield from self.iter_parquet_batches(table, fileobj, config, batch_size, columns)
+            return
+
+        # Columns missing in the CSV, e.g. gathered by older versions, are skipped
+        usecols = (lambda column: column in columns) if columns is not None else None
+        with pd.read_csv(fileobj, chunksize=batch_size, usecols=usecols,
+                         dtype=schema.pandas_types(table, columns),
+                         true_values=schema.TRUE_VALUES,
+                         false_values=schema.FALSE_VALUES) as reader:
+            for chunk in reader:
+                yield self.batch(table, schema.parse_timestamps(chunk, table), config)
+
+    def iter_parquet_batches(self, table, fileobj, config, batch_size, columns=None):
+        import pyarrow.parquet
+
+        parquet_file = pyarrow.parquet.ParquetFile(fileobj)
+        if columns is not None:
+            columns = [column for column in parquet_file.schema_arrow.names if column in columns]
+
+        names = columns or parquet_file.schema_arrow.names
+        categories = [column for column, pandas_type in schema.pandas_types(table, names).items()
+                      if pandas_type == 'category']
+
+        for record_batch in parquet_file.iter_batches(batch_size=batch_size, columns=columns):
+            dataframe = record_batch.to_pandas(categories=categories, types_mapper=self.parquet_types_mapper)
+            yield self.batch(table, dataframe, config)
+
+    @staticmethod
+    def parquet_types_mapper(arrow_type):
+        # Same types as read from the CSV, integers and booleans keep their missing values
+        import pyarrow as pa
+
+        return {
+            pa.int64(): pd.Int64Dtype(),
+            pa.bool_(): pd.BooleanDtype(),
+        }.get(arrow_type)
+
+    def batch(self, table, dataframe, config):
+        batch = {name: pd.DataFrame([{}]) for name in self.TABLES}
+        batch[table] = dataframe
+        batch['config'] = config
+
+        return batch
+
+    def open_tarball(self, path):
+        # Returns a readable binary file object of the tarball
+        return open(path, 'rb')
+
+    def fetch_partition_paths(self, date):
+        pass
+
+    @staticmethod
+    def tarball_sanitize_member(member):
+        if member.isdir() or not member.isfile():
+            return False
+        if not member.name.endswith(("json", "csv", "parquet")):
+            return False
+        if ".." in member.path:
+            return False
+
+        return True
+
+    @staticmethod
+    def tarball_slice(path):
+        # Tarballs of one gathered slice are named <install uuid>-<since>-<until>-<index>.tar.gz
+        return os.path.basename(path).rsplit('-', 1)[0]
+
+    @staticmethod
+    def tarball_slice_range(path):
+        # Since and until of the gathered slice, rounded down to seconds, or None if not named so
+        match = TARBALL_SLICE_RANGE.match(Base.tarball_slice(path))
+        if match is None:
+            return None
+
+        return tuple(pd.Timestamp(datetime.datetime.strptime(match.group(name), '%Y-%m-%d-%H%M%S%z'))
+                     for name in ('since', 'until'))
+
+    def load_config(self, fileobj):
+        return json.loads(fileobj.read())
+
+    @staticmethod
+    def batch_size():
+        return 100000
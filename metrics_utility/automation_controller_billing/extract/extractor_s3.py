@@ -1,124 +1,79 @@
+import collections
+import functools
 import io
-import json
 import logging
 import os
-import tarfile
-import tempfile
-
-import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
 
+from metrics_utility.automation_controller_billing.extract.base import Base
 from metrics_utility.automation_controller_billing.base.s3_handler import S3Handler
 
 
-class ExtractorS3():
+class ExtractorS3(Base):
     LOG_PREFIX = "[ExtractorS3]"
 
     def __init__(self, extra_params, logger=logging.getLogger(__name__)):
-        super().__init__()
+        super().__init__(extra_params, logger=logger)
 
         self.extension = "parquet"
         self.path = extra_params["ship_path"]
-        self.extra_params = extra_params
-
-        self.logger = logger
 
         self.s3_handler = S3Handler(params=self.extra_params)
 
-    def _get_path_prefix(self, date):
-        path_prefix = f"{self.path}/data"
-
-        year = date.strftime("%Y")
-        month = date.strftime("%m")
-        day = date.strftime("%d")
-
-        path = f"{path_prefix}/{year}/{month}/{day}"
-
-        return path
-
-    def get_report_path(self, date):
-        path_prefix = f"{self.path}/reports"
-
-        year = date.strftime("%Y")
-        month = date.strftime("%m")
-
-        path = f"{path_prefix}/{year}/{month}"
-
-        return path
-
-    def iter_batches(self, date, columns=None, batch_size=None):
-        if batch_size is None:
-            batch_size = self.batch_size()
-        # Read parquet in memory in batches
-        self.logger.info(f"{self.LOG_PREFIX} Processing {date}")
-        s3_paths = self.fetch_partition_paths(date)
+    def open_tarball(self, path):
+        # Stream the object body, without a local copy of the tarball
+        return self.s3_handler.open_file(path)
 
-        if batch_size is None:
-            batch_size = self.batch_size()
+    def iter_tarballs(self, dates):
+        prefetch_partitions = self.prefetch_partitions()
+        if prefetch_partitions < 1:
+            yield from super().iter_tarballs(dates)
+            return
 
-        for s3_path in s3_paths:
-            with tempfile.TemporaryDirectory(prefix="automation_controller_billing_data_") as temp_dir:
-                try:
-                    local_path = os.path.join(temp_dir, 'source_tarball')
-                    self.s3_handler.download_file(s3_path, local_path)
+        # Download the next tarballs in background threads while the current one is processed,
+        # prefetched tarballs are kept in memory, up to prefetch_max_bytes in total
+        prefetch_max_bytes = self.prefetch_max_bytes()
 
-                    tar = tarfile.open(local_path)
+        partitions = self.iter_partitions(dates)
+        partition = next(partitions, None)
+        prefetched = collections.deque()
+        prefetched_bytes = 0
 
-                    try:
-                        # The filter param is available in Python 3.9.17
-                        tar.extractall(path=temp_dir, filter='data', members=self.tarball_sanitize_members(tar))
-                    except TypeError:
-                        # Trying without filter for older python versions
-                        tar.extractall(path=temp_dir, members=self.tarball_sanitize_members(tar))
-                    finally:
-                        tar.close()
-
-                    config = self.load_config(os.path.join(temp_dir, 'config.json'))
-
-                    # # TODO: read the csvs in batches
-                    # for chunk in pd.read_csv(filename, chunksize=chunksize):
-                    # # chunk is a DataFrame. To "process" the rows in the chunk:
-                    # for index, row in chunk.iterrows():
-                    #     print(row)
-
-                    if os.path.exists(os.path.join(temp_dir, 'job_host_summary.csv')):
-                        job_host_summary = pd.read_csv(os.path.join(temp_dir, 'job_host_summary.csv'))
-                    else:
-                        job_host_summary = pd.DataFrame([{}])
-
-                    if os.path.exists(os.path.join(temp_dir, 'main_jobevent.csv')):
-                        main_jobevent = pd.read_csv(os.path.join(temp_dir, 'main_jobevent.csv'))
-                    else:
-                        main_jobevent = pd.DataFrame([{}])
-
-                    yield {'main_jobevent': main_jobevent,
-                           'job_host_summary': job_host_summary,
-                           'config': config}
-
-                except Exception as e:
-                    self.logger.exception(f"{self.LOG_PREFIX} ERROR: Extracting {s3_path} failed with {e}")
-
-    @staticmethod
-    def tarball_sanitize_members(tar):
-        members = []
-        for member in tar.getmembers():
-            if member.isdir():
-                continue
-            if member.name.endswith("json") is False and member.name.endswith("csv") is False:
-                continue
-            if ".." in member.path:
-                continue
-
-            members.append(member)
-        return members
-
-    def load_config(self, file_path):
+        executor = ThreadPoolExecutor(max_workers=prefetch_partitions,
+                                      thread_name_prefix="metrics_utility_s3_prefetch")
         try:
-            with open(file_path) as f:
-                config_data = json.loads(f.read())
-            return config_data
-        except FileNotFoundError as e:
-            self.logger.warn(f"{self.LOG_PREFIX} missing required file under path: {self.path} and date: {self.date}")
-            # raise MissingRequiredFile(self.filename) from e
+            while partition is not None or prefetched:
+                # Schedule the downloads in the order of processing, within the limits
+                while partition is not None and len(prefetched) < prefetch_partitions and \
+                        prefetched_bytes + partition[1] <= prefetch_max_bytes:
+                    path, size = partition
+                    prefetched.append((path, size, executor.submit(self.download_tarball, path)))
+                    prefetched_bytes += size
+                    partition = next(partitions, None)
+
+                if prefetched:
+                    path, size, future = prefetched.popleft()
+                    yield path, future.result
+                    prefetched_bytes -= size
+                else:
+                    # The tarball doesn't fit the prefetch limit, it's streamed instead
+                    path, _ = partition
+                    yield path, functools.partial(self.open_tarball, path)
+                    partition = next(partitions, None)
+        finally:
+            executor.shutdown(cancel_futures=True)
+
+    def iter_partitions(self, dates):
+        # Yields the path and size of every tarball of the dates
+        for date in dates:
+            self.logger.info(f"{self.LOG_PREFIX} Processing {date}")
+
+            yield from self.s3_handler.list_file_sizes(self._get_path_prefix(date))
+
+    def download_tarball(self, path):
+        with closing(self.s3_handler.open_file(path)) as body:
+            return io.BytesIO(body.read())
 
     def fetch_partition_paths(self, date):
         prefix = self._get_path_prefix(date)
@@ -127,5 +82,11 @@ class ExtractorS3():
         return paths
 
     @staticmethod
-    def batch_size():
-        return 100000
\ No newline at end of file
+    def prefetch_partitions():
+        # Number of tarballs downloaded ahead of processing, 0 disables the prefetch
+        return int(os.environ.get('METRICS_UTILITY_S3_PREFETCH_PARTITIONS', 4))
+
+    @staticmethod
+    def prefetch_max_bytes():
+        # Memory limit for the prefetched tarballs
+        return int(os.environ.get('METRICS_UTILITY_S3_PREFETCH_MAX_BYTES', 512 * 1024 * 1024))
@@ -0,0 +1,94 @@
+from django.db import connection
+
+"""
+SQL shared by the collectors and the controller db extractor, resolving the
+ansible_host and ansible_connection variables of hosts. Host variables are
+stored as text, either JSON or YAML encoded.
+"""
+
+# PostgreSQL version adding the IS JSON predicate
+PG_IS_JSON_VERSION = 160000
+
+
+def pg_functions():
+    query = '''
+        -- Define function for parsing field out of yaml encoded as text
+        CREATE OR REPLACE FUNCTION metrics_utility_parse_yaml_field(
+            str text,
+            field text
+        )
+        RETURNS text AS
+        $$
+        DECLARE
+            line_re text;
+            field_re text;
+        BEGIN
+            field_re := ' *[:=] *(.+?) *$';
+            line_re := '(?n)^' || field || field_re;
+            RETURN trim(both '"' from substring(str from line_re) );
+        END;
+        $$
+        LANGUAGE plpgsql;
+
+        -- Define function to check if field is a valid json
+        CREATE OR REPLACE FUNCTION metrics_utility_is_valid_json(p_json text)
+            returns boolean
+        AS
+        $$
+        BEGIN
+            RETURN (p_json::json is not null);
+        EXCEPTION
+            WHEN others THEN
+                RETURN false;
+        END;
+        $$
+        LANGUAGE plpgsql;
+    '''
+    return query
+
+
+def is_json_condition(column):
+    # The IS JSON predicate doesn't need the exception block of metrics_utility_is_valid_json,
+    # which opens a subtransaction for every call
+    if (getattr(connection, 'pg_version', None) or 0) >= PG_IS_JSON_VERSION:
+        return f"({column} IS JSON)"
+
+    return f"metrics_utility_is_valid_json({column})"
+
+
+def host_variables_query(hosts_condition, columns={}):
+    """
+    Select the host variables of the hosts matching the hosts_condition, each host is
+    parsed only once, to be joined back by its id or name.
+
+    :param hosts_condition: SQL condition filtering main_host, e.g. the hosts of a slice
+    :param columns: additional columns to select, as alias: expression over main_host
+    """
+    inner_columns = "".join(f"{expression} AS {alias}, " for alias, expression in columns.items())
+    outer_columns = "".join(f"hosts.{alias}, " for alias in columns)
+
+    # OFFSET 0 keeps the subquery from being flattened, so the format is checked once per host
+    query = f'''
+        SELECT hosts.id,
+               hosts.name,
+               {outer_columns}
+               CASE
+                   WHEN hosts.is_json
+                       THEN hosts.variables::jsonb->>'ansible_host'
+                   ELSE metrics_utility_parse_yaml_field(hosts.variables, 'ansible_host' )
+               END AS ansible_host_variable,
+               CASE
+                   WHEN hosts.is_json
+                       THEN hosts.variables::jsonb->>'ansible_connection'
+                   ELSE metrics_utility_parse_yaml_field(hosts.variables, 'ansible_connection' )
+               END AS ansible_connection_variable
+        FROM (SELECT main_host.id,
+                     main_host.name,
+                     main_host.variables,
+                     {inner_columns}
+                     {is_json_condition('main_host.variables')} AS is_json
+              FROM main_host
+              WHERE {hosts_condition}
+              OFFSET 0) AS hosts
+    '''
+    return query
@@ -0,0 +1,35 @@
+import pathlib
+import tarfile
+
+import insights_analytics_collector as base
+
+
+class Base(base.Package):
+    """
+    Package of the collections shipped into the directory or the S3, read by the extractors
+    """
+    def make_tgz(self):
+        # Same as the base make_tgz, but the config.json is stored first, so the tarball
+        # can be streamed by the extractors and the tables parsed with the config known
+        target = self.collector.tmp_dir.parent
+        try:
+            tarname_base = self._tarname_base()
+            path = pathlib.Path(target)
+            index = len(list(path.glob(f"{tarname_base}-*.*")))
+            tarname = f"{tarname_base}-{index}.tar.gz"
+
+            with tarfile.open(target.joinpath(tarname), "w:gz") as f:
+                self._config_to_tar(f)
+
+                for collection in self.collections:
+                    self._collection_to_tar(f, collection)
+
+                self._data_collection_status_to_tar(f)
+
+                self._manifest_to_tar(f)
+
+                self.tar_path = f.name
+            return True
+        except Exception as e:
+            self.logger.exception(f"Failed to write analytics archive file: {e}")
+            return False
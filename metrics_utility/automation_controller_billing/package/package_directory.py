@@ -1,11 +1,11 @@
 import os
 import shutil
-import insights_analytics_collector as base
 
 from django.conf import settings
+from metrics_utility.automation_controller_billing.package.base import Base
 
 
-class PackageDirectory(base.Package):
+class PackageDirectory(Base):
     def _batch_since_and_until(self):
         # TODO: how to verify this is the daily batch of job_host_summary?
         # self.collection_keys is: ['job_host_summary', 'manifest']
@@ -1,13 +1,13 @@
 import os
 import shutil
-import insights_analytics_collector as base
 import tempfile
 
 from django.conf import settings
+from metrics_utility.automation_controller_billing.package.base import Base
 from metrics_utility.automation_controller_billing.base.s3_handler import S3Handler
 
 
-class PackageS3(base.Package):
+class PackageS3(Base):
     def _batch_since_and_until(self):
         # TODO: how to verify this is the daily batch of job_host_summary?
         # self.collection_keys is: ['job_host_summary', 'manifest']
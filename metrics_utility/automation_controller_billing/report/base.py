@@ -7,8 +7,12 @@ from openpyxl.utils import get_column_letter
 from openpyxl.utils.dataframe import dataframe_to_rows
 
 import os
+import re
+import numpy as np
 import pandas as pd
 
+from metrics_utility.exceptions import BadReportSection
+
 
 class Base:
     BLACK_COLOR_HEX = "00000000"
@@ -19,6 +23,8 @@ class Base:
     GREEN_COLOR_HEX = "92d050"
     FONT = "Arial"
     PRICE_FORMAT = '$#,##0.00'
+    # Rows of an Excel sheet
+    MAX_SHEET_ROWS = 1048576
 
     @staticmethod
     def optional_report_sheets():
@@ -27,26 +33,165 @@ class Base:
             'ccsp_summary,managed_nodes,usage_by_organizations,usage_by_collections,usage_by_roles,'\
             'usage_by_modules').split(",")
 
+    @staticmethod
+    def max_sheet_rows():
+        # Rows of a sheet are limited by Excel, a lower limit can be set e.g. for testing
+        return min(int(os.environ.get('METRICS_UTILITY_REPORT_MAX_SHEET_ROWS', Base.MAX_SHEET_ROWS)), Base.MAX_SHEET_ROWS)
+
+    @staticmethod
+    def section_name(title):
+        # Name of the section in the names of the files saved next to the report, e.g. managed_nodes
+        return re.sub(r'[^0-9a-z]+', '_', title.lower()).strip('_')
+
+    def export_sections(self):
+        # With the --export option every data section is saved next to the report
+        return bool(self.extra_params.get('opt_export') or self.extra_params.get('opt_export_only'))
+
+    @classmethod
+    def organization_section_names(cls, organization_names):
+        """
+        Names of the sections of the organizations, saved into the organizations directory apart
+        from the other sections. Organizations having the same name in the files, e.g. "Org, C"
+        and "Org C", are told apart by a numbered suffix, in the order of the organization names.
+        """
+        section_names = {}
+        for organization_name in organization_names:
+            name = cls.section_name(str(organization_name)) or 'organization'
+            section_name, number = name, 1
+            while f"organizations/{section_name}" in section_names.values():
+                number += 1
+                section_name = f"{name}_{number}"
+
+            section_names[organization_name] = f"organizations/{section_name}"
+
+        return section_names
+
+    def _add_sidecar_dataframe(self, section, dataframe):
+        # Sections are saved into the files of their names, one must not overwrite another
+        if not section:
+            raise BadReportSection("Data section of the report has no name to be saved as")
+        if self.sidecar_dataframes.get(section, dataframe) is not dataframe:
+            raise BadReportSection(f"Data sections of the report would be saved into the same files: {section}")
+
+        self.sidecar_dataframes[section] = dataframe
+
+    def _export_section(self, section, dataframe):
+        if self.export_sections():
+            self._add_sidecar_dataframe(section, dataframe)
+
+    def _aggregate(self, dataframe, by, **aggregations):
+        """
+        Named aggregations of the dataframe grouped by the keys, the same as
+        dataframe.groupby(by, dropna=False, observed=True).agg(**aggregations).
+
+        Each aggregation is computed only once per report, the sheets grouping the same
+        dataframe by the same keys reuse it from the aggregations of the report. The
+        aggregated columns of the dataframe must not be changed afterwards.
+        """
+        keys = tuple(by) if isinstance(by, list) else (by,)
+
+        aggregated = {}
+        missing = {}
+        for name, aggregation in aggregations.items():
+            # The dataframe is kept with its aggregations, so its id can't be reused by another one
+            cached = self.aggregations.get((id(dataframe), keys, aggregation))
+            if cached is not None and cached[0] is dataframe:
+                aggregated[name] = cached[1]
+            else:
+                missing[name] = aggregation
+
+        if missing:
+            computed = dataframe.groupby(by, dropna=False, observed=True).agg(**missing)
+            for name, aggregation in missing.items():
+                self.aggregations[(id(dataframe), keys, aggregation)] = (dataframe, computed[name])
+                aggregated[name] = computed[name]
+
+        return pd.DataFrame({name: aggregated[name] for name in aggregations})
+
+    def _build_data_rows(self, current_row, ws, dataframe, section=None):
+        """
+        Streams the header and the rows of the data section into the worksheet one row at a time,
+        all the cells of the header and of the values share their named style.
+
+        Rows past the row limit of a sheet continue on the numbered continuation sheets, each one
+        starting with the header again. The whole data section of such sheets is saved next to the
+        report too, see sidecar_dataframes, named by the section or by the title of the sheet.
+        """
+        section = section or self.section_name(ws.title)
+        self._export_section(section, dataframe)
+        if self.extra_params.get('opt_export_only'):
+            # Only the data sections are saved, without the spreadsheet
+            return current_row + len(dataframe) + 1
+
+        header_style = self.wb.named_style('Data header', font=Font(name=self.FONT,
+                                                                    size=10,
+                                                                    color=self.BLACK_COLOR_HEX,
+                                                                    bold=True))
+        value_style = self.wb.named_style('Data value', font=Font(name=self.FONT,
+                                                                  size=10,
+                                                                  color=self.BLACK_COLOR_HEX))
+        max_sheet_rows = self.max_sheet_rows()
+        first_ws = ws
+        sheets = 1
+
+        rows = dataframe_to_rows(dataframe, index=False)
+        header = next(rows)
+
+        # set header style
+        ws.row_dimensions[current_row].height = 25
+        ws.write_row(current_row, [ws.styled_cell(value, header_style) for value in header])
+        current_row += 1
+
+        for row in rows:
+            if current_row > max_sheet_rows:
+                sheets += 1
+                ws = self._create_continuation_sheet(first_ws, sheets)
+                ws.row_dimensions[1].height = 25
+                ws.write_row(1, [ws.styled_cell(value, header_style) for value in header])
+                current_row = 2
+
+            # set value style
+            ws.write_row(current_row, [ws.styled_cell(value, value_style) for value in row])
+            current_row += 1
+
+        if sheets > 1:
+            self._add_sidecar_dataframe(section, dataframe)
+
+        return current_row
+
+    def _create_continuation_sheet(self, ws, number):
+        # Sheet titles are limited to 31 characters, e.g. "Managed nodes (2)"
+        suffix = f" ({number})"
+        continuation_ws = self.wb.create_sheet(title=f"{ws.title[:31 - len(suffix)]}{suffix}")
+
+        for key, dimension in ws.column_dimensions.items():
+            if dimension.width:
+                continuation_ws.column_dimensions[key].width = dimension.width
+
+        return continuation_ws
+
     def _fix_event_host_names(self, mapping_dataframe, destination_dataframe):
         if destination_dataframe is None:
             return None
 
-        def concatenate_columns_mapping(row):
-            return f"{row['original_host_name']}__{str(row['install_uuid'])}__{str(row['job_remote_id'])}"
-
-        def concatenate_columns_destination(row):
-            return f"{row['host_name']}__{str(row['install_uuid'])}__{str(row['job_remote_id'])}"
+        keys = ['host_name', 'install_uuid', 'job_remote_id']
 
-        # Apply the function to each row of the DataFrame
-        mapping_dataframe['host_composite_id'] = mapping_dataframe.apply(concatenate_columns_mapping, axis=1)
-        mapping_dataframe = mapping_dataframe.set_index("host_composite_id")
-        mapping_dataframe = mapping_dataframe["host_name"].astype(str).to_dict()
+        # Host names of the job host summaries keyed by the original host name, the last
+        # one wins if there are more
+        mapping_dataframe = mapping_dataframe[['original_host_name', 'install_uuid', 'job_remote_id', 'host_name']].rename(
+            columns={'original_host_name': 'host_name', 'host_name': 'mapped_host_name'})
+        mapping_dataframe['mapped_host_name'] = mapping_dataframe['mapped_host_name'].astype(str)
+        mapping_dataframe = mapping_dataframe.drop_duplicates(subset=keys, keep='last')
 
-        def apply_mapping(row):
-            return mapping_dataframe.get(f"{row['host_name']}__{str(row['install_uuid'])}__{row['job_remote_id']}", row['host_name'])
+        # Left join keeps the order of the events, keys of the mapping are unique
+        mapped_host_names = destination_dataframe[keys].merge(
+            mapping_dataframe, on=keys, how='left')['mapped_host_name'].to_numpy()
 
-        destination_dataframe['host_name'] = destination_dataframe.apply(apply_mapping, axis=1)
-        destination_dataframe['host_composite_id'] = destination_dataframe.apply(concatenate_columns_destination, axis=1)
+        host_names = destination_dataframe['host_name'].to_numpy(dtype=object)
+        destination_dataframe['host_name'] = np.where(pd.isna(mapped_host_names), host_names, mapped_host_names)
+        destination_dataframe['host_composite_id'] = (destination_dataframe['host_name'].astype(str) + '__' +
+                                                      destination_dataframe['install_uuid'].astype(str) + '__' +
+                                                      destination_dataframe['job_remote_id'].astype(str))
 
         return destination_dataframe
 
@@ -55,24 +200,14 @@ class Base:
         for key, value in self.config['data_column_widths'].items():
             ws.column_dimensions[get_column_letter(key)].width = value
 
-        header_font = Font(name=self.FONT,
-                           size=10,
-                           color=self.BLACK_COLOR_HEX,
-                           bold=True)
-        value_font = Font(name=self.FONT,
-                          size=10,
-                          color=self.BLACK_COLOR_HEX)
-
         # Rename the columns based on the template
-        ccsp_report_dataframe = (
-            dataframe.groupby('host_name', dropna=False)
-            .agg(
-                organizations=('organization_name', 'nunique'),
-                host_runs=('host_name', 'count'),
-                task_runs=('task_runs', 'sum'),
-                first_automation=('first_automation', 'min'),
-                last_automation=('last_automation', 'max')
-            )
+        ccsp_report_dataframe = self._aggregate(
+            dataframe, 'host_name',
+            organizations=('organization_name', 'nunique'),
+            host_runs=('host_name', 'count'),
+            task_runs=('task_runs', 'sum'),
+            first_automation=('first_automation', 'min'),
+            last_automation=('last_automation', 'max')
         )
         ccsp_report_dataframe = ccsp_report_dataframe.reset_index()
         columns = [
@@ -91,12 +226,17 @@ class Base:
             columns=columns
         )
 
-        # Create dataframe with hostname and orgs as columns, having last automation for each host
-        pivoted_dataframe = dataframe.pivot_table(
-            index='host_name',
-            columns='organization_name',
-            values='last_automation',
-            aggfunc='max'  # You can use 'max', 'min', 'mean', etc., depending on your needs
+        # Create dataframe with hostname and orgs as columns, having last automation for each host,
+        # pivoted from the same aggregation as the sheets of the organizations
+        last_automations = self._aggregate(
+            dataframe, ['organization_name', 'host_name'],
+            last_automation=('last_automation', 'max')
+        )['last_automation']
+        known = (last_automations.index.get_level_values('organization_name').notna() &
+                 last_automations.index.get_level_values('host_name').notna())
+        pivoted_dataframe = (
+            last_automations[known].unstack('organization_name')
+            .dropna(how='all').dropna(axis=1, how='all')
         )
 
         # Set index on host_name for join
@@ -119,52 +259,24 @@ class Base:
             columns=labels
         )
 
-        row_counter = 0
-        rows = dataframe_to_rows(ccsp_report_dataframe, index=False)
-        for r_idx, row in enumerate(rows, current_row):
-            for c_idx, value in enumerate(row, 1):
-                cell = ws.cell(row=r_idx, column=c_idx)
-                cell.value = value
-
-                if row_counter == 0:
-                    # set header style
-                    cell.font = header_font
-                    rd = ws.row_dimensions[r_idx]
-                    rd.height = 25
-                else:
-                    # set value style
-                    cell.font = value_font
-
-            row_counter += 1
-
-        return current_row + row_counter
+        return self._build_data_rows(current_row, ws, ccsp_report_dataframe)
 
 
     def _build_data_section_usage_by_job(self, current_row, ws, dataframe):
         for key, value in self.config['data_column_widths'].items():
             ws.column_dimensions[get_column_letter(key)].width = value
 
-        header_font = Font(name=self.FONT,
-                           size=10,
-                           color=self.BLACK_COLOR_HEX,
-                           bold=True)
-        value_font = Font(name=self.FONT,
-                          size=10,
-                          color=self.BLACK_COLOR_HEX)
-
         dataframe['job_remote_id_install_uuid'] = list(zip(dataframe['job_remote_id'], dataframe['install_uuid']))
 
         # Rename the columns based on the template
-        ccsp_report_dataframe = (
-            dataframe.groupby(['organization_name', 'job_template_name'], dropna=False)
-            .agg(
-                job_runs=('job_remote_id_install_uuid', 'nunique'),
-                host_runs_unique=('host_name', 'nunique'),
-                host_runs=('host_name', 'count'),
-                task_runs=('task_runs', 'sum'),
-                first_run=('job_created', 'min'),
-                last_run=('job_created', 'max'),
-            )
+        ccsp_report_dataframe = self._aggregate(
+            dataframe, ['organization_name', 'job_template_name'],
+            job_runs=('job_remote_id_install_uuid', 'nunique'),
+            host_runs_unique=('host_name', 'nunique'),
+            host_runs=('host_name', 'count'),
+            task_runs=('task_runs', 'sum'),
+            first_run=('job_created', 'min'),
+            last_run=('job_created', 'max'),
         )
         ccsp_report_dataframe = ccsp_report_dataframe.reset_index()
         ccsp_report_dataframe = ccsp_report_dataframe.reindex(
@@ -193,51 +305,34 @@ class Base:
             }
         )
 
-        row_counter = 0
-        rows = dataframe_to_rows(ccsp_report_dataframe, index=False)
-        for r_idx, row in enumerate(rows, current_row):
-            for c_idx, value in enumerate(row, 1):
-                cell = ws.cell(row=r_idx, column=c_idx)
-                cell.value = value
-
-                if row_counter == 0:
-                    # set header style
-                    cell.font = header_font
-                    rd = ws.row_dimensions[r_idx]
-                    rd.height = 25
-                else:
-                    # set value style
-                    cell.font = value_font
-
-            row_counter += 1
+        return self._build_data_rows(current_row, ws, ccsp_report_dataframe)
 
-        return current_row + row_counter
 
 
-
-    def _build_data_section_usage_by_node(self, current_row, ws, dataframe, mode=None):
+    def _build_data_section_usage_by_node(self, current_row, ws, dataframe, mode=None, organization_name=None,
+                                          section=None):
         for key, value in self.config['data_column_widths'].items():
             ws.column_dimensions[get_column_letter(key)].width = value
 
-        header_font = Font(name=self.FONT,
-                           size=10,
-                           color=self.BLACK_COLOR_HEX,
-                           bold=True)
-        value_font = Font(name=self.FONT,
-                          size=10,
-                          color=self.BLACK_COLOR_HEX)
-
         # Rename the columns based on the template
-        ccsp_report_dataframe = (
-            dataframe.groupby('host_name', dropna=False)
-            .agg(
+        if mode == "by_organization":
+            # Nodes of all the organizations are aggregated at once, each organization takes its part
+            ccsp_report_dataframe = self._aggregate(
+                dataframe, ['organization_name', 'host_name'],
+                host_runs=('host_name', 'count'),
+                task_runs=('task_runs', 'sum'),
+                first_automation=('first_automation', 'min'),
+                last_automation=('last_automation', 'max')
+            ).xs(organization_name, level='organization_name')
+        else:
+            ccsp_report_dataframe = self._aggregate(
+                dataframe, 'host_name',
                 organizations=('organization_name', 'nunique'),
                 host_runs=('host_name', 'count'),
                 task_runs=('task_runs', 'sum'),
                 first_automation=('first_automation', 'min'),
                 last_automation=('last_automation', 'max')
             )
-        )
         ccsp_report_dataframe = ccsp_report_dataframe.reset_index()
         columns = [
             'host_name',
@@ -267,42 +362,15 @@ class Base:
             columns=labels
         )
 
-        row_counter = 0
-        rows = dataframe_to_rows(ccsp_report_dataframe, index=False)
-        for r_idx, row in enumerate(rows, current_row):
-            for c_idx, value in enumerate(row, 1):
-                cell = ws.cell(row=r_idx, column=c_idx)
-                cell.value = value
-
-                if row_counter == 0:
-                    # set header style
-                    cell.font = header_font
-                    rd = ws.row_dimensions[r_idx]
-                    rd.height = 25
-                else:
-                    # set value style
-                    cell.font = value_font
-
-            row_counter += 1
-
-        return current_row + row_counter
+        return self._build_data_rows(current_row, ws, ccsp_report_dataframe, section=section)
 
     def _build_data_section_usage_by_collections(self, current_row, ws, dataframe):
         for key, value in self.config['data_column_widths'].items():
             ws.column_dimensions[get_column_letter(key)].width = value
 
-        header_font = Font(name=self.FONT,
-                           size=10,
-                           color=self.BLACK_COLOR_HEX,
-                           bold=True)
-        value_font = Font(name=self.FONT,
-                          size=10,
-                          color=self.BLACK_COLOR_HEX)
-
         # Take the content explorer dataframe and extract specific group by
-        ccsp_report_dataframe = dataframe.groupby(
-            ["collection_name"], dropna=False
-        ).agg(
+        ccsp_report_dataframe = self._aggregate(
+            dataframe, ["collection_name"],
             host_runs_unique=('host_name', 'nunique'),
             host_runs=('host_composite_id', 'nunique'),
             task_runs=('task_runs', 'sum'),
@@ -321,42 +389,15 @@ class Base:
             }
         )
 
-        row_counter = 0
-        rows = dataframe_to_rows(ccsp_report_dataframe, index=False)
-        for r_idx, row in enumerate(rows, current_row):
-            for c_idx, value in enumerate(row, 1):
-                cell = ws.cell(row=r_idx, column=c_idx)
-                cell.value = value
-
-                if row_counter == 0:
-                    # set header style
-                    cell.font = header_font
-                    rd = ws.row_dimensions[r_idx]
-                    rd.height = 25
-                else:
-                    # set value style
-                    cell.font = value_font
-
-            row_counter += 1
-
-        return current_row + row_counter
+        return self._build_data_rows(current_row, ws, ccsp_report_dataframe)
 
     def _build_data_section_usage_by_roles(self, current_row, ws, dataframe):
         for key, value in self.config['data_column_widths'].items():
             ws.column_dimensions[get_column_letter(key)].width = value
 
-        header_font = Font(name=self.FONT,
-                           size=10,
-                           color=self.BLACK_COLOR_HEX,
-                           bold=True)
-        value_font = Font(name=self.FONT,
-                          size=10,
-                          color=self.BLACK_COLOR_HEX)
-
         # Take the content explorer dataframe and extract specific group by
-        ccsp_report_dataframe = dataframe.groupby(
-            ["role_name"], dropna=False
-        ).agg(
+        ccsp_report_dataframe = self._aggregate(
+            dataframe, ["role_name"],
             host_runs_unique=('host_name', 'nunique'),
             host_runs=('host_composite_id', 'nunique'),
             task_runs=('task_runs', 'sum'),
@@ -375,42 +416,14 @@ class Base:
             }
         )
 
-        row_counter = 0
-        rows = dataframe_to_rows(ccsp_report_dataframe, index=False)
-        for r_idx, row in enumerate(rows, current_row):
-            for c_idx, value in enumerate(row, 1):
-                cell = ws.cell(row=r_idx, column=c_idx)
-                cell.value = value
-                # cell.border = dotted_border
-
-                if row_counter == 0:
-                    # set header style
-                    cell.font = header_font
-                    rd = ws.row_dimensions[r_idx]
-                    rd.height = 25
-                else:
-                    # set value style
-                    cell.font = value_font
-
-            row_counter += 1
-
-        return current_row + row_counter
+        return self._build_data_rows(current_row, ws, ccsp_report_dataframe)
 
     def _build_data_section_usage_by_modules(self, current_row, ws, dataframe):
         for key, value in self.config['data_column_widths'].items():
             ws.column_dimensions[get_column_letter(key)].width = value
 
-        header_font = Font(name=self.FONT,
-                           size=10,
-                           color=self.BLACK_COLOR_HEX,
-                           bold=True)
-        value_font = Font(name=self.FONT,
-                          size=10,
-                          color=self.BLACK_COLOR_HEX)
-
-        ccsp_report_dataframe = dataframe.groupby(
-            ["module_name"], dropna=False
-        ).agg(
+        ccsp_report_dataframe = self._aggregate(
+            dataframe, ["module_name"],
             host_runs_unique=('host_name', 'nunique'),
             host_runs=('host_composite_id', 'nunique'),
             task_runs=('task_runs', 'sum'),
@@ -429,22 +442,4 @@ class Base:
             }
         )
 
-        row_counter = 0
-        rows = dataframe_to_rows(ccsp_report_dataframe, index=False)
-        for r_idx, row in enumerate(rows, current_row):
-            for c_idx, value in enumerate(row, 1):
-                cell = ws.cell(row=r_idx, column=c_idx)
-                cell.value = value
-
-                if row_counter == 0:
-                    # set header style
-                    cell.font = header_font
-                    rd = ws.row_dimensions[r_idx]
-                    rd.height = 25
-                else:
-                    # set value style
-                    cell.font = value_font
-
-            row_counter += 1
-
-        return current_row + row_counter
+        return self._build_data_rows(current_row, ws, ccsp_report_dataframe)
@@ -1,6 +1,11 @@
+import numpy as np
 import pandas as pd
 
 class Dedup:
+    # Host metric columns linking records of the same managed node, records sharing a non-null
+    # value in any of these columns end up in the same duplicate group
+    DEDUP_COLUMNS = ['hostname', 'ansible_host_variable', 'ansible_product_serial', 'ansible_machine_id']
+
     def __init__(self, dataframe, extra_params):
         self.dataframe = dataframe
         self.extra_params = extra_params
@@ -15,65 +20,122 @@ class Dedup:
         self.dataframe['ansible_machine_id'] = self.dataframe['ansible_machine_id'].replace('NA', None)
         self.dataframe['ansible_machine_id'] = self.dataframe['ansible_machine_id'].replace('', None)
 
-        self.dataframe['ansible_host_variable'] = self.dataframe['ansible_host_variable'].replace('', None)
-        deduped_list = []
-
-        processed_dupes_index = set()
-        for index, row in self.dataframe.iterrows():
-            # Skip if index is in existing dupes_index
-            if index in processed_dupes_index:
+        if self.dataframe.empty:
+            return pd.DataFrame(columns=self.output_columns())
+
+        # Resolve the duplicate groups as connected components of the graph, where host metric records
+        # are nodes and a shared value of any dedup column is an edge. Every record is labeled with the
+        # position of the first record of its group, so groups keep the order of their first record.
+        dataframe = self.dataframe.reset_index(drop=True)
+        dataframe['dedup_group'] = self.connected_components(dataframe)
+
+        # Take the last updated non deleted hostname with priority, to represent the
+        # duplicate group
+        latest_hostname = dataframe.sort_values(
+            by=['dedup_group', 'deleted', 'last_automation'],
+            ascending=[True, True, False],
+            kind='stable').drop_duplicates('dedup_group').set_index('dedup_group')['hostname']
+
+        dataframe['hostname_active'] = dataframe['hostname'].where(dataframe['deleted'] != True)
+        dataframe['hostname_deleted'] = dataframe['hostname'].where(dataframe['deleted'] == True)
+
+        deduped = dataframe.groupby('dedup_group', sort=True).agg(
+            hostmetric_record_count=('hostname', 'nunique'),
+            hostmetric_record_count_active=('hostname_active', 'nunique'),
+            hostmetric_record_count_deleted=('hostname_deleted', 'nunique'),
+            deleted=('deleted', 'min'),  # if there was at least one false, it's not deleted
+            first_automation=('first_automation', 'min'),
+            last_automation=('last_automation', 'max'),
+            automated_counter=('automated_counter', 'sum'),
+            deleted_counter=('deleted_counter', 'sum'),
+            last_deleted=('last_deleted', 'max'),
+        )
+        deduped['hostname'] = latest_hostname
+        deduped['hostnames'] = self.stringify(dataframe, 'hostname')
+        deduped['ansible_host_variables'] = self.stringify(dataframe, 'ansible_host_variable')
+        deduped['ansible_product_serials'] = self.stringify(dataframe, 'ansible_product_serial')
+        deduped['ansible_machine_ids'] = self.stringify(dataframe, 'ansible_machine_id')
+
+        return deduped.reset_index(drop=True).reindex(columns=self.output_columns())
+
+    def connected_components(self, dataframe, return_rounds=False):
+        """
+        Label every row with the smallest row position of its connected component, using a vectorized
+        union-find: each round hooks the root of every edge onto the smaller root, followed by pointer
+        jumping until all the parents are roots.
+
+        Every round merges at least the smallest linked pair of roots of each group, so the rounds are
+        bounded by the size of the largest group, not by the number of rows. In practice they grow with
+        its log, e.g. 12 rounds for a group chaining 1M records in a random order, see
+        benchmarks/bench_dedup.py.
+
+        :param return_rounds: return the number of rounds with the labels
+        """
+        edges_from = []
+        edges_to = []
+        for column in self.DEDUP_COLUMNS:
+            codes, _ = pd.factorize(dataframe[column])
+            linked = np.flatnonzero(codes >= 0)
+            if len(linked) == 0:
                 continue
-
-            # Start
-            dupes = self.dataframe[self.dataframe['hostname']==row['hostname']]
-
-            # We will do the search in iterations, to cover more indirect relationships
-            iterations = int(self.extra_params['report_renewal_guidance_dedup_iterations'])
-            for i in range(iterations):
-                # Hostname dupe lookup
-                dupes = self.find_dupes(dupes, 'hostname', dupes["hostname"])
-
-                # Host variable dupe lookup
-                dupes = self.find_dupes(dupes, 'ansible_host_variable', dupes["ansible_host_variable"])
-
-                # Serial key dupes lookup
-                dupes = self.find_dupes(dupes, 'ansible_product_serial', dupes["ansible_product_serial"])
-
-                # ansible_machine_id key dupes lookup
-                dupes = self.find_dupes(dupes, 'ansible_machine_id', dupes["ansible_machine_id"])
-
-            processed_dupes_index.update(dupes['index'])
-
-            # Take the last updated non deleted hostname with priority, to represent the
-            # duplicate group
-            latest_hostname = dupes.sort_values(by=['deleted', 'last_automation'],
-                                                ascending=[True, False])['hostname'].iloc[0]
-            deduped_list.append({
-                'hostname': latest_hostname,
-                'hostmetric_record_count': dupes['hostname'].nunique(),
-                'hostmetric_record_count_active': dupes[~dupes["deleted"]==True]['hostname'].nunique(),
-                'hostmetric_record_count_deleted': dupes[dupes["deleted"]==True]['hostname'].nunique(),
-                'hostnames': self.stringify(set(dupes['hostname'])),
-                'ansible_host_variables': self.stringify(set(dupes['ansible_host_variable'])),
-                'ansible_product_serials': self.stringify(set(dupes['ansible_product_serial'])),
-                'ansible_machine_ids': self.stringify(set(dupes['ansible_machine_id'])),
-                'deleted': min(dupes['deleted']), # if there was at least one false, it's not deleted
-                'first_automation':  min(dupes['first_automation']),
-                'last_automation': max(dupes['last_automation']),
-                'automated_counter': sum(dupes['automated_counter']),
-                'deleted_counter': sum(dupes['deleted_counter']),
-                'last_deleted':  max(dupes['last_deleted']),
-            })
-
-        return pd.DataFrame(deduped_list)
-
-    def stringify(self, value):
-        return ", ".join([v for v in list(value) if v is not None])
-
-    def find_dupes(self, dupes, key, values):
-        next_iteration_dupes = self.dataframe[self.dataframe[key].notnull() & self.dataframe[key].isin(values) ]
-        dupes = pd.concat([dupes,next_iteration_dupes]).drop_duplicates().reset_index(drop=True)
-
-        return dupes
-
-
+            # Link every row to the first row having the same value
+            _, first_positions = np.unique(codes[linked], return_index=True)
+            edges_from.append(linked)
+            edges_to.append(linked[first_positions][codes[linked]])
+
+        parent = np.arange(len(dataframe))
+        rounds = 0
+        if not edges_from:
+            return (parent, rounds) if return_rounds else parent
+
+        edges_from = np.concatenate(edges_from)
+        edges_to = np.concatenate(edges_to)
+        while True:
+            root_from = parent[edges_from]
+            root_to = parent[edges_to]
+            unmerged = root_from != root_to
+            if not unmerged.any():
+                return (parent, rounds) if return_rounds else parent
+
+            rounds += 1
+            np.minimum.at(parent,
+                          np.maximum(root_from[unmerged], root_to[unmerged]),
+                          np.minimum(root_from[unmerged], root_to[unmerged]))
+            while True:
+                grandparent = parent[parent]
+                if np.array_equal(grandparent, parent):
+                    break
+                parent = grandparent
+
+    @staticmethod
+    def stringify(dataframe, column):
+        values = dataframe[['dedup_group', column]].dropna().drop_duplicates()
+        values = values.sort_values(by=['dedup_group', column], kind='stable')
+        if values.empty:
+            return pd.Series("", index=dataframe['dedup_group'].unique(), dtype=object)
+
+        # Join the sorted values by slices of each group, avoiding python level groupby per group
+        groups = values['dedup_group'].to_numpy()
+        items = values[column].tolist()
+        starts = np.flatnonzero(np.r_[True, groups[1:] != groups[:-1]])
+        ends = np.r_[starts[1:], len(groups)]
+        joined = pd.Series([", ".join(items[start:end]) for start, end in zip(starts, ends)],
+                           index=groups[starts], dtype=object)
+        return joined.reindex(dataframe['dedup_group'].unique(), fill_value="")
+
+    @staticmethod
+    def output_columns():
+        return ['hostname',
+                'hostmetric_record_count',
+                'hostmetric_record_count_active',
+                'hostmetric_record_count_deleted',
+                'hostnames',
+                'ansible_host_variables',
+                'ansible_product_serials',
+                'ansible_machine_ids',
+                'deleted',
+                'first_automation',
+                'last_automation',
+                'automated_counter',
+                'deleted_counter',
+                'last_deleted']
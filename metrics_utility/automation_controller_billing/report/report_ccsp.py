@@ -2,7 +2,7 @@
 # Code for building the spreadsheet
 ######################################
 from metrics_utility.automation_controller_billing.report.base import Base
-from openpyxl import Workbook
+from metrics_utility.automation_controller_billing.report.spreadsheet import Spreadsheet
 from openpyxl.styles import Font, PatternFill, Border, Side, Alignment
 from openpyxl.utils import get_column_letter
 from openpyxl.utils.dataframe import dataframe_to_rows
@@ -17,7 +17,11 @@ class ReportCCSP(Base):
 
     def __init__(self, dataframe, report_period, extra_params):
         # Create the workbook and worksheet
-        self.wb = Workbook()
+        self.wb = Spreadsheet()
+        # Data sections saved next to the report, by the name of the section
+        self.sidecar_dataframes = {}
+        # Aggregations of the dataframes shared by the sheets, see _aggregate
+        self.aggregations = {}
 
         self.dataframe = dataframe
         self.report_period = report_period
@@ -100,12 +104,8 @@ class ReportCCSP(Base):
         events_dataframe = self.dataframe[1]
         events_dataframe = self._fix_event_host_names(job_host_summary_dataframe, events_dataframe)
 
-        # Create the workbook and worksheets
-        self.wb.remove(self.wb.active) # delete the default sheet
-        self.wb.create_sheet(title="Usage Reporting")
-
         # First sheet with billing
-        ws = self.wb.worksheets[0]
+        ws = self.wb.create_sheet(title="Usage Reporting")
 
         self._init_dimensions(ws)
         current_row = self._build_heading_h1(1, ws)
@@ -115,35 +115,26 @@ class ReportCCSP(Base):
         current_row = self._build_data_section(current_row, ws, job_host_summary_dataframe)
 
         # Add optional sheets
-        sheet_index = 1
         if "managed_nodes" in self.optional_report_sheets():
             # Sheet with list of managed nodes
-            self.wb.create_sheet(title="Managed nodes")
-            ws = self.wb.worksheets[sheet_index]
+            ws = self.wb.create_sheet(title="Managed nodes")
             current_row = self._build_data_section_usage_by_node(1, ws, job_host_summary_dataframe)
-            sheet_index += 1
 
         if events_dataframe is not None:
             if "usage_by_collections" in self.optional_report_sheets():
                 # Sheet with usage by collections
-                self.wb.create_sheet(title="Usage by collections")
-                ws = self.wb.worksheets[sheet_index]
+                ws = self.wb.create_sheet(title="Usage by collections")
                 current_row = self._build_data_section_usage_by_collections(1, ws, events_dataframe)
-                sheet_index += 1
 
             if "usage_by_roles" in self.optional_report_sheets():
                 # Sheet with usage by roles
-                self.wb.create_sheet(title="Usage by roles")
-                ws = self.wb.worksheets[sheet_index]
+                ws = self.wb.create_sheet(title="Usage by roles")
                 current_row = self._build_data_section_usage_by_roles(1, ws, events_dataframe)
-                sheet_index += 1
 
             if "usage_by_modules" in self.optional_report_sheets():
                 # Sheet with usage by modules
-                self.wb.create_sheet(title="Usage by modules")
-                ws = self.wb.worksheets[sheet_index]
+                ws = self.wb.create_sheet(title="Usage by modules")
                 current_row = self._build_data_section_usage_by_modules(1, ws, events_dataframe)
-                sheet_index += 1
 
         return self.wb
 
@@ -281,9 +272,9 @@ class ReportCCSP(Base):
                                bottom=Side(border_style='dotted',
                                            color=self.BLACK_COLOR_HEX))
 
-        ccsp_report = dataframe.reset_index().groupby(
-            'organization_name', dropna=False).agg(
-                quantity_consumed=('host_name', 'nunique'))
+        ccsp_report = self._aggregate(
+            dataframe, 'organization_name',
+            quantity_consumed=('host_name', 'nunique'))
         ccsp_report['mark_x'] = ''
         ccsp_report['unit_price'] = round(self.price_per_node, 2)
         ccsp_report['extended_unit_price'] = round((ccsp_report['quantity_consumed'] * ccsp_report['unit_price']), 2)
@@ -304,6 +295,7 @@ class ReportCCSP(Base):
                      "unit_price": "Subscription Fee\n (SKU Unit Price)",
                      "extended_unit_price": "Extended\n Subscription Fees\n (SKU Extended Unit Price)"
                     })
+        self._export_section(self.section_name(ws.title), ccsp_report_dataframe)
 
         row_counter = 0
         rows = dataframe_to_rows(ccsp_report_dataframe, index=False)
@@ -2,7 +2,7 @@
 # Code for building the spreadsheet
 ######################################
 from metrics_utility.automation_controller_billing.report.base import Base
-from openpyxl import Workbook
+from metrics_utility.automation_controller_billing.report.spreadsheet import Spreadsheet
 from openpyxl.styles import Font, PatternFill, Border, Side, Alignment
 from openpyxl.utils import get_column_letter
 from openpyxl.utils.dataframe import dataframe_to_rows
@@ -21,7 +21,11 @@ class ReportCCSPv2(Base):
     # PRICE_FORMAT = '$#,##0.00'
 
     def __init__(self, dataframe, report_period, extra_params):
-        self.wb = Workbook()
+        self.wb = Spreadsheet()
+        # Data sections saved next to the report, by the name of the section
+        self.sidecar_dataframes = {}
+        # Aggregations of the dataframes shared by the sheets, see _aggregate
+        self.aggregations = {}
 
         self.dataframe = dataframe
         self.report_period = report_period
@@ -116,84 +120,61 @@ class ReportCCSPv2(Base):
 
         job_host_summary_dataframe, events_dataframe = self._apply_filter(job_host_summary_dataframe, events_dataframe)
 
-        # Create the workbook and worksheets
-        self.wb.remove(self.wb.active) # delete the default sheet
-
-        # First sheet index
-        sheet_index = 0
-
         if "ccsp_summary" in self.optional_report_sheets():
-            self.wb.create_sheet(title="Usage Reporting")
-            ws = self.wb.worksheets[sheet_index]
+            ws = self.wb.create_sheet(title="Usage Reporting")
             self._init_dimensions(ws)
             current_row = self._build_heading_h1(1, ws)
             current_row = self._build_header(current_row, ws)
             current_row = self._build_po_number(current_row, ws)
             current_row = self._build_updated_timestamp(current_row, ws)
             current_row = self._build_data_section(current_row, ws, job_host_summary_dataframe)
-            sheet_index += 1
 
         if "jobs" in self.optional_report_sheets():
             # Sheet with usage by org
-            self.wb.create_sheet(title="Jobs")
-            ws = self.wb.worksheets[sheet_index]
+            ws = self.wb.create_sheet(title="Jobs")
             current_row = self._build_data_section_usage_by_job(1, ws, job_host_summary_dataframe)
-            sheet_index += 1
 
         if "managed_nodes_by_organizations" in self.optional_report_sheets() and "managed_nodes" in self.optional_report_sheets():
             # Sheet with list of managed nodes
-            self.wb.create_sheet(title="Managed nodes")
-            ws = self.wb.worksheets[sheet_index]
+            ws = self.wb.create_sheet(title="Managed nodes")
             current_row = self._build_data_section_usage_by_node_with_org_details(1, ws, job_host_summary_dataframe)
-            sheet_index += 1
         elif "managed_nodes" in self.optional_report_sheets():
             # Sheet with list of managed nodes
-            self.wb.create_sheet(title="Managed nodes")
-            ws = self.wb.worksheets[sheet_index]
+            ws = self.wb.create_sheet(title="Managed nodes")
             current_row = self._build_data_section_usage_by_node(1, ws, job_host_summary_dataframe)
-            sheet_index += 1
 
         if "usage_by_organizations" in self.optional_report_sheets():
             # Sheet with usage by org
-            self.wb.create_sheet(title="Usage by organizations")
-            ws = self.wb.worksheets[sheet_index]
+            ws = self.wb.create_sheet(title="Usage by organizations")
             current_row = self._build_data_section_usage_by_org(1, ws, job_host_summary_dataframe)
-            sheet_index += 1
 
         if events_dataframe is not None:
             if "usage_by_collections" in self.optional_report_sheets():
                 # Sheet with usage by collections
-                self.wb.create_sheet(title="Usage by collections")
-                ws = self.wb.worksheets[sheet_index]
+                ws = self.wb.create_sheet(title="Usage by collections")
                 current_row = self._build_data_section_usage_by_collections(1, ws, events_dataframe)
-                sheet_index += 1
 
             if "usage_by_roles" in self.optional_report_sheets():
                 # Sheet with usage by roles
-                self.wb.create_sheet(title="Usage by roles")
-                ws = self.wb.worksheets[sheet_index]
+                ws = self.wb.create_sheet(title="Usage by roles")
                 current_row = self._build_data_section_usage_by_roles(1, ws, events_dataframe)
-                sheet_index += 1
 
             if "usage_by_modules" in self.optional_report_sheets():
                 # Sheet with usage by modules
-                self.wb.create_sheet(title="Usage by modules")
-                ws = self.wb.worksheets[sheet_index]
+                ws = self.wb.create_sheet(title="Usage by modules")
                 current_row = self._build_data_section_usage_by_modules(1, ws, events_dataframe)
-                sheet_index += 1
 
         if "managed_nodes_by_organizations" in self.optional_report_sheets():
             # Sheet with list of managed nodes by organization, this will generate multiple tabs
             organization_names = sorted(job_host_summary_dataframe['organization_name'].unique())
+            section_names = self.organization_section_names(organization_names)
             for organization_name in organization_names:
-                self.wb.create_sheet(title=organization_name)
-                ws = self.wb.worksheets[sheet_index]
+                ws = self.wb.create_sheet(title=organization_name)
 
-                # Filter the data for a certain organization
-                filtered_job_host_summary_dataframe = job_host_summary_dataframe[
-                    job_host_summary_dataframe["organization_name"] == organization_name]
-                current_row = self._build_data_section_usage_by_node(1, ws, filtered_job_host_summary_dataframe, mode="by_organization")
-                sheet_index += 1
+                # Nodes of a certain organization
+                current_row = self._build_data_section_usage_by_node(1, ws, job_host_summary_dataframe, mode="by_organization",
+                                                                     organization_name=organization_name,
+                                                                     section=section_names[organization_name])
 
         return self.wb
 
@@ -201,25 +182,15 @@ class ReportCCSPv2(Base):
         for key, value in self.config['data_column_widths'].items():
             ws.column_dimensions[get_column_letter(key)].width = value
 
-        header_font = Font(name=self.FONT,
-                           size=10,
-                           color=self.BLACK_COLOR_HEX,
-                           bold=True)
-        value_font = Font(name=self.FONT,
-                          size=10,
-                          color=self.BLACK_COLOR_HEX)
-
         dataframe['job_remote_id_install_uuid'] = list(zip(dataframe['job_remote_id'], dataframe['install_uuid']))
 
         # Rename the columns based on the template
-        ccsp_report_dataframe = (
-            dataframe.groupby('organization_name', dropna=False)
-            .agg(
-                job_runs=('job_remote_id_install_uuid', 'nunique'),
-                host_runs_unique=('host_name', 'nunique'),
-                host_runs=('host_name', 'count'),
-                task_runs=('task_runs', 'sum')
-            )
+        ccsp_report_dataframe = self._aggregate(
+            dataframe, 'organization_name',
+            job_runs=('job_remote_id_install_uuid', 'nunique'),
+            host_runs_unique=('host_name', 'nunique'),
+            host_runs=('host_name', 'count'),
+            task_runs=('task_runs', 'sum')
         )
         ccsp_report_dataframe = ccsp_report_dataframe.reset_index()
         ccsp_report_dataframe = ccsp_report_dataframe.reindex(
@@ -242,25 +213,7 @@ class ReportCCSPv2(Base):
             }
         )
 
-        row_counter = 0
-        rows = dataframe_to_rows(ccsp_report_dataframe, index=False)
-        for r_idx, row in enumerate(rows, current_row):
-            for c_idx, value in enumerate(row, 1):
-                cell = ws.cell(row=r_idx, column=c_idx)
-                cell.value = value
-
-                if row_counter == 0:
-                    # set header style
-                    cell.font = header_font
-                    rd = ws.row_dimensions[r_idx]
-                    rd.height = 25
-                else:
-                    # set value style
-                    cell.font = value_font
-
-            row_counter += 1
-
-        return current_row + row_counter
+        return self._build_data_rows(current_row, ws, ccsp_report_dataframe)
 
     def _init_dimensions(self, ws):
         for key, value in self.config['column_widths'].items():
@@ -403,7 +356,9 @@ class ReportCCSPv2(Base):
         )
 
         ccsp_report = {}
-        quantity_consumed = dataframe["host_name"].nunique()
+        # Hosts are aggregated once for the summary and the sheet of the managed nodes
+        hosts = self._aggregate(dataframe, 'host_name', host_runs=('host_name', 'count'))
+        quantity_consumed = hosts.index.notna().sum()
         if quantity_consumed > 0:
             # COmpute the unique hostnam count that are in the df index
             ccsp_report["end_user_company_name"] = self.extra_params['report_end_user_company_name']
@@ -453,6 +408,7 @@ class ReportCCSPv2(Base):
                      "extended_unit_price": "SKU Extended Unit\nPrice",
                      "notes": "Notes",
                     })
+        self._export_section(self.section_name(ws.title), ccsp_report_dataframe)
 
         row_counter = 0
         rows = dataframe_to_rows(ccsp_report_dataframe, index=False)
@@ -3,19 +3,24 @@
 ######################################
 from metrics_utility.automation_controller_billing.helpers import parse_number_of_days
 from metrics_utility.automation_controller_billing.report.base import Base
+from metrics_utility.automation_controller_billing.report.spreadsheet import Spreadsheet
 from metrics_utility.automation_controller_billing.report.renewal_guidance.dedup import Dedup
-from openpyxl import Workbook
 from openpyxl.styles import Font, PatternFill, Border, Side, Alignment
 from openpyxl.utils import get_column_letter
 from openpyxl.utils.dataframe import dataframe_to_rows
 
 import datetime
+import numpy as np
 import pandas as pd
 import time
 
 class ReportRenewalGuidance(Base):
     def __init__(self, dataframe, report_period, extra_params):
-        self.wb = Workbook()
+        self.wb = Spreadsheet()
+        # Data sections saved next to the report, by the name of the section
+        self.sidecar_dataframes = {}
+        # Aggregations of the dataframes shared by the sheets, see _aggregate
+        self.aggregations = {}
 
         self.dataframe = dataframe
         self.report_period = report_period
@@ -99,19 +104,14 @@ class ReportRenewalGuidance(Base):
         host_metric_dataframe['days_automated'] = host_metric_dataframe['days_automated'].apply(
             lambda x: x if x > 0 else 0)
 
-        ephemeral_usage_dataframe = None
+        ephemeral_usage_dataframes = {}
         if self.extra_params.get("opt_ephemeral") is not None:
             # Looking at the historical ephemeral usage, so we want to looks also at records that
             # were soft-deleted already.
-            ephemeral_usage_dataframe = self.compute_ephemeral_intervals(self.df_managed_nodes_query(
-                host_metric_dataframe, ephemeral=True, with_deleted=True))
-
-        # Create the workbook and worksheets
-        self.wb.remove(self.wb.active) # delete the default sheet
-        self.wb.create_sheet(title="Usage Reporting")
+            ephemeral_usage_dataframes = self.compute_ephemeral_intervals(host_metric_dataframe)
 
         # First sheet with billing
-        ws = self.wb.worksheets[0]
+        ws = self.wb.create_sheet(title="Usage Reporting")
 
         self._init_dimensions(ws)
         current_row = 1
@@ -119,46 +119,42 @@ class ReportRenewalGuidance(Base):
         current_row = self._build_header(current_row, ws)
 
         current_row = self._build_updated_timestamp(current_row, ws)
-        current_row = self._build_data_section(current_row, ws, host_metric_dataframe, ephemeral_usage_dataframe)
+        current_row = self._build_data_section(current_row, ws, host_metric_dataframe, ephemeral_usage_dataframes)
 
         # Add optional sheets
-        sheet_index = 1
         if "managed_nodes" in self.optional_report_sheets():
             # Sheet with list of managed nodes
             if self.extra_params.get("opt_ephemeral") is None:
-                self.wb.create_sheet(title="Managed nodes")
-                ws = self.wb.worksheets[sheet_index]
+                ws = self.wb.create_sheet(title="Managed nodes")
                 current_row = self._build_data_section_host_metrics(
                     1, ws, self.df_managed_nodes_query(host_metric_dataframe))
-                sheet_index += 1
             else:
-                self.wb.create_sheet(title="Managed nodes")
-                ws = self.wb.worksheets[sheet_index]
+                ws = self.wb.create_sheet(title="Managed nodes")
                 current_row = self._build_data_section_host_metrics(
                     1, ws, self.df_managed_nodes_query(host_metric_dataframe, ephemeral=False))
-                sheet_index += 1
 
-                self.wb.create_sheet(title="Managed nodes ephemeral")
-                ws = self.wb.worksheets[sheet_index]
+                ws = self.wb.create_sheet(title="Managed nodes ephemeral")
                 current_row = self._build_data_section_host_metrics(
                     1, ws, self.df_managed_nodes_query(host_metric_dataframe, ephemeral=True))
-                sheet_index += 1
 
-                self.wb.create_sheet(title="Managed nodes ephemeral usage")
-                ws = self.wb.worksheets[sheet_index]
-                current_row = self._build_data_section_ephemeral_usage(
-                    1, ws, ephemeral_usage_dataframe)
-                sheet_index += 1
+                for index, (ephemeral, ephemeral_usage_dataframe) in enumerate(ephemeral_usage_dataframes.items()):
+                    # Additional thresholds are compared in their own sheets
+                    ws = self.wb.create_sheet(title="Managed nodes ephemeral usage" if index == 0 else f"Ephemeral usage {ephemeral}")
+                    current_row = self._build_data_section_ephemeral_usage(
+                        1, ws, ephemeral_usage_dataframe)
 
-            self.wb.create_sheet(title="Deleted Managed nodes")
-            ws = self.wb.worksheets[sheet_index]
+            ws = self.wb.create_sheet(title="Deleted Managed nodes")
             current_row = self._build_data_section_host_metrics(
                 1, ws, self.df_deleted_managed_nodes_query(host_metric_dataframe))
-            sheet_index += 1
 
         return self.wb
 
-    def df_managed_nodes_query(self, dataframe, ephemeral=None, with_deleted=False):
+    def ephemeral_thresholds(self):
+        # The --ephemeral option can list more comma separated durations, e.g. 30d,60d,90d, the first
+        # one decides which hosts are ephemeral, the usage is computed for all of them
+        return [ephemeral.strip() for ephemeral in self.extra_params.get("opt_ephemeral").split(",")]
+
+    def df_managed_nodes_query(self, dataframe, ephemeral=None, with_deleted=False, ephemeral_threshold_option=None):
         if ephemeral is None:
             return dataframe[dataframe["deleted"]==False]
         else:
@@ -167,7 +163,7 @@ class ReportRenewalGuidance(Base):
                 dataframe = dataframe[dataframe["deleted"]==False]
 
             # Filter ephemeral based on number of automated days
-            ephemeral_days = parse_number_of_days(self.extra_params.get("opt_ephemeral"))
+            ephemeral_days = parse_number_of_days(ephemeral_threshold_option or self.ephemeral_thresholds()[0])
 
             # Ephemeral threshold, host's first automation must be older than ephemeral threshold
             # to be considered as ephemeral
@@ -198,32 +194,87 @@ class ReportRenewalGuidance(Base):
         return intervals
 
     def compute_ephemeral_intervals(self, host_metric_dataframe):
+        """
+        Counts the distinct ephemeral hosts automated in every window of each ephemeral threshold,
+        windows start every day of the report range and last as long as the threshold.
+
+        Rows are sorted by host name and first automation only once for all the thresholds. A row
+        falls into a range of consecutive windows, overlapping ranges of one host are merged and
+        all the windows are counted at once by a prefix sum of the range starts and ends.
+
+        :return: dict of the ephemeral usage dataframes by the threshold
+        """
         # Convert input date strings to datetime objects
         start_date = pd.to_datetime(
             self.extra_params['since_date']).tz_localize(None)
         end_date = pd.to_datetime(
             self.extra_params['until_date']).tz_localize(None) + datetime.timedelta(days=1) - datetime.timedelta(microseconds=1)
 
-        ephemeral_days = parse_number_of_days(self.extra_params.get("opt_ephemeral"))
-        ephemeral_usage_intervals = []
-        intervals = self.get_intervals(start_date, end_date, ephemeral_days)
-        for window_start, window_end in intervals:
-            # print(f"Processing {window_start}, {window_end}")
-            filtered = host_metric_dataframe[(host_metric_dataframe["last_automation"] >= window_start) & (host_metric_dataframe["first_automation"] <= window_end)]
-            ephemeral_usage_intervals.append({
-                "window_start": window_start,
-                "window_end": window_end,
-                "ephemeral_hosts": filtered["hostname"].nunique(),
+        host_metric_dataframe = host_metric_dataframe.dropna(subset=['hostname', 'first_automation', 'last_automation'])
+        host_metric_dataframe = host_metric_dataframe.sort_values(['hostname', 'first_automation'], kind='stable')
+
+        ephemeral_usage_dataframes = {}
+        for ephemeral in self.ephemeral_thresholds():
+            ephemeral_days = parse_number_of_days(ephemeral)
+            intervals = self.get_intervals(start_date, end_date, ephemeral_days)
+
+            hosts = self.df_managed_nodes_query(host_metric_dataframe, ephemeral=True, with_deleted=True,
+                                                ephemeral_threshold_option=ephemeral)
+            ephemeral_hosts = self.count_hosts_in_windows(hosts, start_date, ephemeral_days, len(intervals))
+
+            ephemeral_usage_dataframes[ephemeral] = pd.DataFrame({
+                "window_start": [window_start for window_start, _ in intervals],
+                "window_end": [window_end for _, window_end in intervals],
+                "ephemeral_hosts": ephemeral_hosts,
             })
 
-        return pd.DataFrame(ephemeral_usage_intervals)
+        return ephemeral_usage_dataframes
+
+    @staticmethod
+    def count_hosts_in_windows(hosts, start_date, window_days, windows):
+        """
+        Window k spans [start_date + k days, start_date + (k + window_days) days - 1 microsecond], a host
+        is counted in it if any of its rows has last_automation >= start and first_automation <= end.
 
+        :param hosts: dataframe sorted by hostname and first_automation
+        """
+        day = pd.Timedelta(days=1).value
+        start = start_date.value
+        window = window_days * day - pd.Timedelta(microseconds=1).value
+
+        first_automation = hosts['first_automation'].to_numpy(dtype='datetime64[ns]').astype('int64')
+        last_automation = hosts['last_automation'].to_numpy(dtype='datetime64[ns]').astype('int64')
+
+        # Range of the windows of every row, ceil and floor of the days from the start
+        first_window = np.maximum(-((start + window - first_automation) // day), 0)
+        last_window = np.minimum((last_automation - start) // day, windows - 1)
+
+        in_windows = first_window <= last_window
+        hostnames = pd.factorize(hosts['hostname'].to_numpy()[in_windows])[0]
+        first_window = first_window[in_windows]
+        last_window = last_window[in_windows]
+
+        if len(hostnames) == 0:
+            return np.zeros(windows, dtype='int64')
+
+        # Rows of a host are sorted by the first window, a row starts a new range unless it overlaps
+        # with the ranges of the host before it
+        last_window_before = pd.Series(last_window).groupby(hostnames).cummax().to_numpy()
+        new_range = np.r_[True, (hostnames[1:] != hostnames[:-1]) | (first_window[1:] > last_window_before[:-1])]
+
+        range_starts = np.flatnonzero(new_range)
+        range_first_window = first_window[range_starts]
+        range_last_window = np.maximum.reduceat(last_window, range_starts)
+
+        counts = (np.bincount(range_first_window, minlength=windows + 1) -
+                  np.bincount(range_last_window + 1, minlength=windows + 1))
+        return np.cumsum(counts)[:windows]
 
     def _init_dimensions(self, ws):
         for key, value in self.config['column_widths'].items():
             ws.column_dimensions[get_column_letter(key)].width = value
 
-    def _build_data_section(self, current_row, ws, dataframe, ephemeral_usage_dataframe):
+    def _build_data_section(self, current_row, ws, dataframe, ephemeral_usage_dataframes):
         header_font = Font(name=self.FONT,
                            size=10,
                            color=self.BLACK_COLOR_HEX,
@@ -276,12 +327,15 @@ class ReportRenewalGuidance(Base):
             }
             ccsp_report.append(ccsp_report_item)
 
-            # Ephemeral automated hosts maximum concurrent usage in defined interval"
-            ccsp_report_item = {
-                'description': "Ephemeral automated hosts maximum\nconcurrent usage in defined interval",
-                'quantity_consumed': ephemeral_usage_dataframe['ephemeral_hosts'].max()
-            }
-            ccsp_report.append(ccsp_report_item)
+            # Ephemeral automated hosts maximum concurrent usage in defined interval", followed
+            # by the additional thresholds
+            for index, (ephemeral, ephemeral_usage_dataframe) in enumerate(ephemeral_usage_dataframes.items()):
+                description = "Ephemeral automated hosts maximum\nconcurrent usage in defined interval"
+                ccsp_report_item = {
+                    'description': description if index == 0 else f"{description} ({ephemeral})",
+                    'quantity_consumed': ephemeral_usage_dataframe['ephemeral_hosts'].max()
+                }
+                ccsp_report.append(ccsp_report_item)
 
         # Deleted automated hosts
         ccsp_report_item = {
@@ -302,6 +356,7 @@ class ReportRenewalGuidance(Base):
             columns={"description": "Description",
                      "quantity_consumed": "Quantity",
                     })
+        self._export_section(self.section_name(ws.title), ccsp_report_dataframe)
 
         row_counter = 0
         rows = dataframe_to_rows(ccsp_report_dataframe, index=False)
@@ -341,14 +396,6 @@ class ReportRenewalGuidance(Base):
         for key, value in self.config['data_column_widths'].items():
             ws.column_dimensions[get_column_letter(key)].width = value
 
-        header_font = Font(name=self.FONT,
-                           size=10,
-                           color=self.BLACK_COLOR_HEX,
-                           bold=True)
-        value_font = Font(name=self.FONT,
-                          size=10,
-                          color=self.BLACK_COLOR_HEX)
-
         # Rename the columns based on the template
         ccsp_report_dataframe = dataframe.reset_index()
         ccsp_report_dataframe = ccsp_report_dataframe.reindex(
@@ -389,38 +436,12 @@ class ReportRenewalGuidance(Base):
             }
         )
 
-        row_counter = 0
-        rows = dataframe_to_rows(ccsp_report_dataframe, index=False)
-        for r_idx, row in enumerate(rows, current_row):
-            for c_idx, value in enumerate(row, 1):
-                cell = ws.cell(row=r_idx, column=c_idx)
-                cell.value = value
-
-                if row_counter == 0:
-                    # set header style
-                    cell.font = header_font
-                    rd = ws.row_dimensions[r_idx]
-                    rd.height = 25
-                else:
-                    # set value style
-                    cell.font = value_font
-
-            row_counter += 1
-
-        return current_row + row_counter
+        return self._build_data_rows(current_row, ws, ccsp_report_dataframe)
 
     def _build_data_section_ephemeral_usage (self, current_row, ws, dataframe):
         for key, value in self.config['uniform_column_widths'].items():
             ws.column_dimensions[get_column_letter(key)].width = value
 
-        header_font = Font(name=self.FONT,
-                           size=10,
-                           color=self.BLACK_COLOR_HEX,
-                           bold=True)
-        value_font = Font(name=self.FONT,
-                          size=10,
-                          color=self.BLACK_COLOR_HEX)
-
         # Rename the columns based on the template
         ccsp_report_dataframe = dataframe.reset_index()
         ccsp_report_dataframe = ccsp_report_dataframe.reindex(
@@ -439,25 +460,7 @@ class ReportRenewalGuidance(Base):
             }
         )
 
-        row_counter = 0
-        rows = dataframe_to_rows(ccsp_report_dataframe, index=False)
-        for r_idx, row in enumerate(rows, current_row):
-            for c_idx, value in enumerate(row, 1):
-                cell = ws.cell(row=r_idx, column=c_idx)
-                cell.value = value
-
-                if row_counter == 0:
-                    # set header style
-                    cell.font = header_font
-                    rd = ws.row_dimensions[r_idx]
-                    rd.height = 25
-                else:
-                    # set value style
-                    cell.font = value_font
-
-            row_counter += 1
-
-        return current_row + row_counter
+        return self._build_data_rows(current_row, ws, ccsp_report_dataframe)
 
     def _build_heading_h1(self, current_row, ws):
         # Merge cells and insert the h1 heading
@@ -2,7 +2,7 @@
 # Code for building the spreadsheet
 ######################################
 from metrics_utility.automation_controller_billing.report.base import Base
-from openpyxl import Workbook
+from metrics_utility.automation_controller_billing.report.spreadsheet import Spreadsheet
 from openpyxl.styles import Font, PatternFill, Border, Side, Alignment
 from openpyxl.utils import get_column_letter
 from openpyxl.utils.dataframe import dataframe_to_rows
@@ -12,7 +12,11 @@ import time
 
 class ReportRenewalGuidanceV2(Base):
     def __init__(self, dataframe, report_period, extra_params):
-        self.wb = Workbook()
+        self.wb = Spreadsheet()
+        # Data sections saved next to the report, by the name of the section
+        self.sidecar_dataframes = {}
+        # Aggregations of the dataframes shared by the sheets, see _aggregate
+        self.aggregations = {}
 
         self.dataframe = dataframe
         self.report_period = report_period
@@ -94,12 +98,8 @@ class ReportRenewalGuidanceV2(Base):
         events_dataframe = self.dataframe[1]
         events_dataframe = self._fix_event_host_names(job_host_summary_dataframe, events_dataframe)
 
-        # Create the workbook and worksheets
-        self.wb.remove(self.wb.active) # delete the default sheet
-        self.wb.create_sheet(title="Usage Reporting")
-
         # First sheet with billing
-        ws = self.wb.worksheets[0]
+        ws = self.wb.create_sheet(title="Usage Reporting")
 
         self._init_dimensions(ws)
         current_row = self._build_heading_h1(1, ws)
@@ -109,42 +109,31 @@ class ReportRenewalGuidanceV2(Base):
         current_row = self._build_data_section(current_row, ws, job_host_summary_dataframe)
 
         # Add optional sheets
-        sheet_index = 1
         if "managed_nodes" in self.optional_report_sheets():
             # Sheet with list of managed nodes
-            self.wb.create_sheet(title="Managed nodes")
-            ws = self.wb.worksheets[sheet_index]
+            ws = self.wb.create_sheet(title="Managed nodes")
             current_row = self._build_data_section_usage_by_node(1, ws, job_host_summary_dataframe)
-            sheet_index += 1
 
         if "usage_by_organizations" in self.optional_report_sheets():
             # Sheet with usage by org
-            self.wb.create_sheet(title="Usage by organizations")
-            ws = self.wb.worksheets[sheet_index]
+            ws = self.wb.create_sheet(title="Usage by organizations")
             current_row = self._build_data_section_usage_by_org(1, ws, job_host_summary_dataframe)
-            sheet_index += 1
 
         if events_dataframe is not None:
             if "usage_by_collections" in self.optional_report_sheets():
                 # Sheet with usage by collections
-                self.wb.create_sheet(title="Usage by collections")
-                ws = self.wb.worksheets[sheet_index]
+                ws = self.wb.create_sheet(title="Usage by collections")
                 current_row = self._build_data_section_usage_by_collections(1, ws, events_dataframe)
-                sheet_index += 1
 
             if "usage_by_roles" in self.optional_report_sheets():
                 # Sheet with usage by roles
-                self.wb.create_sheet(title="Usage by roles")
-                ws = self.wb.worksheets[sheet_index]
+                ws = self.wb.create_sheet(title="Usage by roles")
                 current_row = self._build_data_section_usage_by_roles(1, ws, events_dataframe)
-                sheet_index += 1
 
             if "usage_by_modules" in self.optional_report_sheets():
                 # Sheet with usage by modules
-                self.wb.create_sheet(title="Usage by modules")
-                ws = self.wb.worksheets[sheet_index]
+                ws = self.wb.create_sheet(title="Usage by modules")
                 current_row = self._build_data_section_usage_by_modules(1, ws, events_dataframe)
-                sheet_index += 1
 
         return self.wb
 
@@ -152,22 +141,12 @@ class ReportRenewalGuidanceV2(Base):
         for key, value in self.config['data_column_widths'].items():
             ws.column_dimensions[get_column_letter(key)].width = value
 
-        header_font = Font(name=self.FONT,
-                           size=10,
-                           color=self.BLACK_COLOR_HEX,
-                           bold=True)
-        value_font = Font(name=self.FONT,
-                          size=10,
-                          color=self.BLACK_COLOR_HEX)
-
         # Rename the columns based on the template
-        ccsp_report_dataframe = (
-            dataframe.groupby('organization_name', dropna=False)
-            .agg(
-                host_runs_unique=('host_name', 'nunique'),
-                host_runs=('host_name', 'count'),
-                task_runs=('task_runs', 'sum')
-            )
+        ccsp_report_dataframe = self._aggregate(
+            dataframe, 'organization_name',
+            host_runs_unique=('host_name', 'nunique'),
+            host_runs=('host_name', 'count'),
+            task_runs=('task_runs', 'sum')
         )
         ccsp_report_dataframe = ccsp_report_dataframe.reset_index()
         ccsp_report_dataframe = ccsp_report_dataframe.reindex(
@@ -188,25 +167,7 @@ class ReportRenewalGuidanceV2(Base):
             }
         )
 
-        row_counter = 0
-        rows = dataframe_to_rows(ccsp_report_dataframe, index=False)
-        for r_idx, row in enumerate(rows, current_row):
-            for c_idx, value in enumerate(row, 1):
-                cell = ws.cell(row=r_idx, column=c_idx)
-                cell.value = value
-
-                if row_counter == 0:
-                    # set header style
-                    cell.font = header_font
-                    rd = ws.row_dimensions[r_idx]
-                    rd.height = 25
-                else:
-                    # set value style
-                    cell.font = value_font
-
-            row_counter += 1
-
-        return current_row + row_counter
+        return self._build_data_rows(current_row, ws, ccsp_report_dataframe)
 
     def _init_dimensions(self, ws):
         for key, value in self.config['column_widths'].items():
@@ -349,7 +310,9 @@ class ReportRenewalGuidanceV2(Base):
         )
 
         ccsp_report = {}
-        quantity_consumed = dataframe["host_name"].nunique()
+        # Hosts are aggregated once for the summary and the sheet of the managed nodes
+        hosts = self._aggregate(dataframe, 'host_name', host_runs=('host_name', 'count'))
+        quantity_consumed = hosts.index.notna().sum()
         if quantity_consumed > 0:
             # COmpute the unique hostnam count that are in the df index
             ccsp_report["end_user_company_name"] = self.extra_params['report_end_user_company_name']
@@ -399,6 +362,7 @@ class ReportRenewalGuidanceV2(Base):
                      "extended_unit_price": "SKU Extended Unit\nPrice",
                      "notes": "Notes",
                     })
+        self._export_section(self.section_name(ws.title), ccsp_report_dataframe)
 
         row_counter = 0
         rows = dataframe_to_rows(ccsp_report_dataframe, index=False)
@@ -0,0 +1,97 @@
+######################################
+# Streaming workbook of the reports
+######################################
+from openpyxl import Workbook
+from openpyxl.cell import Cell
+from openpyxl.styles import NamedStyle
+from openpyxl.worksheet._write_only import WriteOnlyWorksheet
+from openpyxl.worksheet.cell_range import CellRange
+
+
+class Spreadsheet(Workbook):
+    """
+    Write-only workbook, the rows of its worksheets are streamed into temporary files
+    instead of keeping a cell object of every value in memory until the workbook is saved.
+    """
+    def __init__(self):
+        super().__init__(write_only=True)
+
+    def create_sheet(self, title=None, index=None):
+        worksheet = StreamingWorksheet(parent=self, title=title)
+        self._add_sheet(sheet=worksheet, index=index)
+        return worksheet
+
+    def named_style(self, name, **attributes):
+        # Styles of the data sections are shared by all their cells
+        if name not in self.named_styles:
+            self.add_named_style(NamedStyle(name=name, **attributes))
+        return name
+
+
+class StreamingWorksheet(WriteOnlyWorksheet):
+    """
+    Write-only worksheet with the cell() and merge_cells() of the normal worksheet. Cells are
+    buffered until the rows before a streamed row are written or until the worksheet is closed,
+    so the headers can be still written in any order. Column widths must be set before the
+    first row is written.
+    """
+    def __init__(self, parent, title):
+        super().__init__(parent, title)
+        self._buffered_rows = {}
+        self._next_row = 1
+
+    def cell(self, row, column):
+        if row < self._next_row:
+            raise ValueError(f"Row {row} of the worksheet {self.title} was already written")
+
+        cells = self._buffered_rows.setdefault(row, {})
+        if column not in cells:
+            cells[column] = Cell(self, row=row, column=column)
+        return cells[column]
+
+    def styled_cell(self, value, style):
+        # Style goes first, values of dates set the number format of the cell
+        cell = Cell(self)
+        cell.style = style
+        cell.value = value
+        return cell
+
+    def merge_cells(self, start_row, start_column, end_row, end_column):
+        self.merged_cells.add(CellRange(min_col=start_column, min_row=start_row,
+                                        max_col=end_column, max_row=end_row))
+
+    def write_row(self, row, values):
+        """
+        Streams the values (or cells) of the row, the rows before it are written first
+        """
+        if row < self._next_row or row in self._buffered_rows:
+            raise ValueError(f"Row {row} of the worksheet {self.title} was already written")
+
+        self._write_buffered_rows(row)
+        self._append(row, values)
+
+    def close(self):
+        self._write_buffered_rows()
+        super().close()
+
+    def _write_buffered_rows(self, before_row=None):
+        for row in sorted(self._buffered_rows):
+            if before_row is not None and row >= before_row:
+                break
+
+            cells = self._buffered_rows.pop(row)
+            self._append(row, [cells.get(column) for column in range(1, max(cells) + 1)])
+
+    def _append(self, row, values):
+        # Rows are written one after another, skipped rows are written empty
+        while self._next_row < row:
+            self.append([])
+            self._next_row += 1
+
+        for column, value in enumerate(values, 1):
+            if isinstance(value, Cell):
+                value.row = row
+                value.column = column
+
+        self.append(values)
+        self._next_row += 1
@@ -7,6 +7,8 @@ import tempfile
 
 import pandas as pd
 
+from metrics_utility.automation_controller_billing.report_saver.sidecar import sidecar_dir, sidecar_formats, sidecar_path, write_sidecar
+
 
 class ReportSaverDirectory():
     LOG_PREFIX = "[ExtractorDirectory]"
@@ -19,6 +21,12 @@ class ReportSaverDirectory():
         self.report_spreadsheet_destination_path = self.extra_params["report_spreadsheet_destination_path"]
 
     def report_exist(self):
+        if self.extra_params.get('opt_export_only'):
+            # Only the data sections are saved. Sections too long for a sheet are saved next to the
+            # report too, these alone are not the export
+            return os.path.exists(sidecar_dir(self.report_spreadsheet_destination_path)) and \
+                not os.path.exists(self.report_spreadsheet_destination_path)
+
         if os.path.exists(self.report_spreadsheet_destination_path):
             return True
         return False
@@ -29,4 +37,15 @@ class ReportSaverDirectory():
 
         report_spreadsheet.save(self.report_spreadsheet_destination_path)
 
-        self.logger.info(f"Report generated into: {self.report_spreadsheet_destination_path}")
\ No newline at end of file
+        self.logger.info(f"Report generated into: {self.report_spreadsheet_destination_path}")
+        return True
+
+    def save_dataframe(self, name, dataframe):
+        # Data section saved next to the report, sections of the organizations into their directory
+        for format in sidecar_formats(self.extra_params):
+            path = sidecar_path(self.report_spreadsheet_destination_path, name, format)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            write_sidecar(dataframe, path, format)
+
+            self.logger.info(f"Report data {name} generated into: {path}")
+        return True
@@ -8,6 +8,7 @@ import tempfile
 import pandas as pd
 
 from metrics_utility.automation_controller_billing.base.s3_handler import S3Handler
+from metrics_utility.automation_controller_billing.report_saver.sidecar import sidecar_dir, sidecar_formats, sidecar_path, write_sidecar
 
 
 class ReportSaverS3():
@@ -22,6 +23,13 @@ class ReportSaverS3():
         self.s3_handler = S3Handler(params=self.extra_params)
 
     def report_exist(self):
+        if self.extra_params.get('opt_export_only'):
+            # Only the data sections are saved. Sections too long for a sheet are saved next to the
+            # report too, these alone are not the export
+            prefix = f"{sidecar_dir(self.report_spreadsheet_destination_path)}/"
+            return len([file for file in self.s3_handler.list_files(prefix)]) > 0 and \
+                len([file for file in self.s3_handler.list_files(self.report_spreadsheet_destination_path)]) == 0
+
         if len([file for file in self.s3_handler.list_files(self.report_spreadsheet_destination_path)]) > 0:
             return True
         return False
@@ -36,5 +44,28 @@ class ReportSaverS3():
 
             except Exception as e:
                 self.logger.exception(f"{self.LOG_PREFIX} ERROR: Saving report to S3 into path {self.report_spreadsheet_destination_path} failed with {e}")
+                return False
+
+        self.logger.info(f"Report sent into S3 bucket into path: {self.report_spreadsheet_destination_path}")
+        return True
+
+    def save_dataframe(self, name, dataframe):
+        # Data section saved next to the report, sections of the organizations into their directory
+        saved = True
+        for format in sidecar_formats(self.extra_params):
+            path = sidecar_path(self.report_spreadsheet_destination_path, name, format)
+
+            with tempfile.TemporaryDirectory(prefix="report_saver_billing_data_") as temp_dir:
+                try:
+                    local_path = os.path.join(temp_dir, os.path.basename(path))
+                    write_sidecar(dataframe, local_path, format)
+
+                    self.s3_handler.upload_file(local_path, path)
+
+                except Exception as e:
+                    self.logger.exception(f"{self.LOG_PREFIX} ERROR: Saving report data to S3 into path {path} failed with {e}")
+                    saved = False
+                    continue
 
-        self.logger.info(f"Report sent into S3 bucket into path: {self.report_spreadsheet_destination_path}")
\ No newline at end of file
+            self.logger.info(f"Report data {name} sent into S3 bucket into path: {path}")
+        return saved
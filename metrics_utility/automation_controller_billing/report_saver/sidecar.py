@@ -0,0 +1,33 @@
+import os
+
+from metrics_utility.automation_controller_billing.collection_format import CSV, PARQUET
+
+"""
+Data sections of the report saved as files next to the spreadsheet, into the directory named as
+the report, e.g. CCSPv2-2024-05/managed_nodes.csv. These are all the sections with the --export
+option, otherwise only the sections too long for the rows of one sheet. CSV by default, or Parquet
+which needs the optional pyarrow dependency (pip install metrics-utility[parquet]).
+"""
+
+
+def sidecar_formats(extra_params):
+    # Formats of the --export option, or the format of the sections too long for one sheet
+    return extra_params.get('opt_export') or [os.environ.get('METRICS_UTILITY_REPORT_SIDECAR_FORMAT', CSV)]
+
+
+def sidecar_dir(report_path):
+    return os.path.splitext(report_path)[0]
+
+
+def sidecar_path(report_path, name, format):
+    return os.path.join(sidecar_dir(report_path), f"{name}.{format}")
+
+
+def write_sidecar(dataframe, path, format):
+    # Column labels of the sheets span more lines
+    dataframe = dataframe.rename(columns=lambda column: " ".join(str(column).split("\n")))
+
+    if format == PARQUET:
+        dataframe.to_parquet(path, index=False)
+    else:
+        dataframe.to_csv(path, index=False)
@@ -0,0 +1,165 @@
+"""
+Schemas of the gathered tables, shared by the collectors writing them, the extractors
+parsing them and the dataframe engines. Columns are read with these explicit types,
+without inferring them from the data.
+"""
+
+import pandas as pd
+
+INTEGER = 'integer'
+FLOAT = 'float'
+BOOLEAN = 'boolean'
+STRING = 'string'
+# Strings with few distinct values, e.g. names of organizations, templates and hosts
+CATEGORY = 'category'
+TIMESTAMP = 'timestamp'
+
+# PostgreSQL booleans as exported by COPY
+TRUE_VALUES = ['t', 'true']
+FALSE_VALUES = ['f', 'false']
+
+TABLES = {
+    'job_host_summary': {
+        'id': INTEGER,
+        'created': TIMESTAMP,
+        'modified': TIMESTAMP,
+        'host_name': CATEGORY,
+        'host_remote_id': INTEGER,
+        'ansible_host_variable': CATEGORY,
+        'ansible_connection_variable': CATEGORY,
+        'changed': INTEGER,
+        'dark': INTEGER,
+        'failures': INTEGER,
+        'ok': INTEGER,
+        'processed': INTEGER,
+        'skipped': INTEGER,
+        'failed': BOOLEAN,
+        'ignored': INTEGER,
+        'rescued': INTEGER,
+        'job_created': TIMESTAMP,
+        'job_remote_id': INTEGER,
+        'job_template_remote_id': INTEGER,
+        'job_template_name': CATEGORY,
+        'inventory_remote_id': INTEGER,
+        'inventory_name': CATEGORY,
+        'organization_remote_id': INTEGER,
+        'organization_name': CATEGORY,
+        'project_remote_id': INTEGER,
+        'project_name': CATEGORY,
+    },
+    'job_host_summary_rollup': {
+        'organization_name': CATEGORY,
+        'job_template_name': CATEGORY,
+        'host_name': CATEGORY,
+        'ansible_host_variable': CATEGORY,
+        'job_remote_id': INTEGER,
+        'task_runs': INTEGER,
+        'host_runs': INTEGER,
+        'first_automation': TIMESTAMP,
+        'last_automation': TIMESTAMP,
+        'job_created': TIMESTAMP,
+    },
+    # Columns of both the raw events and the rollup mode
+    'main_jobevent': {
+        'main_jobhostsummary_id': INTEGER,
+        'main_jobhostsummary_created': TIMESTAMP,
+        'id': INTEGER,
+        'created': TIMESTAMP,
+        'modified': TIMESTAMP,
+        'job_created': TIMESTAMP,
+        'event': CATEGORY,
+        'task_action': CATEGORY,
+        'resolved_action': CATEGORY,
+        'resolved_role': CATEGORY,
+        'duration': FLOAT,
+        'failed': BOOLEAN,
+        'changed': BOOLEAN,
+        'playbook': CATEGORY,
+        'play': STRING,
+        'task': STRING,
+        'role': CATEGORY,
+        'job_remote_id': INTEGER,
+        'host_remote_id': INTEGER,
+        'host_name': CATEGORY,
+        'task_runs': INTEGER,
+    },
+    # Written by the collector into every tarball, with the exact time range of every gathered table
+    'data_collection_status': {
+        'collection_start_timestamp': TIMESTAMP,
+        'since': TIMESTAMP,
+        'until': TIMESTAMP,
+        'file_name': STRING,
+        'status': STRING,
+        'elapsed': FLOAT,
+    },
+    # Read from the controller's database by the RENEWAL_GUIDANCE report
+    'host_metric': {
+        'hostname': STRING,
+        'host_id': INTEGER,
+        'first_automation': TIMESTAMP,
+        'last_automation': TIMESTAMP,
+        'automated_counter': INTEGER,
+        'deleted_counter': INTEGER,
+        'last_deleted': TIMESTAMP,
+        'deleted': BOOLEAN,
+        'ansible_product_serial': STRING,
+        'ansible_machine_id': STRING,
+        'ansible_host_variable': STRING,
+        'ansible_connection_variable': STRING,
+    },
+}
+
+# Types of the parsed columns, timestamps are parsed separately by parse_timestamps()
+PANDAS_TYPES = {
+    INTEGER: 'Int64',
+    FLOAT: 'float64',
+    BOOLEAN: 'boolean',
+    STRING: 'object',
+    CATEGORY: 'category',
+}
+
+ARROW_TYPES = {
+    INTEGER: 'int64',
+    FLOAT: 'float64',
+    BOOLEAN: 'bool',
+    STRING: 'string',
+    CATEGORY: 'string',
+}
+
+
+def columns(table, projection=None):
+    # Columns of the table with their types, limited to the projection if given
+    schema = TABLES.get(table, {})
+    if projection is None:
+        return schema
+
+    return {column: kind for column, kind in schema.items() if column in projection}
+
+
+def pandas_types(table, projection=None):
+    return {column: PANDAS_TYPES[kind] for column, kind in columns(table, projection).items() if kind != TIMESTAMP}
+
+
+def timestamp_columns(table, projection=None):
+    return [column for column, kind in columns(table, projection).items() if kind == TIMESTAMP]
+
+
+def arrow_types(table):
+    import pyarrow as pa
+
+    types = {}
+    for column, kind in columns(table).items():
+        if kind == TIMESTAMP:
+            # PostgreSQL timestamps have microsecond precision
+            types[column] = pa.timestamp('us', tz='UTC')
+        else:
+            types[column] = pa.type_for_alias(ARROW_TYPES[kind])
+    return types
+
+
+def parse_timestamps(dataframe, table):
+    # Timestamps are written with the varying precision and the offset, e.g. 2024-01-01 10:00:00.5+00
+    for column in timestamp_columns(table, dataframe.columns):
+        dataframe[column] = pd.to_datetime(dataframe[column], format='ISO8601', utc=True)
+
+    return dataframe
@@ -29,3 +29,11 @@ class UnparsableParameter(Exception):
 class NotSupportedFactory(Exception):
     def __init__(self, message):
         self.name = message
+
+class MissingRequiredFile(Exception):
+    def __init__(self, message):
+        self.name = message
+
+class BadReportSection(Exception):
+    def __init__(self, message):
+        self.name = message
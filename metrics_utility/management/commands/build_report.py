@@ -10,8 +10,9 @@ from metrics_utility.automation_controller_billing.dataframe_engine.factory impo
 from metrics_utility.automation_controller_billing.extract.factory import Factory as ExtractorFactory
 from metrics_utility.automation_controller_billing.report.factory import Factory as ReportFactory
 from metrics_utility.automation_controller_billing.report_saver.factory import Factory as ReportSaverFactory
+from metrics_utility.automation_controller_billing.report_saver.sidecar import sidecar_dir
 from metrics_utility.automation_controller_billing.helpers import parse_date_param
-from metrics_utility.management.validation import handle_directory_ship_target, handle_s3_ship_target
+from metrics_utility.management.validation import handle_directory_ship_target, handle_s3_ship_target, handle_format, handle_export_formats
 
 from dateutil import parser
 from django.core.management.base import BaseCommand
@@ -44,7 +45,18 @@ class Command(BaseCommand):
                             dest='ephemeral',
                             action='store',
                             help='Duration in months or days to determine if host is ephemeral. Months are taken'\
-                                 'as 30days duration.')
+                                 'as 30days duration. More comma separated durations, e.g. 30d,60d,90d, compare '\
+                                 'the ephemeral usage of each one, the first one determines the ephemeral hosts.')
+        parser.add_argument('--export',
+                            dest='export',
+                            action='store',
+                            help='Comma separated formats, csv and/or parquet, of the data sections of the report '\
+                                 'saved next to it, into the directory named as the report.')
+        parser.add_argument('--export-only',
+                            dest='export_only',
+                            action='store_true',
+                            help='Save only the data sections of the report, without the spreadsheet. In csv, '\
+                                 'unless the --export option sets the formats.')
         parser.add_argument('--force',
                             dest='force',
                             action='store_true',
@@ -78,13 +90,19 @@ class Command(BaseCommand):
 
         opt_ephemeral = options.get('ephemeral') or None
 
+        opt_export = handle_export_formats(options.get('export') or None)
+        opt_export_only = options.get('export_only')
+
         opt_force = options.get('force')
 
         ship_target = os.getenv('METRICS_UTILITY_SHIP_TARGET', None)
         extra_params = self._handle_extra_params(ship_target)
+        handle_format('METRICS_UTILITY_REPORT_SIDECAR_FORMAT')
         extra_params['opt_since'] = opt_since
         extra_params['opt_until'] = opt_until
         extra_params['opt_ephemeral'] = opt_ephemeral
+        extra_params['opt_export'] = opt_export
+        extra_params['opt_export_only'] = opt_export_only
 
         extractor = ExtractorFactory(ship_target, extra_params).create()
 
@@ -129,8 +147,23 @@ class Command(BaseCommand):
         report_spreadsheet = report_engine.build_spreadsheet()
 
         # Save the report to the configured destination
-        report_saver_engine.save(report_spreadsheet)
-        self.logger.info(f"Report generated into {ship_target}: {report_saver_engine.report_spreadsheet_destination_path}")
+        saved = []
+        if not opt_export_only:
+            saved.append(report_saver_engine.save(report_spreadsheet))
+        for name, dataframe in report_engine.sidecar_dataframes.items():
+            saved.append(report_saver_engine.save_dataframe(name, dataframe))
+
+        if opt_export_only:
+            destination_path = sidecar_dir(report_saver_engine.report_spreadsheet_destination_path)
+        else:
+            destination_path = report_saver_engine.report_spreadsheet_destination_path
+
+        if not saved:
+            self.logger.info(f"No report data to export into {ship_target}: {destination_path}")
+        elif all(saved):
+            self.logger.info(f"Report generated into {ship_target}: {destination_path}")
+        else:
+            self.logger.error(f"Report generation into {ship_target}: {destination_path} failed")
 
     def _handle_ship_target(self, ship_target):
         if ship_target == "controller_db":
@@ -183,7 +216,6 @@ class Command(BaseCommand):
             "report_end_user_company_state": os.getenv('METRICS_UTILITY_REPORT_END_USER_STATE', ""),
             "report_end_user_company_country": os.getenv('METRICS_UTILITY_REPORT_END_USER_COUNTRY', ""),
             # Renewal guidance specific params
-            "report_renewal_guidance_dedup_iterations": os.getenv('REPORT_RENEWAL_GUIDANCE_DEDUP_ITERATIONS', "3"),
             "report_organization_filter": os.getenv('METRICS_UTILITY_ORGANIZATION_FILTER', None),
             # S3 specific options
             "s3_bucket_name": os.getenv('METRICS_UTILITY_BUCKET_NAME', None),
@@ -6,7 +6,7 @@ from metrics_utility.exceptions import BadShipTarget, MissingRequiredEnvVar, Fai
     BadRequiredEnvVar, NoAnalyticsCollected
 from metrics_utility.automation_controller_billing.collector import Collector
 from metrics_utility.management.validation import handle_directory_ship_target, handle_s3_ship_target, \
-    handle_crc_ship_target
+    handle_crc_ship_target, handle_format
 
 from dateutil import parser
 from django.core.management.base import BaseCommand
@@ -73,6 +73,7 @@ class Command(BaseCommand):
 
         ship_target = os.getenv('METRICS_UTILITY_SHIP_TARGET', None)
         billing_provider_params = self._handle_ship_target(ship_target)
+        handle_format('METRICS_UTILITY_COLLECTION_FORMAT')
 
         if opt_ship and opt_dry_run:
             self.logger.error('Arguments --ship and --dry-run cannot be processed at the same time, set only one of these.')
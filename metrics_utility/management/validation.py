@@ -1,5 +1,7 @@
+import importlib.util
 import os
-from metrics_utility.exceptions import BadShipTarget, MissingRequiredEnvVar, BadRequiredEnvVar
+from metrics_utility.automation_controller_billing.collection_format import FORMATS, PARQUET
+from metrics_utility.exceptions import BadShipTarget, MissingRequiredEnvVar, BadRequiredEnvVar, UnparsableParameter
 
 
 def handle_directory_ship_target(ship_target):
@@ -65,3 +67,37 @@ def handle_crc_ship_target(ship_target):
         billing_provider_params["red_hat_org_id"] = red_hat_org_id
 
     return billing_provider_params
+
+
+def handle_format(env_var):
+    # Format of the gathered tables or of the report data sections, e.g. METRICS_UTILITY_COLLECTION_FORMAT
+    data_format = os.getenv(env_var, None)
+    if not data_format:
+        return
+
+    if data_format not in FORMATS:
+        raise BadRequiredEnvVar(
+            f"Unexpected value for {env_var} env var, allowed values are {FORMATS}")
+
+    if data_format == PARQUET and importlib.util.find_spec('pyarrow') is None:
+        raise BadRequiredEnvVar(
+            f"{env_var}=parquet needs the pyarrow package, "\
+            "install it with: pip install metrics-utility[parquet]")
+
+
+def handle_export_formats(export):
+    # Formats of the --export option, e.g. csv,parquet
+    if not export:
+        return None
+
+    export_formats = [export_format.strip() for export_format in export.split(",")]
+    for export_format in export_formats:
+        if export_format not in FORMATS:
+            raise UnparsableParameter(
+                f"Unexpected value {export_format} of the --export option, allowed values are {FORMATS}")
+
+        if export_format == PARQUET and importlib.util.find_spec('pyarrow') is None:
+            raise UnparsableParameter(
+                "--export=parquet needs the pyarrow package, install it with: pip install metrics-utility[parquet]")
+
+    return export_formats
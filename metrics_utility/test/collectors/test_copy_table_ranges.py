@@ -0,0 +1,96 @@
+import datetime
+import io
+import os
+
+import pytest
+
+pytest.importorskip('awx', reason='the collectors run within the Automation Controller')
+
+from metrics_utility.automation_controller_billing import collectors  # noqa: E402
+
+HEADER = b'id,modified,host_variables\n'
+
+
+class File:
+    # Records the writes into the split files
+    def __init__(self):
+        self.writes = []
+
+    def write(self, data):
+        self.writes.append(bytes(data))
+
+
+def rows(since, until):
+    # A row every hour of the range, with newlines and escaped quotes in the quoted values
+    rows = []
+    modified = since
+    while modified < until:
+        rows.append(f'{int(modified.timestamp())},{modified.isoformat()},"{{""a"":\n""{modified.hour}""}}"\n'.encode())
+        modified += datetime.timedelta(hours=1)
+
+    return b''.join(rows)
+
+
+@pytest.mark.parametrize('chunk_size', [1, 5, 7, 64, 1024 * 1024])
+def test_copy_csv_rows(chunk_size):
+    since = datetime.datetime(2024, 2, 21, tzinfo=datetime.timezone.utc)
+    data = rows(since, since + datetime.timedelta(days=1))
+    file = File()
+
+    collectors._copy_csv_rows(io.BytesIO(data), file, chunk_size=chunk_size)
+
+    assert b''.join(file.writes) == data
+    # Newlines within the quoted values don't end the writes
+    for write in file.writes:
+        assert write.endswith(b'\n')
+        assert write.count(b'"') % 2 == 0
+
+
+def test_copy_csv_rows_without_last_newline():
+    file = File()
+
+    collectors._copy_csv_rows(io.BytesIO(b'1,"a\nb"\n2,"c'), file, chunk_size=4)
+
+    assert file.writes == [b'1,"a\nb"\n', b'2,"c']
+
+
+def test_copy_table_ranges(tmp_path, monkeypatch):
+    since = datetime.datetime(2024, 2, 21, tzinfo=datetime.timezone.utc)
+    until = since + datetime.timedelta(days=1)
+    queries = []
+
+    def copy_range(query, part_path):
+        queries.append(query)
+        with open(part_path, 'wb') as part:
+            part.write(HEADER + rows(*query))
+
+    monkeypatch.setattr(collectors, 'copy_parallelism', lambda: 3)
+    monkeypatch.setattr(collectors, '_copy_range', copy_range)
+
+    files = collectors._copy_table_ranges('job_host_summary', lambda since, until: (since, until), since, until,
+                                          str(tmp_path))
+
+    # Sub ranges cover the slice, merged in their order under one header
+    assert sorted(queries) == [(since, since + datetime.timedelta(hours=8)),
+                               (since + datetime.timedelta(hours=8), since + datetime.timedelta(hours=16)),
+                               (since + datetime.timedelta(hours=16), until)]
+    assert files == [str(tmp_path / 'job_host_summary_table.csv')]
+    with open(files[0], 'rb') as f:
+        assert f.read() == HEADER + rows(since, until)
+    assert os.listdir(tmp_path) == ['job_host_summary_table.csv']
+
+
+@pytest.mark.parametrize('pg_functions_created', [False, True])
+def test_pg_functions_prepended(monkeypatch, pg_functions_created):
+    prepend_queries = []
+    monkeypatch.setattr(collectors, '_export_table',
+                        lambda prepend_query=None, **kwargs: prepend_queries.append(prepend_query))
+    monkeypatch.setenv('METRICS_UTILITY_OPTIONAL_COLLECTORS', 'job_host_summary_rollup')
+    since = datetime.datetime(2024, 2, 21, tzinfo=datetime.timezone.utc)
+
+    for table in (collectors.job_host_summary_table, collectors.job_host_summary_rollup_table):
+        table(since=since, full_path='', until=since + datetime.timedelta(days=1),
+              pg_functions_created=pg_functions_created)
+
+    # The functions created before the concurrent slices are not created again by every slice
+    assert prepend_queries == [None if pg_functions_created else collectors.pg_functions()] * 2
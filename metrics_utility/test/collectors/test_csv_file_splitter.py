@@ -0,0 +1,60 @@
+import pandas as pd
+
+from metrics_utility.automation_controller_billing.csv_file_splitter import BinaryCsvFileSplitter
+
+HEADER = b'id,host_name,host_variables\n'
+# Host variables with newlines in the quoted values
+ROWS = [f'{index},host{index},"{{""ansible_host"":\n""host{index}""}}"\n'.encode() for index in range(100)]
+
+
+def splitter(tmp_path, max_file_size):
+    return BinaryCsvFileSplitter(filespec=str(tmp_path / 'job_host_summary_table.csv'), max_file_size=max_file_size)
+
+
+def test_rows_split_into_files(tmp_path):
+    file = splitter(tmp_path, max_file_size=500)
+    # Rows are written as read from a COPY, the header first
+    for row in [HEADER] + ROWS:
+        file.write(memoryview(row))
+    files = file.file_list()
+
+    assert len(files) > 1
+    rows = b''
+    for path in files:
+        with open(path, 'rb') as f:
+            assert f.readline() == HEADER
+            rows += f.read()
+    assert rows == b''.join(ROWS)
+
+    dataframe = pd.concat([pd.read_csv(path) for path in files], ignore_index=True)
+    assert list(dataframe['id']) == list(range(100))
+    assert dataframe['host_variables'][1] == '{"ansible_host":\n"host1"}'
+
+
+def test_split_only_after_row_end(tmp_path):
+    file = splitter(tmp_path, max_file_size=len(HEADER) + 10)
+    file.write(HEADER)
+
+    # A part of a row past the file size doesn't end the file, writes are expected to be whole rows
+    middle = ROWS[0].index(b'\n')
+    file.write(ROWS[0][:middle])
+    assert len(file.files) == 1
+
+    file.write(ROWS[0][middle:])
+    assert len(file.files) == 2
+
+    file.write(ROWS[1])
+    files = file.file_list()
+
+    for path, row in zip(files, ROWS[:2]):
+        with open(path, 'rb') as f:
+            assert f.read() == HEADER + row
+
+
+def test_single_file(tmp_path):
+    file = splitter(tmp_path, max_file_size=1024 * 1024)
+    for row in [HEADER] + ROWS:
+        file.write(row)
+
+    files = file.file_list()
+    assert files == [str(tmp_path / 'job_host_summary_table.csv')]
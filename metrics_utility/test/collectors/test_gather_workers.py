@@ -0,0 +1,167 @@
+import datetime
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+import pytest
+from insights_analytics_collector import Package
+from insights_analytics_collector.collection import Collection
+
+from metrics_utility.automation_controller_billing import collector
+from metrics_utility.automation_controller_billing.collector import Collector, MAX_GATHER_WORKERS
+from metrics_utility.automation_controller_billing.host_variables import pg_functions
+
+DAY = datetime.datetime(2024, 5, 1, tzinfo=datetime.timezone.utc)
+
+
+def day(index):
+    return DAY + datetime.timedelta(days=index)
+
+
+class Slice(Collection):
+    # Daily slice of a collector, failing to gather if asked to, the later slices can finish first
+    def __init__(self, key, index, gathering_successful=True, delay=0):
+        self.key = key
+        self.shipping_group = 'default'
+        self.since, self.until = day(index), day(index + 1)
+        self.full_sync_enabled = False
+        self.sub_collections = []
+        self.pg_functions_created = False
+        self.gathering_successful = None
+        self.finished_gathering = gathering_successful
+        self.delay = delay
+
+    def gather(self, max_data_size):
+        # The statements run on the main connection before the slice, and if the slice would create them again
+        self.gathered_after = (list(collector.connection.statements), self.pg_functions_created)
+        time.sleep(self.delay)
+        self.gathering_successful = self.finished_gathering
+
+    def is_empty(self):
+        return False
+
+    def data_size(self):
+        return 1
+
+
+class SlicePackage(Package):
+    def __init__(self):
+        self.collections = []
+        self.collection_keys = []
+        self.total_data_size = 0
+        self.shipping_successful = None
+
+
+class Connection:
+    def __init__(self):
+        self.statements = []
+
+    @contextmanager
+    def cursor(self):
+        yield self
+
+    def execute(self, statement):
+        self.statements.append(statement)
+
+    def close(self):
+        pass
+
+
+class SliceCollector(Collector):
+    # Collector of the slices, without the database and the controller, shipping the packages
+    # unless their slice is in failed_ships
+    def __init__(self, gather_dir, slices, failed_ships=()):
+        self.gather_dir = gather_dir
+        self.collections = {Collection.COLLECTION_TYPE_CSV: slices}
+        self.packages = {}
+        self.last_gathered_entries = {}
+        self.slice_packages = None
+        self._packages_lock = threading.Lock()
+        self.failed_ships = failed_ships
+        self.saved_entries = None
+
+    def _package_class(self):
+        return SlicePackage
+
+    def _create_package(self):
+        return SlicePackage()
+
+    def _process_package(self, package):
+        package.shipping_successful = not any(collection in self.failed_ships for collection in package.collections)
+
+    def _save_last_gathered_entries(self, last_gathered_entries):
+        self.saved_entries = dict(last_gathered_entries)
+
+
+@pytest.fixture(autouse=True)
+def connection(monkeypatch):
+    monkeypatch.setattr(collector, 'connection', Connection())
+
+
+def gather(tmp_path, slices, failed_ships=()):
+    slice_collector = SliceCollector(tmp_path, slices, failed_ships)
+    slice_collector._gather_csv_collections_concurrently(MAX_GATHER_WORKERS)
+    slice_collector._update_last_gathered_entries()
+
+    return slice_collector.saved_entries
+
+
+def test_pg_functions_created_once(tmp_path):
+    slices = [Slice('job_host_summary', index) for index in range(4)]
+    gather(tmp_path, slices)
+
+    assert [collection.gathered_after for collection in slices] == [([pg_functions()], True)] * 4
+
+
+def test_failed_slice(tmp_path):
+    slices = [Slice('job_host_summary', 0), Slice('job_host_summary', 1, gathering_successful=False),
+              Slice('job_host_summary', 2), Slice('main_jobevent', 0), Slice('main_jobevent', 1),
+              Slice('main_jobevent', 2)]
+
+    assert gather(tmp_path, slices) == {'job_host_summary': day(1), 'main_jobevent': day(3)}
+
+
+def test_failed_ship(tmp_path):
+    slices = [Slice('job_host_summary', index) for index in range(4)]
+
+    assert gather(tmp_path, slices, failed_ships=[slices[2]]) == {'job_host_summary': day(2)}
+
+
+def test_slices_finishing_out_of_order(tmp_path):
+    # The later slices finish first
+    slices = [Slice('job_host_summary', index, delay=(4 - index) * .05) for index in range(4)]
+
+    assert gather(tmp_path, slices) == {'job_host_summary': day(4)}
+
+
+def test_failed_slice_finishing_first(tmp_path):
+    slices = [Slice('job_host_summary', index, delay=(4 - index) * .05) for index in range(3)] + \
+             [Slice('job_host_summary', 3, gathering_successful=False)]
+
+    assert gather(tmp_path, slices) == {'job_host_summary': day(3)}
+
+
+def test_first_slice_failed(tmp_path):
+    slices = [Slice('job_host_summary', 0, gathering_successful=False, delay=.1)] + \
+             [Slice('job_host_summary', index) for index in range(1, 4)]
+
+    assert gather(tmp_path, slices) == {}
+
+
+@pytest.mark.parametrize('workers, expected', [(None, 1), ('0', 1), ('3', 3), (str(MAX_GATHER_WORKERS), MAX_GATHER_WORKERS)])
+def test_gather_workers(monkeypatch, caplog, workers, expected):
+    if workers is not None:
+        monkeypatch.setenv('METRICS_UTILITY_GATHER_WORKERS', workers)
+
+    with caplog.at_level(logging.WARNING):
+        assert Collector.gather_workers() == expected
+    assert not caplog.records
+
+
+def test_gather_workers_limited(monkeypatch, caplog):
+    monkeypatch.setenv('METRICS_UTILITY_GATHER_WORKERS', '64')
+
+    with caplog.at_level(logging.WARNING):
+        assert Collector.gather_workers() == MAX_GATHER_WORKERS
+    assert 'METRICS_UTILITY_GATHER_WORKERS=64' in caplog.text
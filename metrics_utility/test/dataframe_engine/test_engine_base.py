@@ -0,0 +1,81 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from metrics_utility.automation_controller_billing.dataframe_engine.base import Aggregator, Vocabulary, fillna
+
+OPERATIONS = {'first': 'min', 'last': 'max'}
+
+
+def batches(rows, batch_size, seed):
+    rng = np.random.default_rng(seed)
+    dataframe = pd.DataFrame({
+        'organization': rng.choice(['org1', 'org2', None], rows),
+        'host': rng.integers(0, 50, rows),
+        'runs': rng.integers(0, 10, rows),
+        'first': pd.Timestamp('2024-01-01') + pd.to_timedelta(rng.integers(0, 86400, rows), unit='s'),
+    })
+    dataframe['last'] = dataframe['first']
+
+    return dataframe, [dataframe.iloc[start:start + batch_size] for start in range(0, rows, batch_size)]
+
+
+def aggregate(dataframe):
+    return dataframe.groupby(['organization', 'host'], dropna=False).agg(
+        runs=('runs', 'sum'), first=('first', 'min'), last=('last', 'max'))
+
+
+@pytest.mark.parametrize('rows,batch_size', [(1, 1), (1000, 1), (1000, 7), (1000, 1000)])
+def test_aggregator(rows, batch_size):
+    dataframe, dataframe_batches = batches(rows, batch_size, rows + batch_size)
+
+    aggregator = Aggregator(['runs', 'first', 'last'], OPERATIONS)
+    for batch in dataframe_batches:
+        aggregator.add(aggregate(batch))
+
+    # Only log(batches) partial aggregations are kept
+    assert len(aggregator.partials) <= len(dataframe_batches).bit_length()
+    pd.testing.assert_frame_equal(aggregator.result().sort_index(), aggregate(dataframe).sort_index())
+
+
+def test_aggregator_empty():
+    assert Aggregator(['runs'], OPERATIONS).result() is None
+
+
+def test_vocabulary():
+    vocabulary = Vocabulary()
+    first = pd.Series(['b', None, 'a', 'b'])
+    second = pd.Series(['c', 'a', None], dtype='category')
+
+    first_codes = vocabulary.encode(first)
+    second_codes = vocabulary.encode(second)
+
+    # Codes are kept across the batches, missing values are -1
+    assert list(first_codes) == [0, -1, 1, 0]
+    assert list(second_codes) == [2, 1, -1]
+    assert list(vocabulary.decode(first_codes)) == ['b', np.nan, 'a', 'b']
+    assert list(vocabulary.decode(second_codes)) == ['c', 'a', np.nan]
+    # Categories are sorted, as the values are
+    assert list(vocabulary.decode(second_codes).categories) == ['a', 'b', 'c']
+
+
+def test_vocabulary_empty():
+    vocabulary = Vocabulary()
+
+    assert list(vocabulary.encode(pd.Series([], dtype=object))) == []
+    assert list(vocabulary.encode(pd.Series([None, None]))) == [-1, -1]
+    assert len(vocabulary.decode(np.array([], dtype='int64'))) == 0
+
+
+@pytest.mark.parametrize('dtype', [object, 'category'])
+def test_fillna(dtype):
+    series = pd.Series(['a', None, 'b', None], dtype=dtype)
+
+    filled = fillna(series, 'missing')
+    assert list(filled) == ['a', 'missing', 'b', 'missing']
+    assert type(filled.dtype) is type(series.dtype)
+
+    # Filled in by the values of another series, which can be missing too
+    filled = fillna(series, pd.Series(['x', 'y', 'z', None]))
+    assert list(filled.isna()) == [False, False, False, True]
+    assert list(filled[:3]) == ['a', 'y', 'b']
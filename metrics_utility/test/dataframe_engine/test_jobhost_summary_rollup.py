@@ -0,0 +1,105 @@
+import datetime
+import io
+import json
+import os
+import tarfile
+
+from metrics_utility.automation_controller_billing.dataframe_engine.base import build_dataframes
+from metrics_utility.automation_controller_billing.dataframe_engine.dataframe_jobhost_summary_usage \
+    import DataframeJobhostSummaryUsage
+from metrics_utility.automation_controller_billing.extract.extractor_directory import ExtractorDirectory
+
+INSTALL_UUID = '36e809d0-b1ae-4b99-9011-2fa3a3eb196e'
+DATE = datetime.date(2024, 2, 21)
+
+# Host runs of one day, by the time they were modified
+RUNS = [('host1', '06:00:00'), ('host2', '11:59:59.500'), ('host3', '12:00:00.250'), ('host4', '18:00:00')]
+
+
+def slice_name(since, until):
+    return '-'.join(datetime.datetime.fromisoformat(f'2024-02-21 {time}+00:00').strftime('%Y-%m-%d-%H%M%S%z')
+                    for time in (since, until))
+
+
+def write_tarball(ship_path, table, since, until, content, index=0):
+    # Tarball of a gathered slice, the data_collection_status.csv has the exact time range
+    path = os.path.join(ship_path, 'data', DATE.strftime('%Y/%m/%d'),
+                        f'{INSTALL_UUID}-{slice_name(since, until)}-{index}.tar.gz')
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    status = 'collection_start_timestamp,since,until,file_name,status,elapsed\n' \
+             f'2024-02-22 00:00:00+00:00,2024-02-21 {since}+00:00,2024-02-21 {until}+00:00,{table}.csv,ok,0\n'
+    members = [('config.json', json.dumps({'install_uuid': INSTALL_UUID}).encode()),
+               (f'{table}.csv', content.encode()),
+               ('data_collection_status.csv', status.encode())]
+
+    with tarfile.open(path, 'w:gz') as tar:
+        for name, data in members:
+            info = tarfile.TarInfo(f'./{name}')
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+
+
+def in_range(time, since, until):
+    return since <= time < until
+
+
+def write_raw(ship_path, since, until, index=0):
+    rows = [f'{host},2024-02-21 {time}+00,2024-02-21 {time}+00,0,0,2,1,0,0,2024-02-21 05:00:00+00,1,Template,Org\n'
+            for host, time in RUNS if in_range(time, since, until)]
+    write_tarball(ship_path, 'job_host_summary', since, until,
+                  'host_name,created,modified,dark,failures,ok,skipped,ignored,rescued,'
+                  'job_created,job_remote_id,job_template_name,organization_name\n' + ''.join(rows), index)
+
+
+def write_rollup(ship_path, since, until, index=0):
+    rows = [f'Org,Template,{host},,1,3,1,2024-02-21 {time}+00,2024-02-21 {time}+00,2024-02-21 05:00:00+00\n'
+            for host, time in RUNS if in_range(time, since, until)]
+    write_tarball(ship_path, 'job_host_summary_rollup', since, until,
+                  'organization_name,job_template_name,host_name,ansible_host_variable,job_remote_id,'
+                  'task_runs,host_runs,first_automation,last_automation,job_created\n' + ''.join(rows), index)
+
+
+def build(ship_path):
+    extractor = ExtractorDirectory({'ship_path': str(ship_path)})
+    engine = DataframeJobhostSummaryUsage(extractor=extractor, month=DATE, extra_params={})
+    return build_dataframes(extractor, [DATE], [engine])[0]
+
+
+def assert_counted_once(dataframe):
+    runs = dataframe.groupby('host_name', observed=True)[['host_runs', 'task_runs']].sum()
+
+    assert runs.to_dict('index') == {host: {'host_runs': 1, 'task_runs': 3} for host, _ in RUNS}
+
+
+def test_raw_slices(tmp_path):
+    write_raw(tmp_path, '00:00:00', '12:00:00.100')
+    write_raw(tmp_path, '12:00:00.100', '23:59:59.999')
+
+    assert_counted_once(build(tmp_path))
+
+
+def test_rollup_slices_within_raw_slice(tmp_path):
+    write_raw(tmp_path, '00:00:00', '23:59:59.999')
+    write_rollup(tmp_path, '00:00:00', '12:00:00.100')
+    write_rollup(tmp_path, '12:00:00.100', '23:59:59.999')
+
+    assert_counted_once(build(tmp_path))
+
+
+def test_rollup_slice_overlapping_raw_slices(tmp_path):
+    write_raw(tmp_path, '00:00:00', '12:00:00.100')
+    write_raw(tmp_path, '12:00:00.100', '23:59:59.999')
+    # Gathered since a different time than the raw slices, rows of both raw slices are replaced
+    write_rollup(tmp_path, '08:00:00', '23:59:59.999')
+
+    assert_counted_once(build(tmp_path))
+
+
+def test_rollup_slice_within_same_second(tmp_path):
+    # The tarball names of both are rounded down to 12:00:00, the exact ranges tell them apart
+    write_raw(tmp_path, '00:00:00', '12:00:00.100')
+    write_raw(tmp_path, '12:00:00.100', '12:00:00.900', index=1)
+    write_rollup(tmp_path, '12:00:00.100', '23:59:59.999')
+
+    assert_counted_once(build(tmp_path))
@@ -0,0 +1,101 @@
+import datetime
+import io
+import json
+import os
+import tarfile
+
+import pytest
+
+from metrics_utility.automation_controller_billing.dataframe_engine.base import build_dataframes
+from metrics_utility.automation_controller_billing.dataframe_engine.dataframe_jobhost_summary_usage \
+    import DataframeJobhostSummaryUsage
+from metrics_utility.automation_controller_billing.extract.extractor_directory import ExtractorDirectory
+
+INSTALL_UUID = '36e809d0-b1ae-4b99-9011-2fa3a3eb196e'
+DATE = datetime.date(2024, 2, 21)
+HEADER = 'id,created,modified,host_name,dark,failures,ok,skipped,ignored,rescued,' \
+         'job_created,job_remote_id,job_template_name,organization_name\n'
+
+
+def job_host_summary_csv(hosts, job_remote_id=1):
+    rows = [f'{index},2024-02-21 10:00:00+00,2024-02-21 10:00:00+00,{host},0,0,2,1,0,0,'
+            f'2024-02-21 09:59:00+00,{job_remote_id},Template,Org\n' for index, host in enumerate(hosts)]
+    return (HEADER + ''.join(rows)).encode()
+
+
+def write_tarball(ship_path, index, members):
+    path = os.path.join(ship_path, 'data', DATE.strftime('%Y/%m/%d'),
+                        f'{INSTALL_UUID}-2024-02-21-000000+0000-2024-02-22-000000+0000-{index}.tar.gz')
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    with tarfile.open(path, 'w:gz') as tar:
+        for name, content in members:
+            info = tarfile.TarInfo(f'./{name}')
+            info.size = len(content)
+            tar.addfile(info, io.BytesIO(content))
+
+    return path
+
+
+def config_json():
+    return json.dumps({'install_uuid': INSTALL_UUID}).encode()
+
+
+def build(ship_path):
+    extractor = ExtractorDirectory({'ship_path': str(ship_path)})
+    engine = DataframeJobhostSummaryUsage(extractor=extractor, month=DATE, extra_params={})
+    return build_dataframes(extractor, [DATE], [engine])[0]
+
+
+def test_tarballs_are_counted(tmp_path):
+    write_tarball(tmp_path, 0, [('config.json', config_json()),
+                                ('job_host_summary.csv', job_host_summary_csv(['host1', 'host2']))])
+    # Tables stored ahead of the config.json are read too
+    write_tarball(tmp_path, 1, [('job_host_summary.csv', job_host_summary_csv(['host3'], job_remote_id=2)),
+                                ('config.json', config_json())])
+
+    dataframe = build(tmp_path)
+
+    assert sorted(dataframe['host_name']) == ['host1', 'host2', 'host3']
+    assert dataframe['task_runs'].sum() == 9
+
+
+def test_tarball_without_config_is_skipped(tmp_path, caplog):
+    write_tarball(tmp_path, 0, [('config.json', config_json()),
+                                ('job_host_summary.csv', job_host_summary_csv(['host1']))])
+    write_tarball(tmp_path, 1, [('job_host_summary.csv', job_host_summary_csv(['host2'], job_remote_id=2))])
+
+    dataframe = build(tmp_path)
+
+    assert list(dataframe['host_name']) == ['host1']
+    assert 'missing config.json' in caplog.text
+
+
+@pytest.mark.parametrize('truncate_at', [0.5, 0.9])
+def test_truncated_tarball_is_not_counted(tmp_path, caplog, truncate_at):
+    write_tarball(tmp_path, 0, [('config.json', config_json()),
+                                ('job_host_summary.csv', job_host_summary_csv(['host1']))])
+
+    # Large enough to be read in several batches before the truncation is reached
+    hosts = [f'truncated{index}' for index in range(200000)]
+    path = write_tarball(tmp_path, 1, [('config.json', config_json()),
+                                       ('job_host_summary.csv', job_host_summary_csv(hosts, job_remote_id=2))])
+    with open(path, 'rb') as f:
+        content = f.read()
+    with open(path, 'wb') as f:
+        f.write(content[:int(len(content) * truncate_at)])
+
+    dataframe = build(tmp_path)
+
+    assert list(dataframe['host_name']) == ['host1']
+    assert dataframe['host_runs'].sum() == 1
+    assert f'Extracting {path} failed' in caplog.text
+
+
+def test_iter_dates_tarballs_raises_on_missing_config(tmp_path):
+    write_tarball(tmp_path, 0, [('job_host_summary.csv', job_host_summary_csv(['host1']))])
+    extractor = ExtractorDirectory({'ship_path': str(tmp_path)})
+
+    (_, batches), = list(extractor.iter_dates_tarballs([DATE]))
+    with pytest.raises(Exception, match='missing config.json'):
+        list(batches)
@@ -0,0 +1,59 @@
+import io
+import logging
+import tarfile
+
+import pytest
+
+from metrics_utility.automation_controller_billing.package.package_directory import PackageDirectory
+from metrics_utility.automation_controller_billing.package.package_s3 import PackageS3
+
+
+class Collection:
+    # Collection of one file stored into the tarball
+    def __init__(self, filename):
+        self.filename = filename
+        self.key = filename.split('.')[0]
+
+    def add_to_tar(self, tar):
+        info = tarfile.TarInfo(f'./{self.filename}')
+        info.size = 2
+        tar.addfile(info, io.BytesIO(b'{}'))
+
+    def add_collection(self, collection):
+        pass
+
+    def data_size(self):
+        return 2
+
+    def gather(self, max_data_size):
+        pass
+
+    def is_empty(self):
+        return False
+
+
+class Collector:
+    def __init__(self, tmp_dir):
+        self.tmp_dir = tmp_dir
+        self.logger = logging.getLogger(__name__)
+        self.collections = {'config': Collection('config.json')}
+
+    def collection_data_status_class(self):
+        return lambda collector, package: Collection('data_collection_status.csv')
+
+    def collection_manifest_class(self):
+        return lambda collector: Collection('manifest.json')
+
+
+@pytest.mark.parametrize('package_class', [PackageDirectory, PackageS3])
+def test_config_is_the_first_member(tmp_path, package_class):
+    package = package_class(Collector(tmp_path / 'collector'))
+    package._tarname_base = lambda: 'tarball'
+    package.add_collection(Collection('job_host_summary.csv'))
+
+    assert package.make_tgz()
+
+    with tarfile.open(package.tar_path) as tar:
+        assert tar.getnames() == ['./config.json', './job_host_summary.csv', './data_collection_status.csv',
+                                  './manifest.json']
+    assert package.tar_path.endswith('tarball-0.tar.gz')
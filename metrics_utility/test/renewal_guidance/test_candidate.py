@@ -1,4 +1,112 @@
-# TODO test dedup on various combination of inventory
+import numpy as np
+import pandas as pd
+
+from metrics_utility.automation_controller_billing.report.renewal_guidance.dedup import Dedup
+
+
+def host_metrics(hosts):
+    automation = pd.Timestamp('2024-01-01')
+    dataframe = pd.DataFrame(hosts, columns=['hostname', 'ansible_host_variable', 'ansible_product_serial',
+                                             'ansible_machine_id'])
+    dataframe['first_automation'] = automation
+    dataframe['last_automation'] = [automation + pd.Timedelta(days=index) for index in range(len(dataframe))]
+    dataframe['automated_counter'] = 1
+    dataframe['deleted_counter'] = 0
+    dataframe['last_deleted'] = pd.NaT
+    dataframe['deleted'] = False
+
+    return dataframe
+
+
+def connected_components(dataframe):
+    # Reference grouping, records are merged one by one with every group they share a value with
+    groups = []
+    for index, row in dataframe[Dedup.DEDUP_COLUMNS].iterrows():
+        values = {(column, value) for column, value in row.items() if pd.notna(value)}
+        linked = [group for group in groups if group[1] & values]
+        groups = [group for group in groups if not group[1] & values]
+        groups.append(({index}.union(*[group[0] for group in linked]), values.union(*[group[1] for group in linked])))
+
+    labels = np.empty(len(dataframe), dtype='int64')
+    for rows, _ in groups:
+        labels[list(rows)] = min(rows)
+    return labels
+
+
+def test_dedup_transitive_merge():
+    dataframe = host_metrics([
+        # Linked by the serial, the machine id and the host variable one after another
+        ['host1', None, 'serial1', None],
+        ['host2', None, 'serial1', 'machine1'],
+        ['host3', 'variable1', None, 'machine1'],
+        ['host4', 'variable1', 'NA', ''],
+        ['host5', '', 'serial2', 'machine2'],
+        # Linked by the host name only, to the group of host1 to host4
+        ['host1', None, None, None],
+    ])
+
+    deduped = Dedup(dataframe, {}).run_deduplication()
+
+    assert list(deduped['hostname']) == ['host1', 'host5']
+    assert list(deduped['hostnames']) == ['host1, host2, host3, host4', 'host5']
+    assert list(deduped['hostmetric_record_count']) == [4, 1]
+    assert list(deduped['ansible_product_serials']) == ['serial1', 'serial2']
+    assert list(deduped['ansible_machine_ids']) == ['machine1', 'machine2']
+    assert list(deduped['ansible_host_variables']) == ['variable1', '']
+    assert list(deduped['automated_counter']) == [5, 1]
+
+
+def test_dedup_all_missing_columns():
+    dataframe = host_metrics([
+        ['host1', None, 'NA', ''],
+        ['host2', '', None, 'NA'],
+        ['host1', None, '', None],
+    ])
+
+    deduped = Dedup(dataframe, {}).run_deduplication()
+
+    assert list(deduped['hostnames']) == ['host1', 'host2']
+    for column in ['ansible_host_variables', 'ansible_product_serials', 'ansible_machine_ids']:
+        assert list(deduped[column]) == ['', '']
+
+
+def test_dedup_empty():
+    deduped = Dedup(host_metrics([]), {}).run_deduplication()
+
+    assert deduped.empty
+    assert list(deduped.columns) == Dedup.output_columns()
+
+
+def test_connected_components():
+    rng = np.random.default_rng(0)
+    rows = 300
+
+    def column(prefix):
+        values = pd.Series([f'{prefix}{value}' for value in rng.integers(0, rows // 2, rows)], dtype=object)
+        values[rng.random(rows) < .6] = None
+        return values
+
+    dataframe = pd.DataFrame({column_name: column(column_name) for column_name in Dedup.DEDUP_COLUMNS})
+
+    np.testing.assert_array_equal(Dedup(dataframe, {}).connected_components(dataframe),
+                                  connected_components(dataframe))
+
+
+def test_connected_components_chain():
+    # Record k shares the serial with record k + 1 when k is even, the machine id otherwise
+    rows = 1001
+    dataframe = pd.DataFrame({
+        'hostname': [f'host{index}' for index in range(rows)],
+        'ansible_host_variable': None,
+        'ansible_product_serial': [f'serial{(index + 1) // 2}' for index in range(rows)],
+        'ansible_machine_id': [f'machine{index // 2}' for index in range(rows)],
+    }).iloc[np.random.default_rng(0).permutation(rows)].reset_index(drop=True)
+
+    components, rounds = Dedup(dataframe, {}).connected_components(dataframe, return_rounds=True)
+    assert (components == 0).all()
+    # The rounds grow with the log of the group size, not with the size
+    assert 0 < rounds <= 20
+
 
 
 # HOST 1
@@ -0,0 +1,70 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from metrics_utility.automation_controller_billing.report.report_renewal_guidance import ReportRenewalGuidance
+
+START_DATE = pd.Timestamp('2024-01-01')
+
+
+def count_hosts_in_windows(hosts, start_date, window_days, windows):
+    # Previous implementation, the hosts of every window filtered one by one
+    counts = []
+    for index in range(windows):
+        window_start = start_date + pd.Timedelta(days=index)
+        window_end = window_start + pd.Timedelta(days=window_days) - pd.Timedelta(microseconds=1)
+        filtered = hosts[(hosts['last_automation'] >= window_start) & (hosts['first_automation'] <= window_end)]
+        counts.append(filtered['hostname'].nunique())
+
+    return np.array(counts, dtype='int64')
+
+
+def host_metrics(rows, hostnames, seed):
+    rng = np.random.default_rng(seed)
+    first_automation = START_DATE + pd.to_timedelta(rng.integers(-30 * 86400, 120 * 86400, rows), unit='s')
+    hosts = pd.DataFrame({
+        'hostname': rng.choice([f'host{index}' for index in range(hostnames)], rows),
+        'first_automation': first_automation,
+        'last_automation': first_automation + pd.to_timedelta(rng.integers(0, 60 * 86400, rows), unit='s'),
+    })
+
+    return hosts.sort_values(['hostname', 'first_automation'], kind='stable')
+
+
+@pytest.mark.parametrize('seed', range(5))
+@pytest.mark.parametrize('window_days', [1, 7, 30, 400])
+def test_count_hosts_in_windows(seed, window_days):
+    # Duplicate host names with overlapping and disjoint automations
+    hosts = host_metrics(500, 100, seed)
+
+    np.testing.assert_array_equal(ReportRenewalGuidance.count_hosts_in_windows(hosts, START_DATE, window_days, 90),
+                                  count_hosts_in_windows(hosts, START_DATE, window_days, 90))
+
+
+def test_count_hosts_in_windows_on_window_bounds():
+    hosts = pd.DataFrame({
+        'hostname': ['host1', 'host1', 'host2', 'host3'],
+        'first_automation': pd.to_datetime(['2024-01-02', '2024-01-05', '2024-01-03 23:59:59.999999',
+                                            '2023-12-01'], format='ISO8601'),
+        'last_automation': pd.to_datetime(['2024-01-02', '2024-01-06', '2024-01-04', '2023-12-31 23:59:59.999999'],
+                                          format='ISO8601'),
+    })
+
+    counts = ReportRenewalGuidance.count_hosts_in_windows(hosts, START_DATE, 2, 8)
+
+    np.testing.assert_array_equal(counts, count_hosts_in_windows(hosts, START_DATE, 2, 8))
+    np.testing.assert_array_equal(counts, [1, 2, 1, 2, 1, 1, 0, 0])
+
+
+def test_count_hosts_in_windows_single_row():
+    hosts = host_metrics(1, 1, 0)
+
+    np.testing.assert_array_equal(ReportRenewalGuidance.count_hosts_in_windows(hosts, START_DATE, 30, 90),
+                                  count_hosts_in_windows(hosts, START_DATE, 30, 90))
+
+
+def test_count_hosts_in_windows_empty():
+    hosts = host_metrics(0, 1, 0)
+
+    np.testing.assert_array_equal(ReportRenewalGuidance.count_hosts_in_windows(hosts, START_DATE, 30, 90),
+                                  np.zeros(90, dtype='int64'))
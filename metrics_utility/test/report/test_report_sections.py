@@ -0,0 +1,92 @@
+import os
+
+import pandas as pd
+import pytest
+
+from metrics_utility.automation_controller_billing.report.report_ccsp_v2 import ReportCCSPv2
+from metrics_utility.automation_controller_billing.report_saver.report_saver_directory import ReportSaverDirectory
+from metrics_utility.exceptions import BadReportSection
+
+ORGANIZATION_NAMES = ['Org, C', 'Org C', 'Jobs', 'Managed nodes', '!!!', '&&&']
+
+
+def extra_params(**params):
+    extra_params = {key: 'Test' for key in ('report_sku', 'report_sku_description', 'report_h1_heading',
+                                            'report_company_name', 'report_email', 'report_rhn_login',
+                                            'report_po_number', 'report_end_user_company_name',
+                                            'report_end_user_company_city', 'report_end_user_company_state',
+                                            'report_end_user_company_country')}
+    extra_params.update(price_per_node=11.55, report_organization_filter=None, **params)
+
+    return extra_params
+
+
+def job_host_summary():
+    created = pd.Timestamp('2024-05-01 10:00:00')
+    return pd.DataFrame({
+        'organization_name': pd.Categorical(ORGANIZATION_NAMES),
+        'host_name': pd.Categorical([f'host{index}' for index in range(len(ORGANIZATION_NAMES))]),
+        'job_template_name': 'Template',
+        'job_remote_id': 1,
+        'install_uuid': 'uuid',
+        'host_runs': 1,
+        'task_runs': 3,
+        'first_automation': created,
+        'last_automation': created,
+        'job_created': created,
+    })
+
+
+def test_organization_section_names():
+    assert ReportCCSPv2.organization_section_names(sorted(ORGANIZATION_NAMES)) == {
+        '!!!': 'organizations/organization',
+        '&&&': 'organizations/organization_2',
+        'Jobs': 'organizations/jobs',
+        'Managed nodes': 'organizations/managed_nodes',
+        'Org C': 'organizations/org_c',
+        'Org, C': 'organizations/org_c_2',
+    }
+
+
+def test_exported_sections_are_unique(monkeypatch):
+    monkeypatch.setenv('METRICS_UTILITY_OPTIONAL_CCSP_REPORT_SHEETS',
+                       'jobs,managed_nodes,usage_by_organizations,managed_nodes_by_organizations')
+    report = ReportCCSPv2(dataframe=(job_host_summary(), None), report_period='2024-05',
+                          extra_params=extra_params(opt_export=['csv'], opt_export_only=True))
+    report.build_spreadsheet()
+
+    assert sorted(report.sidecar_dataframes) == [
+        'jobs', 'managed_nodes', 'organizations/jobs', 'organizations/managed_nodes', 'organizations/org_c',
+        'organizations/org_c_2', 'organizations/organization', 'organizations/organization_2',
+        'usage_by_organizations']
+    assert list(report.sidecar_dataframes['organizations/org_c_2']['Host name']) == ['host0']
+    assert list(report.sidecar_dataframes['organizations/jobs']['Host name']) == ['host2']
+
+
+def test_colliding_sections_are_refused():
+    report = ReportCCSPv2(dataframe=(job_host_summary(), None), report_period='2024-05',
+                          extra_params=extra_params(opt_export=['csv']))
+    report._export_section('jobs', pd.DataFrame({'a': [1]}))
+
+    with pytest.raises(BadReportSection):
+        report._export_section('jobs', pd.DataFrame({'a': [2]}))
+    with pytest.raises(BadReportSection):
+        report._export_section(report.section_name('!!!'), pd.DataFrame({'a': [2]}))
+
+
+def test_export_only_report_exist(tmp_path):
+    report_path = str(tmp_path / 'CCSPv2-2024-05.xlsx')
+    saver = ReportSaverDirectory(extra_params(opt_export=['csv'], opt_export_only=True,
+                                              report_spreadsheet_destination_path=report_path))
+    assert not saver.report_exist()
+
+    # Sections too long for a sheet, saved next to the report, are not the export
+    with open(report_path, 'w'):
+        pass
+    assert saver.save_dataframe('managed_nodes', pd.DataFrame({'a': [1]}))
+    assert not saver.report_exist()
+
+    os.remove(report_path)
+    assert saver.save_dataframe('organizations/org_c', pd.DataFrame({'a': [1]}))
+    assert saver.report_exist()
+    assert os.path.exists(tmp_path / 'CCSPv2-2024-05' / 'organizations' / 'org_c.csv')